@@ -0,0 +1,399 @@
+import argparse
+import sqlite3
+import sys
+import time
+
+# Classes of test outcomes (same split as the stats of APK Tester)
+OUTCOME_CLASSES = ("launched", "crashed", "not_installed", "error")
+CRASH_OUTCOMES = ("Error: App crashed.", "Error: App is not running.")
+
+# Rows read at once while the aggregates are rebuilt
+BATCH_SIZE = 100_000
+
+# Time that other workers wait for the first fill of the tables (about 20 seconds per million rows)
+CREATE_TIMEOUT_MS = 30 * 60 * 1000
+
+# Normalized native libraries and summary tables, updated in the same transaction as every insert
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS apk_native_libs (" +
+        "apk_id INTEGER," +
+        "abi TEXT," +
+        "lib TEXT)",
+    "CREATE INDEX IF NOT EXISTS apk_native_libs_apk_id ON apk_native_libs (apk_id)",
+    "CREATE INDEX IF NOT EXISTS apk_native_libs_lib ON apk_native_libs (lib, abi)",
+    "CREATE TABLE IF NOT EXISTS test_outcomes (" +
+        "target_sdk INTEGER," +
+        "native_libs INTEGER," + # 1 if the app has native libraries
+        "apps INTEGER DEFAULT 0," +
+        "launched INTEGER DEFAULT 0," +
+        "crashed INTEGER DEFAULT 0," +
+        "not_installed INTEGER DEFAULT 0," +
+        "error INTEGER DEFAULT 0," +
+        "PRIMARY KEY (target_sdk, native_libs))",
+    "CREATE TABLE IF NOT EXISTS abi_outcomes (" +
+        "abi TEXT PRIMARY KEY," +
+        "apps INTEGER DEFAULT 0," +
+        "launched INTEGER DEFAULT 0," +
+        "crashed INTEGER DEFAULT 0," +
+        "not_installed INTEGER DEFAULT 0," +
+        "error INTEGER DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS native_lib_outcomes (" +
+        "abi TEXT," +
+        "lib TEXT," +
+        "apps INTEGER DEFAULT 0," +
+        "launched INTEGER DEFAULT 0," +
+        "crashed INTEGER DEFAULT 0," +
+        "not_installed INTEGER DEFAULT 0," +
+        "error INTEGER DEFAULT 0," +
+        "PRIMARY KEY (abi, lib))",
+    "CREATE TABLE IF NOT EXISTS label_by_sdk (" +
+        "target_sdk INTEGER," +
+        "scan_label TEXT," +
+        "apps INTEGER DEFAULT 0," +
+        "PRIMARY KEY (target_sdk, scan_label))",
+]
+
+# Created last: the other tables exist if it exists
+MARKER_TABLE = "label_by_sdk"
+
+def table_exists(cursor, name: str) -> bool:
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def outcome_class(outcome: str | None) -> str:
+    """
+    Returns:
+        outcome_class (str): Class of a test outcome (one of OUTCOME_CLASSES).
+    """
+
+    if outcome == "Launched successfully":
+        return "launched"
+    if outcome in CRASH_OUTCOMES:
+        return "crashed"
+    if outcome is None or outcome.startswith("ERROR"): # Program error, the APK is tested again
+        return "error"
+    return "not_installed"
+
+def target_sdk(sdk_version: str | None, min_sdk_version: str | None) -> int:
+    """
+    Returns:
+        target_sdk (int): Target SDK version of the app, the minimum SDK version if the target
+            is missing (as Android does), 0 if both are missing.
+    """
+
+    for value in (sdk_version, min_sdk_version):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+def parse_native_libs(native_libs: str | None) -> list[tuple[str, str]]:
+    """
+    Splits the 'native_libs' column of 'apk_info' ('lib/<abi>/<name>.so, ...').
+
+    Returns:
+        libs (list[tuple[str, str]]): Distinct (ABI, library name) pairs.
+    """
+
+    libs = []
+    for entry in (native_libs or "").split(", "):
+        parts = entry.split("/", 2)
+        if len(parts) == 3 and parts[0] == "lib" and (parts[1], parts[2]) not in libs:
+            libs.append((parts[1], parts[2]))
+    return libs
+
+def add_outcomes(cursor, table: str, keys: tuple[str, ...], rows: list[tuple]):
+    """
+    Adds outcomes to a summary table.
+
+    Args:
+        cursor (any): Database cursor
+        table (str): Summary table.
+        keys (tuple[str, ...]): Key columns of the table.
+        rows (list[tuple]): Key values followed by the counts of 'apps' and of every outcome class.
+    """
+
+    columns = keys + ("apps",) + OUTCOME_CLASSES
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in columns[len(keys):])
+    cursor.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) " +
+        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}", rows)
+
+def outcome_counts(outcome: str | None) -> tuple[int, ...]:
+    """
+    Returns:
+        counts (tuple[int, ...]): Count of 'apps' and of every outcome class for one app.
+    """
+
+    result = outcome_class(outcome)
+    return (1,) + tuple(int(result == name) for name in OUTCOME_CLASSES)
+
+def add_label(cursor, rows: list[tuple[int, str, int]]):
+    """
+    Adds (target SDK, scan label, count) rows to 'label_by_sdk' (negative counts remove apps).
+    """
+
+    cursor.executemany(
+        "INSERT INTO label_by_sdk (target_sdk, scan_label, apps) VALUES (?, ?, ?) " +
+        "ON CONFLICT (target_sdk, scan_label) DO UPDATE SET apps = apps + excluded.apps", rows)
+
+def latest_label(cursor, sha256_hash: str, before_id: int | None = None) -> str | None:
+    """
+    Returns:
+        One_of_Two:
+            - **scan_label** (str): Label of the latest scan of the hash (before the scan 'before_id').
+            - **None**: If the hash wasn't scanned.
+    """
+
+    if not table_exists(cursor, "scan_results"):
+        return None
+    row = cursor.execute("SELECT scan_label FROM scan_results WHERE sha256_hash = ? AND id < ? ORDER BY id DESC LIMIT 1",
+                         (sha256_hash, before_id if before_id is not None else sys.maxsize)).fetchone()
+    return row[0] if row else None
+
+def record_test(cursor, apk_id: int, data: dict):
+    """
+    Updates the native libraries and summary tables after a row is inserted in 'apk_info'
+    (in the same transaction).
+
+    Args:
+        cursor (any): Database cursor
+        apk_id (int): ID of the new row.
+        data (dict): The record
+    """
+
+    sdk = target_sdk(data["sdk_version"], data["min_sdk_version"])
+    libs = parse_native_libs(data["native_libs"])
+    counts = outcome_counts(data["outcome"])
+
+    cursor.executemany("INSERT INTO apk_native_libs (apk_id, abi, lib) VALUES (?, ?, ?)",
+                       [(apk_id, abi, lib) for abi, lib in libs])
+    add_outcomes(cursor, "test_outcomes", ("target_sdk", "native_libs"), [(sdk, int(bool(libs))) + counts])
+    add_outcomes(cursor, "abi_outcomes", ("abi",), [(abi,) + counts for abi in dict.fromkeys(abi for abi, _ in libs)])
+    add_outcomes(cursor, "native_lib_outcomes", ("abi", "lib"), [(abi, lib) + counts for abi, lib in libs])
+
+    label = latest_label(cursor, data["sha256_hash"])
+    if label is not None:
+        add_label(cursor, [(sdk, label, 1)])
+
+def record_scan(cursor, scan_id: int, data: dict):
+    """
+    Updates 'label_by_sdk' after a row is inserted in 'scan_results' (in the same transaction).
+    The latest scan of a hash gives the label of the tested apps with this hash.
+
+    Args:
+        cursor (any): Database cursor
+        scan_id (int): ID of the new row.
+        data (dict): The record
+    """
+
+    if not table_exists(cursor, "apk_info"):
+        return
+
+    previous = latest_label(cursor, data["sha256_hash"], scan_id)
+    rows = []
+    for sdk_version, min_sdk_version in cursor.execute("SELECT sdk_version, min_sdk_version FROM apk_info WHERE sha256_hash = ?",
+                                                       (data["sha256_hash"],)).fetchall():
+        sdk = target_sdk(sdk_version, min_sdk_version)
+        if previous is not None:
+            rows.append((sdk, previous, -1))
+        rows.append((sdk, data["scan_label"], 1))
+    add_label(cursor, rows)
+
+def record_relabel(cursor, scan_id: int, sha256_hash: str, old_label: str, new_label: str):
+    """
+    Updates 'apk_info' and 'label_by_sdk' after the label of a row of 'scan_results' is changed
+    (in the same transaction). Only the latest scan of a hash gives the label of the tested apps.
+
+    Args:
+        cursor (any): Database cursor
+        scan_id (int): ID of the changed row.
+        sha256_hash (str): SHA-256 hash of the file
+        old_label (str): Label before the change.
+        new_label (str): Label after the change.
+    """
+
+    if not table_exists(cursor, "apk_info"):
+        return
+    if cursor.execute("SELECT 1 FROM scan_results WHERE sha256_hash = ? AND id > ? LIMIT 1", (sha256_hash, scan_id)).fetchone():
+        return
+
+    rows = []
+    for sdk_version, min_sdk_version in cursor.execute("SELECT sdk_version, min_sdk_version FROM apk_info WHERE sha256_hash = ?",
+                                                       (sha256_hash,)).fetchall():
+        sdk = target_sdk(sdk_version, min_sdk_version)
+        rows += [(sdk, old_label, -1), (sdk, new_label, 1)]
+    add_label(cursor, rows)
+
+    # Copy of the label in the test results (set once the app is both tested and scanned)
+    cursor.execute("UPDATE apk_info SET scan_label = ? WHERE sha256_hash = ? AND scan_label != 'PENDING'", (new_label, sha256_hash))
+
+def rebuild(cursor):
+    """
+    Recomputes the native libraries and summary tables from 'apk_info' and 'scan_results'
+    (databases created before the aggregates were stored). The caller holds the write lock.
+    """
+
+    for table in ("apk_native_libs", "test_outcomes", "abi_outcomes", "native_lib_outcomes", "label_by_sdk"):
+        cursor.execute(f"DELETE FROM {table}")
+    if not table_exists(cursor, "apk_info"):
+        return
+
+    label_query = ("(SELECT scan_label FROM scan_results WHERE scan_results.sha256_hash = apk_info.sha256_hash ORDER BY id DESC LIMIT 1)"
+                   if table_exists(cursor, "scan_results") else "NULL")
+    rows = cursor.connection.execute("SELECT id, sdk_version, min_sdk_version, native_libs, outcome, " +
+                                     f"{label_query} FROM apk_info")
+    summaries = {"test_outcomes": {}, "abi_outcomes": {}, "native_lib_outcomes": {}}
+    labels = {}
+    while batch := rows.fetchmany(BATCH_SIZE):
+        native_libs = []
+        for apk_id, sdk_version, min_sdk_version, libs, outcome, label in batch:
+            sdk = target_sdk(sdk_version, min_sdk_version)
+            libs = parse_native_libs(libs)
+            counts = outcome_counts(outcome)
+            native_libs.extend((apk_id, abi, lib) for abi, lib in libs)
+
+            keys = [("test_outcomes", (sdk, int(bool(libs))))]
+            keys += [("abi_outcomes", (abi,)) for abi in dict.fromkeys(abi for abi, _ in libs)]
+            keys += [("native_lib_outcomes", pair) for pair in libs]
+            for table, key in keys:
+                total = summaries[table].get(key, (0,) * len(counts))
+                summaries[table][key] = tuple(a + b for a, b in zip(total, counts))
+            if label is not None:
+                labels[(sdk, label)] = labels.get((sdk, label), 0) + 1
+        cursor.executemany("INSERT INTO apk_native_libs (apk_id, abi, lib) VALUES (?, ?, ?)", native_libs)
+
+    add_outcomes(cursor, "test_outcomes", ("target_sdk", "native_libs"), [key + counts for key, counts in summaries["test_outcomes"].items()])
+    add_outcomes(cursor, "abi_outcomes", ("abi",), [key + counts for key, counts in summaries["abi_outcomes"].items()])
+    add_outcomes(cursor, "native_lib_outcomes", ("abi", "lib"), [key + counts for key, counts in summaries["native_lib_outcomes"].items()])
+    add_label(cursor, [key + (count,) for key, count in labels.items()])
+
+def create_tables(cursor):
+    """
+    Creates the native libraries and summary tables if they don't exist, and fills them
+    from the rows already in the database.
+
+    Args:
+        cursor (any): Database cursor
+    """
+
+    if table_exists(cursor, MARKER_TABLE):
+        return
+
+    # Several workers may start at once: only the first one creates and fills the tables,
+    # the others wait for it
+    connection = cursor.connection
+    connection.commit()
+    busy_timeout = cursor.execute("PRAGMA busy_timeout").fetchone()[0]
+    cursor.execute(f"PRAGMA busy_timeout = {CREATE_TIMEOUT_MS}")
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        if not table_exists(cursor, MARKER_TABLE):
+            for statement in TABLES:
+                cursor.execute(statement)
+            rebuild(cursor)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        cursor.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+# ----- Reports -----
+def percent(count: int, total: int) -> str:
+    return f"{count / total:.1%}" if total else "-"
+
+def print_table(header: tuple, rows: list[tuple]):
+    """
+    Prints rows as aligned columns (first column to the left, others to the right).
+    """
+
+    rows = [tuple(str(value) for value in row) for row in rows]
+    widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(str(value).ljust(width) if i == 0 else str(value).rjust(width)
+                        for i, (value, width) in enumerate(zip(row, widths))))
+
+def outcome_row(name, apps: int, launched: int, crashed: int, not_installed: int, error: int) -> tuple:
+    """
+    Returns:
+        row (tuple): Name, number of apps and shares of every outcome. Program errors are not
+            counted in the shares (the APKs are tested again).
+    """
+
+    tested = apps - error
+    return (name, apps, percent(launched, tested), percent(crashed, tested), percent(not_installed, tested), error)
+
+OUTCOME_HEADER = ("apps", "launched", "crashed", "not installed", "errors")
+
+def report_crash_rate(cursor):
+    rows = cursor.execute("SELECT target_sdk, SUM(apps), SUM(launched), SUM(crashed), SUM(not_installed), SUM(error) " +
+                          "FROM test_outcomes GROUP BY target_sdk HAVING SUM(apps) > 0 ORDER BY target_sdk").fetchall()
+    print_table(("target SDK",) + OUTCOME_HEADER, [outcome_row(sdk or "unknown", *counts) for sdk, *counts in rows])
+
+def report_native_libs(cursor, abi: str | None, top: int):
+    rows = cursor.execute("SELECT native_libs, SUM(apps), SUM(launched), SUM(crashed), SUM(not_installed), SUM(error) " +
+                          "FROM test_outcomes GROUP BY native_libs ORDER BY native_libs").fetchall()
+    print_table(("native libs",) + OUTCOME_HEADER, [outcome_row("yes" if libs else "no", *counts) for libs, *counts in rows])
+
+    print()
+    rows = cursor.execute("SELECT abi, apps, launched, crashed, not_installed, error FROM abi_outcomes " +
+                          "WHERE apps > 0 ORDER BY apps DESC").fetchall()
+    print_table(("ABI",) + OUTCOME_HEADER, [outcome_row(*row) for row in rows])
+
+    print()
+    rows = cursor.execute("SELECT abi, lib, apps, launched, crashed, not_installed, error FROM native_lib_outcomes " +
+                          "WHERE apps > 0 AND (? IS NULL OR abi = ?) ORDER BY apps DESC LIMIT ?", (abi, abi, top)).fetchall()
+    print_table(("library",) + OUTCOME_HEADER, [outcome_row(f"{abi}/{lib}", *counts) for abi, lib, *counts in rows])
+
+def report_labels(cursor):
+    labels = {}
+    for sdk, label, apps in cursor.execute("SELECT target_sdk, scan_label, apps FROM label_by_sdk WHERE apps > 0"):
+        labels.setdefault(sdk, {})[label] = apps
+    tested = dict(cursor.execute("SELECT target_sdk, SUM(apps) FROM test_outcomes GROUP BY target_sdk"))
+
+    names = ["BENIGN", "SUSPICIOUS", "MALICIOUS"]
+    names += sorted({label for counts in labels.values() for label in counts} - set(names))
+    rows = []
+    for sdk in sorted(set(tested) | set(labels)):
+        counts = labels.get(sdk, {})
+        scanned = sum(counts.values())
+        rows.append((sdk or "unknown",) + tuple(f"{counts.get(name, 0)} ({percent(counts.get(name, 0), scanned)})" for name in names) +
+                    (max(0, tested.get(sdk, 0) - scanned),))
+    print_table(("target SDK",) + tuple(name.lower() for name in names) + ("not scanned",), rows)
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Prints reports of 'results.db' from its summary tables.")
+    parser.add_argument("--db", default = "results.db")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    commands.add_parser("crash-rate", help = "Outcomes of tested apps by target SDK.")
+    native_libs = commands.add_parser("native-libs", help = "Outcomes of apps with and without native libraries, by ABI and by library.")
+    native_libs.add_argument("--abi", help = "Only libraries of this ABI (e.g. arm64-v8a).")
+    native_libs.add_argument("--top", type = int, default = 20, help = "Number of libraries (most used first).")
+    commands.add_parser("labels", help = "Scan labels of tested apps by target SDK.")
+    commands.add_parser("rebuild", help = "Recomputes the summary tables from all rows.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    connection = sqlite3.connect(args.db)
+    cursor = connection.cursor()
+    create_tables(cursor)
+
+    if args.command == "rebuild":
+        cursor.execute("BEGIN IMMEDIATE")
+        rebuild(cursor)
+        connection.commit()
+    elif args.command == "crash-rate":
+        report_crash_rate(cursor)
+    elif args.command == "native-libs":
+        report_native_libs(cursor, args.abi, args.top)
+    else:
+        report_labels(cursor)
+
+    connection.close()
+    print(f"\nDone in {(time.time() - start_time) * 1000:.0f} ms.", file = sys.stderr)
@@ -1,8 +1,11 @@
 import subprocess as sp
 import sys
 import os
+import shlex
 from time import sleep
-from config import ADB_PATH
+from metrics import stage_timer
+from emu_manager import adb, take_apk_push, REMOTE_APK_PATH
+from errors import TransientError
 
 def check_apk_exists(apk_path: str):
     """
@@ -10,149 +13,315 @@ def check_apk_exists(apk_path: str):
 
     Args:
         apk_path (str): Path to the APK file.
+    Raises:
+        TransientError: If the file is missing (e.g. removed from tmpfs), it is downloaded again later.
     """
 
     if not os.path.isfile(apk_path):
-        connection.send(("current", f"ERROR: APK file not found at {apk_path}."))
-        sys.exit(1)
+        raise TransientError(f"ERROR: APK file not found at {apk_path}.")
 
 def check_emulator():
     """
     Checks if the emulator is running.
+
+    Raises:
+        TransientError: If the emulator isn't running (e.g. it stopped during the boot).
     """
 
     try:
-        result = sp.run([ADB_PATH, "get-state"], stdout = sp.PIPE, stderr = sp.STDOUT, text = True) # "adb get-state"
-        if result.stdout.strip() != "device": # "device" means the emulator is running
-            connection.send(("current", "ERROR: No running emulator detected."))
-            sys.exit(1)
-    except sp.CalledProcessError as e:
-        connection.send(("current", f"ERROR: Failed to execute 'adb get-state' for checking the emulator: {e.output}"))
-        sys.exit(1)
-    except Exception as e:
-        connection.send(("current", f"ERROR: Unexpected failure while checking the emulator: {e}"))
+        result = sp.run(adb("get-state"), stdout = sp.PIPE, stderr = sp.STDOUT, text = True) # "adb get-state"
+    except OSError as e: # ADB can't be run (ADB_PATH)
+        connection.send(("current", f"ERROR: Failed to execute 'adb get-state' for checking the emulator: {e}"))
         sys.exit(1)
 
+    if result.stdout.strip() != "device": # "device" means the emulator is running
+        raise TransientError("ERROR: No running emulator detected.")
+
 def install_apk(apk_path: str):
     """
-    Installs the APK on the emulator.
+    Installs the APK on the emulator. If the APK was pushed while the emulator booted,
+    it is installed from the copy on the emulator ('pm install').
 
     Args:
         apk_path (str): Path to the APK file.
+    Raises:
+        RuntimeError: If the APK can't be installed.
     """
 
+    push = take_apk_push()
+    if push is not None:
+        output, _ = push.communicate() # Waits for the end of the copy
+        if push.returncode == 0:
+            install_pushed_apk()
+            return
+        connection.send(("current", f"Warning: Failed to push the APK during the boot: {output.strip()}"))
+
     try:
-        sp.run([ADB_PATH, "install", "-r", apk_path], stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
+        sp.run(adb("install", "-r", apk_path), stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
     except sp.CalledProcessError as e:
         connection.send(("current", f"Error: Failed to execute 'adb install'.\nReason: {e.output}"))
         raise RuntimeError(f"Error: App install failed. Reason:\n{e.output}")
-    except Exception as e:
+    except OSError as e: # ADB can't be run (ADB_PATH)
         connection.send(("current", f"ERROR: Unexpected failure while installing the APK: {e}"))
         sys.exit(1)
 
-def launch_app(package_name: str):
+def install_pushed_apk():
     """
-    Launches the installed app on the emulator.
-    
-    Args:
-        package_name (str): Package name of the APK.
+    Installs the copy of the APK on the emulator with 'pm install', then removes the copy.
     """
-    
+
     try:
-        # Launches the app
-        sp.run([ADB_PATH, "shell", "monkey", "-p", package_name, "-c", "android.intent.category.LAUNCHER", "1"], stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
-    except sp.CalledProcessError as e:
-        connection.send(("current", f"ERROR: Failed to execute 'adb shell monkey': {e.output}"))
-        sys.exit(1)
-    except Exception as e:
-        connection.send(("current", f"ERROR: Unexpected failure while launching the app: {e}"))
+        # 'pm install' of old Android versions exits with 0 on failures, so the output is checked
+        result = sp.run(adb("shell", f"pm install -r {REMOTE_APK_PATH}; rm -f {REMOTE_APK_PATH}"), 
+                        stdout = sp.PIPE, stderr = sp.STDOUT, text = True)
+    except OSError as e: # ADB can't be run (ADB_PATH)
+        connection.send(("current", f"ERROR: Unexpected failure while installing the APK: {e}"))
         sys.exit(1)
 
-def check_installation(package_name: str):
+    if "Success" not in result.stdout.split():
+        connection.send(("current", f"Error: Failed to execute 'pm install'.\nReason: {result.stdout}"))
+        raise RuntimeError(f"Error: App install failed. Reason:\n{result.stdout}")
+
+def run_launch_command(command: str, check: bool) -> tuple[str | None, str]:
     """
-    Performs the installation check on the app.
+    Runs a launch command on the device, after printing the device time.
 
     Args:
-        package_name (str): Package name of the APK.
+        command (str): Shell command that launches the app.
+        check (bool): Raises an error if the command fails.
+    Returns:
+        tuple:
+            - **launch_time** (str | None): Device time of the launch (seconds since epoch), None if unknown.
+            - **output** (str): Output of the command.
+    Raises:
+        RuntimeError: If the command fails (with 'check'), e.g. the app has no activity to launch.
     """
 
     try:
-        result = sp.run([ADB_PATH, "shell", "pm", "list", "packages"], stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
-        if package_name not in result.stdout:
-            raise RuntimeError("ERROR: Package is not installed.")
+        # The device time is printed first, so that logs of the launch can be found
+        result = sp.run(adb("shell", f"date +%s; {command}"), stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = check)
     except sp.CalledProcessError as e:
-        connection.send(("current", f"ERROR: Failed to execute 'adb shell pm list packages': {e.output}"))
-        sys.exit(1)
-    except Exception as e:
-        if isinstance(e, RuntimeError):
-            raise RuntimeError("Error: Package is not installed.")
-        connection.send(("current", f"ERROR: Unexpected failure while checking for installation: {e}"))
+        _, _, output = e.output.partition("\n") # Without the device time
+        connection.send(("current", f"Error: Failed to execute 'adb shell {command.split()[0]}': {output}"))
+        raise RuntimeError(f"Error: App launch failed. Reason:\n{output}")
+    except OSError as e: # ADB can't be run (ADB_PATH)
+        connection.send(("current", f"ERROR: Unexpected failure while launching the app: {e}"))
         sys.exit(1)
 
-    connection.send(("current", "App is successfully installed."))
+    launch_time, _, output = result.stdout.partition("\n")
+    return (launch_time.strip() if launch_time.strip().isdigit() else None), output
 
-def check_crash_log(package_name: str):
+def launch_app(package_name: str, activity: str | None = None) -> dict:
     """
-    Checks the crash logs if the app crashed.
-
+    Launches the installed app on the emulator. With the launchable activity, the app is started
+    with 'am start -W', which waits for the first frame and reports the cold start time.
+    Otherwise (or if 'am start' fails), it is started with 'monkey', which gives no timing.
+    
     Args:
         package_name (str): Package name of the APK.
+        activity (str): Launchable activity of the APK (None if unknown).
+    Returns:
+        launch (dict): 'launch_time' (str, device time of the launch, None if unknown),
+            'total_time_ms' and 'wait_time_ms' (int, None if not measured).
+    """
 
-    Raises:
-        RuntimeError: When the app crashes.
+    if activity is not None:
+        component = shlex.quote(f"{package_name}/{activity}")
+        launch_time, output = run_launch_command(
+            f"am start -W -a android.intent.action.MAIN -c android.intent.category.LAUNCHER -n {component}", check = False)
+
+        # Lines like 'TotalTime: 640' (time to the first frame) and 'WaitTime: 655' (including the system)
+        values = dict(line.strip().partition(": ")[::2] for line in output.splitlines())
+        if "Error" not in output and values.get("TotalTime", "").isdigit():
+            return {
+                "launch_time": launch_time,
+                "total_time_ms": int(values["TotalTime"]),
+                "wait_time_ms": int(values["WaitTime"]) if values.get("WaitTime", "").isdigit() else None,
+            }
+
+    launch_time, _ = run_launch_command(f"monkey -p {shlex.quote(package_name)} -c android.intent.category.LAUNCHER 1", check = True)
+    return {"launch_time": launch_time, "total_time_ms": None, "wait_time_ms": None}
+
+# Health check that runs on the device in one 'adb shell' session. The device only prints the raw output of
+# every check after a marker line ('@@probe:<section>') and probe_app filters it, so the script needs nothing
+# but the shell and the checked commands (the toolbox of old images has no 'head', 'grep' or 'cut'):
+# - installed: output of 'pm path' (exact package name, unlike a search in 'pm list packages')
+# - pid: process IDs of the app
+# - log: logcat since the launch (whole log if '-T' isn't supported)
+# While the app runs, a snapshot of its first process is added:
+# - status: /proc/<pid>/status ('State' and 'VmRSS')
+# - stat, uptime: /proc/<pid>/stat and /proc/uptime, for the CPU use since the start of the process
+# - meminfo: 'dumpsys meminfo' (its first 'TOTAL' row starts with the total PSS in kB)
+PROBE_MARKER = "@@probe:"
+PROBE_SCRIPT = (
+    "pkg={package}; "
+    "echo @@probe:installed; pm path $pkg 2>/dev/null; "
+    "pid=$(pidof $pkg 2>/dev/null); p=${{pid%% *}}; "
+    "echo @@probe:pid; echo $pid; "
+    "echo @@probe:log; logcat -d -T {since} 2>/dev/null || logcat -d 2>/dev/null; "
+    "if [ -n \"$p\" ]; then "
+    "echo @@probe:status; cat /proc/$p/status 2>/dev/null; "
+    "echo @@probe:stat; cat /proc/$p/stat 2>/dev/null; "
+    "echo @@probe:uptime; cat /proc/uptime; "
+    "echo @@probe:meminfo; dumpsys meminfo $p 2>/dev/null; "
+    "fi"
+)
+
+# Crash lines of the app in logcat (same keywords as the earlier 'adb logcat' check)
+CRASH_KEYWORDS = ("FATAL EXCEPTION", "has died", "crashed")
+
+CLOCK_TICKS = 100 # Unit of the CPU times in /proc/<pid>/stat (USER_HZ on Android)
+
+def first_number(text: str) -> int | None:
+    """
+    Returns:
+        One_of_Two:
+            - **number** (int): First integer among the words of the text.
+            - **None**: If there is none.
     """
-    
-    try:
-        result = sp.run([ADB_PATH, "logcat", "-t", "0"], stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
-        logcat_output = result.stdout
 
-        error_keywords = ["FATAL EXCEPTION", "has died", "crashed"]
-        if any(
-            line for line in logcat_output.splitlines()
-            if any(keyword in line for keyword in error_keywords) and package_name in line
-        ):
-            raise RuntimeError("Error: App crashed.")
+    for word in text.split():
+        if word.isdigit():
+            return int(word)
+    return None
 
-    except sp.CalledProcessError as e:
-        connection.send(("current", f"ERROR: Failed to execute 'adb logcat -t 0': {e.output}"))
-        sys.exit(1)
-    except Exception as e:
-        if isinstance(e, RuntimeError):
-            raise RuntimeError("Error: App crashed.")
-        connection.send(("current", f"ERROR: Unexpected failure while checking for crash logs: {e}"))
-        sys.exit(1)
+def probe_sections(output: str) -> dict:
+    """
+    Splits the output of the health check into its sections.
+
+    Returns:
+        sections (dict): Section name -> lines printed after its marker.
+    """
+
+    sections = {}
+    lines = None
+    for line in output.splitlines():
+        line = line.rstrip("\r") # Old ADB versions end lines with CRLF
+        if line.startswith(PROBE_MARKER):
+            lines = sections.setdefault(line[len(PROBE_MARKER):].strip(), [])
+        elif lines is not None:
+            lines.append(line)
+    return sections
 
-def check_app_pid(package_name: str):
+def status_field(status: list[str], name: str) -> str:
     """
-    Checks the process ID (PID) of the app.\n
-    If it has no value, then it means the app isn't working.
+    Returns:
+        value (str): Value of a field of /proc/<pid>/status (e.g. 'S (sleeping)' for 'State'), empty if missing.
+    """
+
+    for line in status:
+        key, _, value = line.partition(":")
+        if key == name:
+            return value.strip()
+    return ""
+
+def cpu_percent(stat: str, uptime: str) -> float | None:
+    """
+    Computes the CPU use of a process since it started.
+
+    Args:
+        stat (str): Content of /proc/<pid>/stat.
+        uptime (str): Content of /proc/uptime.
+    Returns:
+        One_of_Two:
+            - **percent** (float): CPU time of the process / time since it started (100 = one core).
+            - **None**: If the values can't be read.
+    """
+
+    try:
+        fields = stat.rsplit(")", 1)[1].split() # The name of the process may contain spaces
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS # utime + stime
+        age = float(uptime.split()[0]) - int(fields[19]) / CLOCK_TICKS # uptime - starttime
+    except (IndexError, ValueError):
+        return None
+    return round(100 * cpu_seconds / max(age, 0.01), 1)
+
+def probe_app(package_name: str, launch_time: str | None) -> dict:
+    """
+    Runs the installation, crash and process checks of the app on the device in one round trip,
+    and takes a snapshot of the memory and CPU use of the app if it runs.
 
     Args:
         package_name (str): Package name of the APK.
+        launch_time (str): Device time of the launch (None if unknown).
+    Returns:
+        probe (dict): 'installed' (bool), 'pid' (str, empty if not running), 'state' (str),
+            'crashes' (int, number of crash lines since the launch), and 'pss_kb', 'rss_kb'
+            and 'cpu_percent' (None if not measured).
+    Raises:
+        TransientError: If the device doesn't answer.
     """
-    
+
+    # Logs from one second before the launch, in case the clock ticked during the launch
+    since = f"{int(launch_time) - 1}.000" if launch_time else "0.000"
+    script = PROBE_SCRIPT.format(package = shlex.quote(package_name), since = since)
     try:
-        result = sp.run([ADB_PATH, "shell", "pidof", package_name], stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = False)
-        pid = result.stdout.strip()
-        if not pid: # No PID = App not running
-            raise RuntimeError("Error: App is not running.")
-        else:
-            connection.send(("current", "Health check passed."))
+        result = sp.run(adb("shell", script), stdout = sp.PIPE, stderr = sp.STDOUT, text = True, check = True)
     except sp.CalledProcessError as e:
-        connection.send(("current", f"ERROR: Failed to execute 'adb shell pidof': {e.output}"))
-        sys.exit(1)
-    except Exception as e:
-        if isinstance(e, RuntimeError):
-            raise RuntimeError("Error: App is not running.")
-        connection.send(("current", f"ERROR: Unexpected failure while checking for PID: {e}"))
+        raise TransientError(f"ERROR: Failed to execute the health check on the device: {e.output}")
+    except OSError as e: # ADB can't be run (ADB_PATH)
+        connection.send(("current", f"ERROR: Failed to execute the health check on the device: {e}"))
         sys.exit(1)
+
+    sections = probe_sections(result.stdout)
+    if not {"installed", "pid", "log"} <= sections.keys():
+        raise TransientError(f"ERROR: Unexpected output of the health check: {result.stdout}")
+
+    status = sections.get("status", [])
+    return {
+        "installed": any(line.strip().startswith("package:") for line in sections["installed"]),
+        "pid": " ".join(" ".join(sections["pid"]).split()),
+        "state": status_field(status, "State"),
+        "crashes": sum(1 for line in sections["log"]
+                       if package_name in line and any(keyword in line for keyword in CRASH_KEYWORDS)),
+        "pss_kb": first_number(next((line for line in sections.get("meminfo", []) if "TOTAL" in line), "")),
+        "rss_kb": first_number(status_field(status, "VmRSS")),
+        "cpu_percent": cpu_percent(" ".join(sections.get("stat", [])), " ".join(sections.get("uptime", []))),
+    }
+
+def check_health(probe: dict):
+    """
+    Performs the health check on the app: installation, crash logs, and process ID (in this order).
+
+    Args:
+        probe (dict): Result of 'probe_app'.
+    Raises:
+        RuntimeError: When the app isn't installed, crashed, or isn't running.
+    """
+
+    if not probe["installed"]:
+        raise RuntimeError("Error: Package is not installed.")
+    connection.send(("current", "App is successfully installed."))
+
+    if probe["crashes"] > 0:
+        raise RuntimeError("Error: App crashed.")
+
+    if not probe["pid"]: # No PID = App not running
+        raise RuntimeError("Error: App is not running.")
+    connection.send(("current", "Health check passed."))
     
+def record_performance(performance: dict | None, values: dict):
+    """
+    Stores measurements of the app and sends them to the TUI.
+
+    Args:
+        performance (dict): Measurements of the app (None to only send them).
+        values (dict): New measurements (None if not measured).
+    """
+
+    for name, value in values.items():
+        if value is None:
+            continue
+        if performance is not None:
+            performance[name] = value
+        connection.send(("sample", (name, value)))
+
 # ////////////////////////////////////
 # /////////////// MAIN ///////////////
 # ////////////////////////////////////
 connection = None
 
-def app_launch_main(apk_path: str, package_name: str, conn):
+def app_launch_main(apk_path: str, package_name: str, conn, activity: str | None = None, performance: dict | None = None):
     """
     Installs, runs the app, and does the health check.
 
@@ -160,6 +329,9 @@ def app_launch_main(apk_path: str, package_name: str, conn):
         apk_path (str): APK path.
         package_name (str): Package name of the APK.
         conn (Connection): Pipe connection for sending data.
+        activity (str): Launchable activity of the APK (None if unknown).
+        performance (dict): Filled with the cold start time ('cold_start_ms', 'wait_time_ms'),
+            memory ('pss_kb', 'rss_kb') and CPU use ('cpu_percent') of the app, as they are measured.
     """
 
     global connection
@@ -173,19 +345,19 @@ def app_launch_main(apk_path: str, package_name: str, conn):
 
     # Installs the APK
     connection.send(("current", "Installing APK..."))
-    install_apk(apk_path)
+    with stage_timer(connection, "install"):
+        install_apk(apk_path)
 
     # Launches the app
     connection.send(("current", "Launching app..."))
-    launch_app(package_name)
+    with stage_timer(connection, "launch"):
+        launch = launch_app(package_name, activity)
+    record_performance(performance, {"cold_start_ms": launch["total_time_ms"], "wait_time_ms": launch["wait_time_ms"]})
     sleep(2) # Gives a little time for the app to launch completely
 
     # ///// Performs the health check /////
-    # ----- Installation check -----
-    check_installation(package_name)
-
-    # ----- Running check -----
-    # Checks for the crash in logcat
-    check_crash_log(package_name)
-    # Checks PID of the app
-    check_app_pid(package_name)
\ No newline at end of file
+    # Installation, crash logs and PID are checked in one adb round trip, with a snapshot of memory and CPU use
+    with stage_timer(connection, "health_check"):
+        probe = probe_app(package_name, launch["launch_time"])
+    record_performance(performance, {key: probe[key] for key in ("pss_kb", "rss_kb", "cpu_percent")})
+    check_health(probe)
\ No newline at end of file
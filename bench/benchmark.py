@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark of APK Tester and Virus Scanner.\n
+It runs 'headless.py' against local stand-ins (fake AndroZoo 'ssh', 'adb', 'emulator', 'aapt' and
+a fake VirusTotal server), so no AndroZoo account, API key or AVD is needed. Results are appended
+to a JSON-lines file together with the git commit, so that regressions show up between commits.
+"""
+
+import argparse
+import configparser
+import csv
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import time
+import zipfile as zp
+from fake_virustotal import FakeVirusTotal, start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+CSV_HEADER = ["sha256", "sha1", "md5", "dex_date", "apk_size", "pkg_name", "vercode",
+              "vt_detection", "vt_scan_date", "dex_size", "markets"]
+MARKETS = ["play.google.com", "anzhi", "appchina", "mi.com", "VirusShare"]
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, round(p / 100 * len(ordered)))) - 1]
+
+def make_apk(apk_dir: str, index: int, size: int, rng: random.Random) -> list:
+    """
+    Creates a fake APK (a zip file with a manifest read by the fake 'aapt').
+
+    Args:
+        apk_dir (str): Directory of the APKs.
+        index (int): Number of the APK.
+        size (int): Approximate size in bytes.
+        rng (Random): Random generator.
+    Returns:
+        row (list): Row of 'latest.csv' for the APK.
+    """
+
+    package = f"com.bench.app{index}"
+    target_sdk = rng.choice([19, 21, 23, 24, 26, 28, 29, 30, 31, 33, 34, 35])
+    manifest = {"package": package, "min_sdk": min(target_sdk, rng.choice([16, 19, 21])),
+                "target_sdk": target_sdk if rng.random() > 0.05 else None}
+
+    tmp_path = os.path.join(apk_dir, "tmp.apk")
+    with zp.ZipFile(tmp_path, "w", zp.ZIP_STORED) as apk:
+        apk.writestr("fake_manifest.json", json.dumps(manifest))
+        apk.writestr("classes.dex", b"".join(rng.randbytes(min(2**24, size - start)) for start in range(0, size, 2**24)))
+        if rng.random() < 0.4:
+            apk.writestr(f"lib/{rng.choice(['arm64-v8a', 'armeabi-v7a', 'x86_64'])}/libnative{index}.so", b"\0" * 64)
+
+    with open(tmp_path, "rb") as f:
+        content = f.read()
+    sha256_hash = hashlib.sha256(content).hexdigest().upper()
+    os.replace(tmp_path, os.path.join(apk_dir, f"{sha256_hash}.apk"))
+
+    vt_detection = rng.choice(["", "0", "0", "1", "5"]) if rng.random() < 0.8 else ""
+    return [sha256_hash, hashlib.sha1(content).hexdigest().upper(), hashlib.md5(content).hexdigest().upper(),
+            f"{rng.randint(2012, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 00:00:00",
+            len(content), package, 1, vt_detection,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - rng.randint(0, 730) * 86400)) if vt_detection else "",
+            size, rng.choice(MARKETS)]
+
+def prepare(work_dir: str, args: argparse.Namespace, vt_port: int) -> dict:
+    """
+    Creates the corpus, fake tools and configuration in the working directory.
+
+    Returns:
+        env (dict): Environment variables for 'headless.py'.
+    """
+
+    rng = random.Random(args.seed)
+
+    # APKs and 'latest.csv'
+    apk_dir = os.path.join(work_dir, "apks")
+    os.makedirs(apk_dir)
+    with open(os.path.join(work_dir, "latest.csv"), "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        rows = []
+        for i in range(1, args.apks + 1):
+            if rows and rng.random() < args.duplicate_rate: # Same APK as an earlier row
+                rows.append(rng.choice(rows))
+            else:
+                size = int(rng.lognormvariate(0, 0.8) * args.apk_size_kb * 1024)
+                rows.append(make_apk(apk_dir, i, size, rng))
+            writer.writerow(rows[-1])
+
+    # Fake tools (the tool is chosen by the name of the symlink)
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    for tool in ["ssh", "adb", "emulator", "aapt"]:
+        os.symlink(os.path.join(BENCH_DIR, "fake_tools.py"), os.path.join(bin_dir, tool))
+    state_dir = os.path.join(work_dir, "devices")
+    os.makedirs(state_dir)
+
+    # Configuration
+    config = configparser.ConfigParser()
+    config.optionxform = str # Keeps upper case keys
+    config.read(os.path.join(REPO_DIR, "config.ini"))
+    config["Paths"]["EMULATOR_PATH"] = os.path.join(bin_dir, "emulator")
+    config["Paths"]["ADB_PATH"] = os.path.join(bin_dir, "adb")
+    config["Paths"]["AAPT_PATH"] = os.path.join(bin_dir, "aapt")
+    config["API_URLs"]["API_SCAN_URL"] = f"http://127.0.0.1:{vt_port}/vtapi/v2/file/scan"
+    config["API_URLs"]["API_REPORT_URL"] = f"http://127.0.0.1:{vt_port}/vtapi/v2/file/report"
+    config["APK_Test"]["MAX_APK_NB_TA"] = str(args.apks)
+    config["Virus_Scan"]["MAX_APK_NB_VS"] = str(args.apks)
+    config["Virus_Scan"]["COOLDOWN"] = str(args.vt_cooldown)
+    config["Resources"]["SCALE_INTERVAL"] = str(args.scale_interval)
+    config["Scratch"]["SCRATCH"] = args.scratch
+    config["Emulator"]["PUSH_DURING_BOOT"] = args.push_during_boot
+    config["Retry"]["BASE_DELAY"] = str(args.retry_delay)
+    config["Scratch"]["DISK_DIR"] = os.path.join(work_dir, "scratch")
+    with open(os.path.join(work_dir, "config.ini"), "w") as f:
+        config.write(f)
+
+    return {
+        **os.environ,
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        "API_KEY": "benchmark",
+        "SSH_KEY_PATH": os.path.join(work_dir, "ssh_key"),
+        "FAKE_STATE_DIR": state_dir,
+        "FAKE_APK_DIR": apk_dir,
+        "FAKE_SEED": str(args.seed),
+        "FAKE_SSH_LATENCY": str(args.ssh_latency),
+        "FAKE_SSH_BYTES_PER_SECOND": str(args.ssh_mb_per_second * 2**20),
+        "FAKE_SSH_CUT_RATE": str(args.ssh_cut_rate),
+        "FAKE_SSH_CORRUPT_RATE": str(args.ssh_corrupt_rate),
+        "FAKE_BOOT_SECONDS": str(args.boot_seconds),
+        "FAKE_SHUTDOWN_SECONDS": str(args.shutdown_seconds),
+        "FAKE_ADBD_SECONDS": str(args.adbd_seconds),
+        "FAKE_PUSH_SECONDS_PER_MB": str(args.push_seconds_per_mb),
+        "FAKE_INSTALL_SECONDS": str(args.install_seconds),
+        "FAKE_INSTALL_SECONDS_PER_MB": str(args.install_seconds_per_mb),
+        "FAKE_INSTALL_FAIL_RATE": str(args.install_fail_rate),
+        "FAKE_CRASH_RATE": str(args.crash_rate),
+        "FAKE_AAPT_SECONDS": str(args.aapt_seconds),
+    }
+
+def summarize(events: list[dict]) -> dict:
+    """
+    Computes throughput and per-stage times from the JSON-lines output of 'headless.py'.
+    """
+
+    pipelines = {}
+    for event in events:
+        name = event.get("pipeline")
+        if name is None:
+            continue
+        data = pipelines.setdefault(name, {"start": event["time"], "end": event["time"], "completed": 0, "stages": {}, "events": {}, "samples": {}})
+        if event["event"] == "summary": # Emitted after the run, keeps the measured time unchanged
+            data["events"] = event["events"]
+            data["samples"] = event.get("samples", {})
+            continue
+        data["end"] = event["time"]
+        if event["event"] == "timing":
+            data["stages"].setdefault(event["stage"], []).append(event["seconds"])
+        elif event["event"] == "total":
+            data["completed"] += 1
+
+    summary = {}
+    for name, data in pipelines.items():
+        elapsed = max(data["end"] - data["start"], 1e-9)
+        summary[name] = {
+            "completed": data["completed"],
+            "seconds": round(elapsed, 2),
+            "apks_per_hour": round(data["completed"] * 3600 / elapsed, 1),
+            "events": data["events"],
+            "samples": data["samples"],
+            "stages": {stage: {"count": len(values), "total": round(sum(values), 3),
+                               "share": round(sum(values) / elapsed, 3),
+                               "p50": percentile(values, 50), "p95": percentile(values, 95)}
+                       for stage, values in data["stages"].items()},
+        }
+    return summary
+
+def git_commit() -> str:
+    result = sp.run(["git", "-C", REPO_DIR, "rev-parse", "--short", "HEAD"], stdout = sp.PIPE, stderr = sp.DEVNULL, text = True)
+    dirty = sp.run(["git", "-C", REPO_DIR, "diff", "--quiet", "HEAD"], stdout = sp.DEVNULL, stderr = sp.DEVNULL).returncode
+    return result.stdout.strip() + ("-dirty" if dirty else "")
+
+def compare(result: dict, results_path: str):
+    """
+    Prints the change of throughput against the last stored result of the same scenario.
+    """
+
+    previous = None
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record["scenario"] == result["scenario"]:
+                    previous = record
+    if previous is None:
+        print("No previous result for this scenario.")
+        return
+
+    for name, data in result["pipelines"].items():
+        old = previous["pipelines"].get(name, {}).get("apks_per_hour")
+        if not old:
+            continue
+        change = (data["apks_per_hour"] - old) / old * 100
+        flag = "  <-- REGRESSION" if change < -10 else ""
+        print(f"{name}: {data['apks_per_hour']} APKs/h vs {old} APKs/h at {previous['commit']} ({change:+.1f}%){flag}")
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Runs one benchmark and returns its result.
+    """
+
+    service = FakeVirusTotal(args.vt_rate_limit, args.vt_rate_window, args.vt_known_rate, args.vt_scan_seconds, str(args.seed))
+    server = start_server(service)
+    work_dir = tempfile.mkdtemp(prefix = "apk-observer-bench-")
+    try:
+        env = prepare(work_dir, args, server.server_address[1])
+
+        command = [sys.executable, os.path.join(REPO_DIR, "headless.py"), "--pipeline", args.pipeline,
+                   "--start", "1", "--end", str(args.apks), "--no-ssh-check",
+                   "--test-workers", str(args.test_workers), "--scan-workers", str(args.scan_workers)]
+        if args.adaptive:
+            command.append("--adaptive")
+        if args.corpus: # Columnar corpus and a work list of every APK
+            sp.run([sys.executable, os.path.join(REPO_DIR, "corpus.py"), "build"], cwd = work_dir, env = env, check = True)
+            sp.run([sys.executable, os.path.join(REPO_DIR, "corpus.py"), "select", "--output", "worklist.txt"],
+                   cwd = work_dir, env = env, check = True)
+            command += ["--work-list", "worklist.txt"]
+        start_time = time.time()
+        process = sp.Popen(command, cwd = work_dir, env = env, stdout = sp.PIPE, text = True)
+        events = []
+        for line in process.stdout:
+            events.append(json.loads(line))
+            if args.verbose:
+                print(line, end = "")
+        process.wait()
+        wall = time.time() - start_time
+    finally:
+        server.shutdown()
+        if args.keep:
+            print(f"Working directory kept: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors = True)
+
+    scenario = {key: value for key, value in vars(args).items() if key not in ("output", "keep", "verbose")}
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "scenario": scenario,
+        "exit_code": process.returncode,
+        "wall_seconds": round(wall, 2),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, # Largest process
+        "virustotal": service.stats,
+        "pipelines": summarize(events),
+    }
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description = "End-to-end benchmark with local stand-ins for AndroZoo, adb and VirusTotal.")
+    parser.add_argument("--apks", type = int, default = 20, help = "Number of APKs in the fake corpus.")
+    parser.add_argument("--pipeline", choices = ["test", "scan", "both"], default = "both")
+    parser.add_argument("--test-workers", type = int, default = 1)
+    parser.add_argument("--scan-workers", type = int, default = 1)
+    parser.add_argument("--adaptive", action = "store_true", help = "Runs headless.py with adaptive concurrency.")
+    parser.add_argument("--corpus", action = "store_true", help = "Uses the columnar corpus and a work list (corpus.py).")
+    parser.add_argument("--scale-interval", type = int, default = 2, help = "SCALE_INTERVAL written to config.ini.")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--duplicate-rate", type = float, default = 0, help = "Share of rows that repeat an earlier APK.")
+    parser.add_argument("--apk-size-kb", type = float, default = 2048, help = "Median APK size.")
+    parser.add_argument("--ssh-latency", type = float, default = 0.2)
+    parser.add_argument("--ssh-mb-per-second", type = float, default = 50)
+    parser.add_argument("--ssh-cut-rate", type = float, default = 0, help = "Share of transfers that drop halfway.")
+    parser.add_argument("--ssh-corrupt-rate", type = float, default = 0, help = "Share of transfers with a wrong byte.")
+    parser.add_argument("--retry-delay", type = float, default = 1, help = "[Retry] BASE_DELAY written to config.ini.")
+    parser.add_argument("--boot-seconds", type = float, default = 3)
+    parser.add_argument("--shutdown-seconds", type = float, default = 0.5)
+    parser.add_argument("--adbd-seconds", type = float, default = 1, help = "Time after the emulator start when ADB can reach it.")
+    parser.add_argument("--push-seconds-per-mb", type = float, default = 0.05, help = "Time to copy 1 MB to the emulator.")
+    parser.add_argument("--install-seconds", type = float, default = 0.5)
+    parser.add_argument("--install-seconds-per-mb", type = float, default = 0.2)
+    parser.add_argument("--install-fail-rate", type = float, default = 0.05)
+    parser.add_argument("--crash-rate", type = float, default = 0.1)
+    parser.add_argument("--aapt-seconds", type = float, default = 0.05)
+    parser.add_argument("--vt-rate-limit", type = int, default = 4, help = "VirusTotal requests per window (0 = unlimited).")
+    parser.add_argument("--vt-rate-window", type = float, default = 10)
+    parser.add_argument("--vt-cooldown", type = int, default = 3, help = "COOLDOWN written to config.ini.")
+    parser.add_argument("--vt-known-rate", type = float, default = 0.7, help = "Share of hashes VirusTotal already knows.")
+    parser.add_argument("--vt-scan-seconds", type = float, default = 5)
+    parser.add_argument("--output", default = os.path.join(REPO_DIR, "bench_results.jsonl"), help = "Results file.")
+    parser.add_argument("--scratch", choices = ["auto", "tmpfs", "disk", "compare"], default = "auto",
+                        help = "Where workers keep APKs ('compare' runs with disk, then tmpfs, and prints the I/O time saved).")
+    parser.add_argument("--push-during-boot", choices = ["yes", "no", "compare"], default = "yes",
+                        help = "Pushes APKs while emulators boot ('compare' runs without, then with it, for every size in --size-buckets-kb).")
+    parser.add_argument("--size-buckets-kb", default = "256,4096,16384",
+                        help = "Median APK sizes compared by '--push-during-boot compare' (comma-separated).")
+    parser.add_argument("--keep", action = "store_true", help = "Keeps the working directory.")
+    parser.add_argument("--verbose", action = "store_true", help = "Prints the output of headless.py.")
+    return parser.parse_args(argv)
+
+IO_STAGES = ["download", "metadata", "install", "vt_upload"] # Stages that read or write APK files
+
+def print_io_savings(disk: dict, tmpfs: dict):
+    """
+    Prints the time of the stages that read or write APK files on disk and on tmpfs.
+    """
+
+    print("I/O time saved by tmpfs (disk -> tmpfs):")
+    for name, data in tmpfs["pipelines"].items():
+        disk_stages = disk["pipelines"].get(name, {}).get("stages", {})
+        for stage in IO_STAGES:
+            if stage not in data["stages"] or stage not in disk_stages:
+                continue
+            before, after = disk_stages[stage], data["stages"][stage]
+            print(f"    [{name}] {stage:<10} total {before['total']:.2f}s -> {after['total']:.2f}s " +
+                  f"({before['total'] - after['total']:+.2f}s saved), p50 {before['p50']:.3f}s -> {after['p50']:.3f}s")
+
+def print_push_savings(results: list[dict]):
+    """
+    Prints the install time and throughput of APK Tester without and with the push during the boot,
+    for every APK size bucket.
+    """
+
+    print("Install time by APK size (push after boot -> push during boot):")
+    for before, after in zip(results[::2], results[1::2]):
+        old, new = before["pipelines"].get("test"), after["pipelines"].get("test")
+        if not old or not new or "install" not in old["stages"] or "install" not in new["stages"]:
+            continue
+        old_install, new_install = old["stages"]["install"], new["stages"]["install"]
+        print(f"    ~{before['scenario']['apk_size_kb']:>8g} KB  " +
+              f"install total {old_install['total']:.2f}s -> {new_install['total']:.2f}s, " +
+              f"p50 {old_install['p50']:.3f}s -> {new_install['p50']:.3f}s, " +
+              f"{old['apks_per_hour']} -> {new['apks_per_hour']} APKs/h")
+
+def report(result: dict, args: argparse.Namespace):
+    """
+    Prints a result, compares it with the previous result of the same scenario and stores it.
+    """
+
+    for name, data in result["pipelines"].items():
+        print(f"[{name}] {data['completed']} APKs in {data['seconds']}s -> {data['apks_per_hour']} APKs/h")
+        for stage, stage_data in sorted(data["stages"].items(), key = lambda item: -item[1]["total"]):
+            print(f"    {stage:<14} total {stage_data['total']:>8.2f}s  share {stage_data['share']:>6.1%}  " +
+                  f"p50 {stage_data['p50']:.3f}s  p95 {stage_data['p95']:.3f}s")
+        for name, sample in data["samples"].items():
+            print(f"    app {name:<14} p50 {sample['p50']}  p95 {sample['p95']}")
+    print(f"Peak RSS: {result['peak_rss_kb'] / 1024:.1f} MB, exit code: {result['exit_code']}, " +
+          f"VirusTotal requests: {result['virustotal']['requests']} ({result['virustotal']['rate_limited']} rate limited)")
+    for name, data in result["pipelines"].items():
+        if data["events"].get("duplicate_skip"):
+            print(f"[{name}] Duplicates skipped: {data['events']['duplicate_skip']}")
+        if data["events"].get("retry") or data["events"].get("give_up"):
+            print(f"[{name}] Retries: {data['events'].get('retry', 0)}, give-ups: {data['events'].get('give_up', 0)}")
+    if "scan" in result["pipelines"]:
+        print(f"VirusTotal quota saved: {result['pipelines']['scan']['events'].get('csv_label_hit', 0)} APKs labelled from latest.csv")
+
+    compare(result, args.output)
+    with open(args.output, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.scratch == "compare":
+        results = [run(argparse.Namespace(**{**vars(args), "scratch": scratch})) for scratch in ("disk", "tmpfs")]
+    elif args.push_during_boot == "compare":
+        results = [run(argparse.Namespace(**{**vars(args), "apk_size_kb": float(size), "push_during_boot": push}))
+                   for size in args.size_buckets_kb.split(",") for push in ("no", "yes")]
+    else:
+        results = [run(args)]
+
+    for result in results:
+        report(result, argparse.Namespace(**{**vars(args), **result["scenario"]}))
+    if args.scratch == "compare":
+        print_io_savings(*results)
+    elif args.push_during_boot == "compare":
+        print_push_savings(results)
+    sys.exit(0 if all(result["exit_code"] == 0 for result in results) else 1)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Throughput and memory benchmark of 'export.py'.\n
+It generates a 'results.db' with N rows in 'apk_info' and 'scan_results' (10 million by default),
+runs a full export in every format, then changes and adds rows and runs an incremental export.
+Every export runs in its own process, so its peak RSS is measured alone.
+"""
+
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+from db_manager import create_table as create_test_table
+from scan_db_manager import create_table as create_scan_table
+
+BATCH_ROWS = 200_000
+LIBS = [f"lib/{abi}/lib{name}.so" for abi in ("arm64-v8a", "armeabi-v7a", "x86") for name in range(50)]
+OUTCOMES = ["Launched successfully", "Error: App crashed.", "Error: App is not running.", "Error: App install failed."]
+LABELS = ["BENIGN", "SUSPICIOUS", "MALICIOUS"]
+
+def generate_database(db_path: str, rows: int, rng: random.Random):
+    """
+    Writes 'rows' test results and 'rows' scan results (without the summary tables of
+    analytics.py, which are filled from the rows when the database is first opened).
+    """
+
+    connection = sqlite3.connect(db_path)
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = OFF")
+    cursor.execute("PRAGMA synchronous = OFF")
+    create_scan_table(cursor)
+    create_test_table(cursor)
+    for table in ("apk_native_libs", "test_outcomes", "abi_outcomes", "native_lib_outcomes", "label_by_sdk"):
+        cursor.execute(f"DROP TABLE {table}")
+    connection.commit()
+
+    for start in range(0, rows, BATCH_ROWS):
+        batch = [f"{number:064X}" for number in range(start, min(start + BATCH_ROWS, rows))]
+        cursor.executemany(
+            "INSERT INTO apk_info (apk_name, sha256_hash, min_sdk_version, sdk_version, max_sdk_version, native_libs, " +
+            "outcome, scan_label, positives, total_engines, test_time, scan_time, cold_start_ms, wait_time_ms, pss_kb, " +
+            "rss_kb, cpu_percent) VALUES (?, ?, ?, ?, NULL, ?, ?, 'PENDING', 'PENDING', 'PENDING', ?, 'PENDING', ?, ?, ?, ?, ?)",
+            [(f"com.bench.app{sha256_hash[-8:]}", sha256_hash, str(rng.randint(14, 23)), str(rng.randint(23, 34)),
+              ", ".join(rng.sample(LIBS, rng.choice((0, 0, 2, 4)))), rng.choice(OUTCOMES), "2026-01-01T00:00:00+00:00",
+              rng.randint(200, 3000), rng.randint(200, 3000), rng.randint(20000, 200000), rng.randint(40000, 400000),
+              round(rng.uniform(0, 100), 1)) for sha256_hash in batch])
+        cursor.executemany(
+            "INSERT INTO scan_results (sha256_hash, positives, total_engines, scan_label, label_source, scan_time) " +
+            "VALUES (?, ?, 70, ?, 'virustotal', '2026-01-01T00:00:00+00:00')",
+            [(sha256_hash, rng.randint(0, 9), rng.choice(LABELS)) for sha256_hash in batch])
+        connection.commit()
+    connection.close()
+
+def change_rows(db_path: str, rows: int, changed: int, rng: random.Random):
+    """
+    Adds scan labels to 'changed' existing test results and inserts 'changed' new ones.
+    """
+
+    connection = sqlite3.connect(db_path)
+    ids = rng.sample(range(1, rows + 1), changed)
+    connection.executemany("UPDATE apk_info SET scan_label = ?, positives = 0, total_engines = 70 WHERE id = ?",
+                           [(rng.choice(LABELS), apk_id) for apk_id in ids])
+    connection.executemany("INSERT INTO apk_info (apk_name, sha256_hash, outcome) VALUES ('com.bench.new', ?, 'Launched successfully')",
+                           [(f"{rows + number:064X}",) for number in range(changed)])
+    connection.commit()
+    connection.close()
+
+def run_export(db_path: str, output_dir: str, file_format: str, full: bool = False) -> dict:
+    """
+    Runs 'export.py' in a new process.
+
+    Returns:
+        result (dict): Duration in seconds, peak RSS in MB, output lines and size of the files in MB.
+    """
+
+    start_time = time.time()
+    command = [sys.executable, os.path.join(REPO_DIR, "export.py"), "--db", db_path, "--output", output_dir, "--format", file_format]
+    process = sp.run(command + (["--full"] if full else []), stderr = sp.PIPE, text = True, check = True)
+    rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output_dir) for name in names)
+    return {"seconds": time.time() - start_time, "peak_rss_mb": rusage.ru_maxrss / 1024,
+            "output": process.stderr.strip(), "size_mb": size / 2**20}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark of export.py on a generated database.")
+    parser.add_argument("--rows", type = int, default = 10_000_000, help = "Rows of 'apk_info' and of 'scan_results'.")
+    parser.add_argument("--changed", type = int, default = 100_000, help = "Rows changed and added before the incremental export.")
+    parser.add_argument("--formats", default = "parquet,jsonl,csv")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix = "apk-observer-export-") as work_dir:
+        db_path = os.path.join(work_dir, "results.db")
+        start_time = time.time()
+        generate_database(db_path, args.rows, rng)
+        print(f"Generated {args.rows:,} + {args.rows:,} rows in {time.time() - start_time:.0f}s " +
+              f"({os.path.getsize(db_path) / 2**20:.0f} MB).")
+
+        for number, file_format in enumerate(args.formats.split(",")):
+            output_dir = os.path.join(work_dir, f"export-{file_format}")
+            result = run_export(db_path, output_dir, file_format)
+            # The first export also adds the 'export_version' column and triggers
+            print(f"[{file_format}] full export in {result['seconds']:.1f}s" + (" (with the one-time setup)" if number == 0 else "") +
+                  f", {result['size_mb']:.0f} MB, peak RSS so far {result['peak_rss_mb']:.0f} MB")
+            print("    " + result["output"].replace("\n", "\n    "))
+
+        change_rows(db_path, args.rows, args.changed, rng)
+        for file_format in args.formats.split(","):
+            output_dir = os.path.join(work_dir, f"export-{file_format}")
+            size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output_dir) for name in names)
+            result = run_export(db_path, output_dir, file_format)
+            print(f"[{file_format}] incremental export in {result['seconds']:.1f}s, {result['size_mb'] - size / 2**20:.1f} MB")
+            print("    " + result["output"].replace("\n", "\n    "))
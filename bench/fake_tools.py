@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for 'ssh' (AndroZoo), 'adb', 'emulator' and 'aapt' used by the benchmark.\n
+The tool is chosen by the name it is called with (symlinks created by benchmark.py).
+Behaviour is set through environment variables:
+- FAKE_STATE_DIR: directory with the state of the fake devices (required).
+- FAKE_APK_DIR: directory with APKs named '<sha256>.apk' (ssh).
+- FAKE_SSH_LATENCY, FAKE_SSH_BYTES_PER_SECOND: download latency and bandwidth.
+- FAKE_SSH_CUT_RATE, FAKE_SSH_CORRUPT_RATE: share of transfers that drop halfway / have a wrong byte.
+- FAKE_BOOT_SECONDS, FAKE_SHUTDOWN_SECONDS: emulator boot and shut down time. The boot time
+  also depends on the launch options ('-cores', '-memory', '-gpu', '-no-audio').
+- FAKE_NO_GPU: the host has no GPU ('-gpu host' exits at start). '-gpu off' never boots on A15.
+- FAKE_ADBD_SECONDS: time after the emulator start when ADB can reach it (before the boot completes).
+- FAKE_PUSH_SECONDS_PER_MB: time to copy an APK to the emulator ('adb push', part of 'adb install').
+- FAKE_INSTALL_SECONDS, FAKE_INSTALL_SECONDS_PER_MB: install time on the emulator.
+- FAKE_INSTALL_FAIL_RATE, FAKE_CRASH_RATE: share of APKs that fail to install / crash.
+- FAKE_AAPT_SECONDS, FAKE_ADB_LATENCY: time of an 'aapt' call / of every 'adb' call.
+- FAKE_SEED: changes which APKs fail or crash.
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess as sp
+import sys
+import time
+import zipfile as zp
+
+STATE_DIR = os.environ.get("FAKE_STATE_DIR", "")
+DEFAULT_PORT = 5554
+
+def setting(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+def chance(key: str, rate: float) -> bool:
+    """
+    Deterministic random decision, so that every run fails the same APKs.
+    """
+
+    digest = hashlib.sha256(f"{os.environ.get('FAKE_SEED', '0')}:{key}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 < rate
+
+def read_manifest(apk_path: str) -> dict:
+    with zp.ZipFile(apk_path) as apk:
+        return json.loads(apk.read("fake_manifest.json"))
+
+# ----- Device state (one JSON file per emulator) -----
+def state_path(serial: str) -> str:
+    return os.path.join(STATE_DIR, f"{serial}.json")
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def load_state(serial: str) -> dict | None:
+    try:
+        with open(state_path(serial)) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not process_alive(state.get("pid", os.getpid())): # Emulator process was killed
+        try:
+            os.remove(state_path(serial))
+        except FileNotFoundError:
+            pass
+        return None
+    return state
+
+def save_state(serial: str, state: dict):
+    tmp_path = f"{state_path(serial)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path(serial))
+
+def running_serials() -> list[str]:
+    serials = sorted(name[:-len(".json")] for name in os.listdir(STATE_DIR) if name.endswith(".json"))
+    return [serial for serial in serials if load_state(serial) is not None]
+
+def is_booted(state: dict) -> bool:
+    return time.time() - state["boot_started"] >= state.get("boot_seconds", setting("FAKE_BOOT_SECONDS", 3))
+
+def device_file(serial: str, remote_path: str) -> str:
+    # Files pushed to an emulator, flat in one directory per emulator
+    return os.path.join(STATE_DIR, f"{serial}-files", os.path.basename(remote_path))
+
+def fake_pm_install(serial: str, state: dict, apk_path: str, booted: bool) -> bool:
+    manifest = read_manifest(apk_path)
+    size_mb = os.path.getsize(apk_path) / 2**20
+    time.sleep(setting("FAKE_INSTALL_SECONDS", 0.5) + size_mb * setting("FAKE_INSTALL_SECONDS_PER_MB", 0.2))
+    if not booted or chance(f"install:{manifest['package']}", setting("FAKE_INSTALL_FAIL_RATE", 0.05)):
+        return False
+    state["packages"][manifest["package"]] = {"pid": None, "crashed": False}
+    save_state(serial, state)
+    return True
+
+# ----- ssh -----
+def fake_ssh(args: list[str]) -> int:
+    # Request: '<sha256>' or '<sha256> <offset>' (resumed download)
+    request = sys.stdin.read().split()
+    sha256_hash = request[0]
+    offset = int(request[1]) if len(request) > 1 else 0
+    apk_path = os.path.join(os.environ["FAKE_APK_DIR"], f"{sha256_hash}.apk")
+    if not os.path.isfile(apk_path):
+        return 1
+
+    # Number of requests for this APK (every attempt fails or succeeds independently)
+    count_path = os.path.join(STATE_DIR, f"ssh-{sha256_hash}.count")
+    attempt = int(open(count_path).read()) + 1 if os.path.exists(count_path) else 1
+    with open(count_path, "w") as f:
+        f.write(str(attempt))
+
+    with open(apk_path, "rb") as f:
+        f.seek(offset)
+        content = f.read()
+    if chance(f"corrupt:{sha256_hash}:{attempt}", setting("FAKE_SSH_CORRUPT_RATE", 0)) and content:
+        content = bytes([content[0] ^ 0xFF]) + content[1:]
+    end = len(content)
+    if chance(f"cut:{sha256_hash}:{attempt}", setting("FAKE_SSH_CUT_RATE", 0)): # Connection drops halfway
+        end //= 2
+
+    time.sleep(setting("FAKE_SSH_LATENCY", 0.2))
+    speed = setting("FAKE_SSH_BYTES_PER_SECOND", 50e6)
+    for start in range(0, end, 65536):
+        chunk = content[start:min(start + 65536, end)]
+        time.sleep(len(chunk) / speed)
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    return 255 if end < len(content) else 0
+
+# ----- emulator -----
+def fake_emulator(args: list[str]) -> int:
+    avd = args[args.index("-avd") + 1]
+    port = int(args[args.index("-port") + 1]) if "-port" in args else DEFAULT_PORT
+    serial = f"emulator-{port}"
+
+    option = lambda name, default: args[args.index(name) + 1] if name in args else default
+    gpu = option("-gpu", "auto")
+    if gpu == "host" and setting("FAKE_NO_GPU", 0):
+        print("emulator: ERROR: GPU emulation is not supported on this host.", file = sys.stderr)
+        return 1
+
+    # Boot time of the launch options: more cores and RAM are faster, software GPU is slower
+    boot_seconds = setting("FAKE_BOOT_SECONDS", 3) * (2 / int(option("-cores", 2))) ** 0.5
+    boot_seconds *= 1.3 if int(option("-memory", 2048)) < 2048 else 1.0
+    boot_seconds *= {"swiftshader_indirect": 1.15, "off": 0.9}.get(gpu, 1.0)
+    boot_seconds *= 0.95 if "-no-audio" in args else 1.0
+    if gpu == "off" and avd == "A15": # Needs a renderer
+        boot_seconds = float("inf")
+    boot_seconds *= 1 + (int(hashlib.sha256(f"{avd}{port}{time.time()}".encode()).hexdigest(), 16) % 100) / 1000 # Noise
+
+    save_state(serial, {"avd": avd, "boot_started": time.time(), "packages": {}, "stopping": None,
+                        "pid": os.getpid(), "boot_seconds": boot_seconds})
+    shutil.rmtree(device_file(serial, ""), ignore_errors = True) # -wipe-data
+
+    # Runs until 'adb emu kill'
+    while True:
+        state = load_state(serial)
+        if state is None:
+            return 0
+        if state["stopping"] is not None and time.time() >= state["stopping"]:
+            os.remove(state_path(serial))
+            return 0
+        time.sleep(0.1)
+
+# ----- aapt -----
+def fake_aapt(args: list[str]) -> int:
+    time.sleep(setting("FAKE_AAPT_SECONDS", 0.05))
+    try:
+        manifest = read_manifest(args[-1])
+    except (OSError, KeyError, zp.BadZipFile):
+        print(f"ERROR: dump failed because no AndroidManifest.xml found", file = sys.stderr)
+        return 1
+
+    print(f"package: name='{manifest['package']}' versionCode='1' versionName='1.0'")
+    if manifest.get("min_sdk") is not None:
+        print(f"sdkVersion:'{manifest['min_sdk']}'")
+    if manifest.get("target_sdk") is not None:
+        print(f"targetSdkVersion:'{manifest['target_sdk']}'")
+    print(f"application-label:'{manifest['package']}'")
+    print(f"launchable-activity: name='{manifest['package']}.MainActivity'  label='' icon=''")
+    return 0
+
+# ----- adb -----
+def fake_adb(args: list[str]) -> int:
+    time.sleep(setting("FAKE_ADB_LATENCY", 0.01))
+
+    serial = None
+    if args[:1] == ["-s"]:
+        serial, args = args[1], args[2:]
+
+    command = args[0] if args else ""
+    if command == "devices":
+        print("List of devices attached")
+        for running in running_serials():
+            state = load_state(running)
+            if state is not None:
+                print(f"{running}\tdevice")
+        return 0
+
+    if command == "wait-for-device": # Waits until ADB can reach the emulator, then runs the rest of the command
+        while True:
+            states = [load_state(running) for running in running_serials()] if serial is None else [load_state(serial)]
+            if any(state is not None and time.time() - state["boot_started"] >= setting("FAKE_ADBD_SECONDS", 1)
+                   for state in states):
+                break
+            time.sleep(0.1)
+        if len(args) == 1:
+            return 0
+        args = args[1:]
+        command = args[0]
+
+    if serial is None:
+        serials = running_serials()
+        if len(serials) != 1:
+            print("error: no devices/emulators found" if not serials else "error: more than one device/emulator",
+                  file = sys.stderr)
+            return 1
+        serial = serials[0]
+
+    state = load_state(serial)
+    if state is None:
+        print(f"error: device '{serial}' not found", file = sys.stderr)
+        return 1
+
+    booted = is_booted(state)
+
+    if command == "get-state":
+        print("device")
+        return 0
+
+    if command == "emu" and args[1:] == ["kill"]:
+        state["stopping"] = time.time() + setting("FAKE_SHUTDOWN_SECONDS", 0.5)
+        save_state(serial, state)
+        print("OK: killing emulator, bye bye")
+        return 0
+
+    if command == "push":
+        apk_path, remote_path = args[1], args[2]
+        time.sleep(os.path.getsize(apk_path) / 2**20 * setting("FAKE_PUSH_SECONDS_PER_MB", 0.05))
+        if load_state(serial) is None: # Emulator was shut down during the copy
+            print(f"adb: error: failed to copy '{apk_path}' to '{remote_path}': device offline", file = sys.stderr)
+            return 1
+        os.makedirs(device_file(serial, ""), exist_ok = True)
+        shutil.copyfile(apk_path, device_file(serial, remote_path))
+        print(f"{apk_path}: 1 file pushed, 0 skipped.")
+        return 0
+
+    if command == "install": # Push, then install
+        apk_path = args[-1]
+        time.sleep(os.path.getsize(apk_path) / 2**20 * setting("FAKE_PUSH_SECONDS_PER_MB", 0.05))
+        print("Performing Streamed Install")
+        if not fake_pm_install(serial, state, apk_path, booted):
+            print("adb: failed to install: Failure [INSTALL_FAILED_NO_MATCHING_ABIS]")
+            return 1
+        print("Success")
+        return 0
+
+    if command == "logcat":
+        for package, info in state["packages"].items():
+            if info["crashed"]:
+                print(f"E AndroidRuntime: FATAL EXCEPTION: main Process: {package}, PID: 4242")
+        return 0
+
+    if command == "shell":
+        return fake_adb_shell(serial, state, args[1:])
+
+    print(f"fake adb: unsupported command {args}", file = sys.stderr)
+    return 1
+
+def fake_adb_shell(serial: str, state: dict, args: list[str]) -> int:
+    booted = is_booted(state)
+
+    if len(args) == 1 and " " in args[0]: # Command line for the device shell
+        script = args[0]
+        if script.startswith("pkg="): # Health probe of app_launch.py
+            return run_device_script(serial, script)
+        code = 0
+        for command in script.split(";"):
+            code = fake_adb_shell(serial, state, shlex.split(command))
+        return code
+
+    if args[:2] == ["pm", "install"]:
+        apk_path = device_file(serial, args[-1])
+        if not booted:
+            print("Error: Could not access the Package Manager.  Is the system running?")
+            return 1
+        if not os.path.isfile(apk_path):
+            print(f"Failure [INSTALL_FAILED_INVALID_URI]")
+            return 1
+        if not fake_pm_install(serial, state, apk_path, booted):
+            print("Failure [INSTALL_FAILED_NO_MATCHING_ABIS]")
+            return 1
+        print("Success")
+        return 0
+
+    if args[:2] == ["rm", "-f"]:
+        for remote_path in args[2:]:
+            if os.path.exists(device_file(serial, remote_path)):
+                os.remove(device_file(serial, remote_path))
+        return 0
+
+    if args[:2] == ["date", "+%s"]:
+        print(int(time.time()))
+        return 0
+
+    if args[:2] == ["getprop", "sys.boot_completed"]:
+        print("1" if booted else "")
+        return 0
+
+    if args[:1] == ["monkey"]:
+        package = args[args.index("-p") + 1]
+        if package not in state["packages"]:
+            print(f"** No activities found to run, monkey aborted.")
+            return 252
+        fake_launch(serial, state, package)
+        print("Events injected: 1")
+        return 0
+
+    if args[:3] == ["am", "start", "-W"]:
+        component = args[args.index("-n") + 1]
+        package = component.split("/")[0]
+        print(f"Starting: Intent {{ act=android.intent.action.MAIN cat=[android.intent.category.LAUNCHER] cmp={component} }}")
+        if package not in state["packages"]:
+            print(f"Error: Activity class {{{component}}} does not exist.")
+            return 1
+        fake_launch(serial, state, package)
+        print("Status: ok")
+        print(f"Activity: {component}")
+        print(f"ThisTime: {cold_start_ms(package)}")
+        print(f"TotalTime: {cold_start_ms(package)}")
+        print(f"WaitTime: {cold_start_ms(package) + 15}")
+        print("Complete")
+        return 0
+
+    if args[:3] == ["pm", "list", "packages"]:
+        for package in state["packages"]:
+            print(f"package:{package}")
+        return 0
+
+    if args[:1] == ["pidof"]:
+        info = state["packages"].get(args[1])
+        if info is None or info["pid"] is None:
+            return 1
+        print(info["pid"])
+        return 0
+
+    if args[:2] == ["pm", "path"]:
+        if args[2] not in state["packages"]:
+            return 1
+        print(f"package:/data/app/{args[2]}-1/base.apk")
+        return 0
+
+    if args[:2] == ["logcat", "-d"]:
+        for package, info in state["packages"].items():
+            if info["crashed"]:
+                print(f"E AndroidRuntime: FATAL EXCEPTION: main Process: {package}, PID: 4242")
+        return 0
+
+    if args[:2] == ["cat", "/proc/uptime"]:
+        uptime = time.time() - state["boot_started"]
+        print(f"{uptime:.2f} {uptime * 2:.2f}")
+        return 0
+
+    if args[:1] == ["cat"] and args[1].startswith("/proc/"):
+        return fake_proc_file(state, args[1])
+
+    if args[:2] == ["dumpsys", "meminfo"]:
+        package = package_of_pid(state, args[2])
+        if package is None:
+            print(f"No process found for: {args[2]}")
+            return 0
+        pss_kb = fake_pss_kb(package)
+        print("Applications Memory Usage (in Kilobytes):")
+        print(f"** MEMINFO in pid {args[2]} [{package}] **")
+        print("                   Pss  Private  Private  SwapPss     Heap     Heap     Heap")
+        print("                 Total    Dirty    Clean    Dirty     Size    Alloc     Free")
+        print(f"  Native Heap     {pss_kb // 4}    {pss_kb // 4}        0        0    16384    12288     4096")
+        print(f"        TOTAL    {pss_kb}    {pss_kb // 2}        0        0    {pss_kb * 2}        0        0")
+        print(" App Summary")
+        print(f"           TOTAL PSS:    {pss_kb}            TOTAL RSS:    {pss_kb * 2}       TOTAL SWAP PSS:        0")
+        return 0
+
+    print(f"fake adb: unsupported shell command {args}", file = sys.stderr)
+    return 1
+
+def cold_start_ms(package: str) -> int:
+    # Deterministic cold start time between 200 and 2000 ms
+    return 200 + int(hashlib.sha256(package.encode()).hexdigest(), 16) % 1800
+
+def fake_launch(serial: str, state: dict, package: str):
+    crashed = chance(f"crash:{package}", setting("FAKE_CRASH_RATE", 0.1))
+    state["packages"][package] = {"pid": None if crashed else 4242 + len(state["packages"]), "crashed": crashed,
+                                  "started": time.time()}
+    save_state(serial, state)
+
+# Commands of the device that scripts run by run_device_script call back to this fake adb
+DEVICE_COMMANDS = ("pm", "pidof", "logcat", "cat", "dumpsys")
+
+def run_device_script(serial: str, script: str) -> int:
+    """
+    Runs a device shell script with the shell of the host, like 'adb shell' does on the device.
+    The device commands are shell functions that call this fake adb (the toolbox of the device
+    is not emulated: 'head', 'grep' or 'cut' in the script would run on the host).
+    """
+
+    shims = "".join(f'{name}() {{ "{os.path.abspath(sys.argv[0])}" -s {serial} shell {name} "$@"; }}; ' for name in DEVICE_COMMANDS)
+    return sp.run(["sh", "-c", shims + script]).returncode
+
+def package_of_pid(state: dict, pid: str) -> str | None:
+    return next((package for package, info in state["packages"].items() if str(info["pid"]) == pid), None)
+
+def fake_pss_kb(package: str) -> int:
+    # Memory use derived from the package name, stable between runs
+    return 20000 + cold_start_ms(package) * 40
+
+def fake_proc_file(state: dict, path: str) -> int:
+    parts = path.split("/") # ['', 'proc', pid, file]
+    package = package_of_pid(state, parts[2]) if len(parts) == 4 else None
+    if package is None:
+        print(f"cat: {path}: No such file or directory", file = sys.stderr)
+        return 1
+
+    if parts[3] == "status":
+        print(f"Name:\t{package[-15:]}")
+        print("State:\tS (sleeping)")
+        print(f"Pid:\t{parts[2]}")
+        print(f"VmRSS:\t{fake_pss_kb(package) * 2} kB")
+        return 0
+    if parts[3] == "stat":
+        info = state["packages"][package]
+        start_ticks = int((info.get("started", time.time()) - state["boot_started"]) * 100)
+        cpu_ticks = cold_start_ms(package) // 10
+        fields = ["S", "1"] + ["0"] * 9 + [str(cpu_ticks), "0"] + ["0"] * 6 + [str(start_ticks)] + ["0"] * 20
+        print(f"{parts[2]} ({package}) {' '.join(fields)}")
+        return 0
+    print(f"cat: {path}: No such file or directory", file = sys.stderr)
+    return 1
+
+TOOLS = {
+    "ssh": fake_ssh,
+    "emulator": fake_emulator,
+    "aapt": fake_aapt,
+    "adb": fake_adb,
+}
+
+if __name__ == "__main__":
+    tool = os.path.basename(sys.argv[0])
+    if tool not in TOOLS:
+        print(f"Call this script through a symlink named one of: {', '.join(TOOLS)}", file = sys.stderr)
+        sys.exit(2)
+    sys.exit(TOOLS[tool](sys.argv[1:]))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Local HTTP server that mimics the VirusTotal v2 API ('/vtapi/v2/file/report' and '/vtapi/v2/file/scan'),
+including the '204 No Content' answer when the request rate limit is reached.
+"""
+
+import argparse
+import hashlib
+import json
+import threading as th
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+ENGINES = [f"Engine{i}" for i in range(60)]
+
+class FakeVirusTotal:
+    """
+    State of the fake VirusTotal service.
+    """
+
+    def __init__(self, rate_limit: int = 4, rate_window: float = 60, known_rate: float = 0.7,
+                 scan_seconds: float = 5, seed: str = "0"):
+        """
+        Args:
+            rate_limit (int): Requests allowed per window (0 = unlimited).
+            rate_window (float): Length of the rate limit window in seconds.
+            known_rate (float): Share of hashes that were already scanned before.
+            scan_seconds (float): Time until an uploaded file has a report.
+            seed (str): Changes which hashes are known and how many engines flag them.
+        """
+
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.known_rate = known_rate
+        self.scan_seconds = scan_seconds
+        self.seed = seed
+        self.requests = deque() # Times of the requests inside the window
+        self.uploads = {} # Scan ID -> (sha256, upload time)
+        self.lock = th.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "uploads": 0}
+
+    def allow(self) -> bool:
+        """
+        Returns:
+            allowed (bool): False if the rate limit is reached.
+        """
+
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.time()
+            while self.requests and now - self.requests[0] > self.rate_window:
+                self.requests.popleft()
+            if self.rate_limit and len(self.requests) >= self.rate_limit:
+                self.stats["rate_limited"] += 1
+                return False
+            self.requests.append(now)
+            return True
+
+    def number(self, key: str) -> float:
+        digest = hashlib.sha256(f"{self.seed}:{key}".encode()).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32
+
+    def make_report(self, sha256_hash: str, scan_id: str) -> dict:
+        """
+        Returns a full report, with per-engine verdicts like the real API.
+        """
+
+        roll = self.number(f"positives:{sha256_hash}")
+        positives = 0 if roll < 0.6 else (1 + int(roll * 10) % 2 if roll < 0.8 else 3 + int(roll * 100) % 20)
+        scans = {engine: {"detected": i < positives, "version": "1.0", "update": "20250101",
+                          "result": "Android.Trojan" if i < positives else None}
+                 for i, engine in enumerate(ENGINES)}
+        return {"response_code": 1, "verbose_msg": "Scan finished, information embedded in this object",
+                "resource": sha256_hash, "scan_id": scan_id, "sha256": sha256_hash,
+                "scan_date": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+                "positives": positives, "total": len(ENGINES), "scans": scans}
+
+    def report(self, resource: str) -> dict:
+        with self.lock:
+            upload = self.uploads.get(resource)
+        if upload is not None: # Resource is a scan ID
+            sha256_hash, uploaded = upload
+            if time.time() - uploaded < self.scan_seconds:
+                return {"response_code": -2, "resource": resource, "verbose_msg": "Your resource is queued for analysis"}
+            return self.make_report(sha256_hash, resource)
+
+        if self.number(f"known:{resource}") < self.known_rate:
+            return self.make_report(resource, f"{resource}-1")
+        return {"response_code": 0, "resource": resource,
+                "verbose_msg": "The requested resource is not among the finished, queued or pending scans"}
+
+    def upload(self, content: bytes) -> dict:
+        sha256_hash = hashlib.sha256(content).hexdigest()
+        scan_id = f"{sha256_hash}-{int(time.time())}"
+        with self.lock:
+            self.uploads[scan_id] = (sha256_hash, time.time())
+            self.stats["uploads"] += 1
+        return {"response_code": 1, "scan_id": scan_id, "sha256": sha256_hash, "resource": scan_id,
+                "verbose_msg": "Scan request successfully queued, come back later for the report"}
+
+def make_handler(service: FakeVirusTotal):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, data: dict):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def rate_limited(self) -> bool:
+            if service.allow():
+                return False
+            self.send_response(204)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/vtapi/v2/file/report":
+                self.send_error(404)
+                return
+            if self.rate_limited():
+                return
+            params = parse_qs(url.query)
+            self.send_json(service.report(params.get("resource", [""])[0]))
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/vtapi/v2/file/scan":
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.rate_limited():
+                return
+
+            # Multipart form: takes the 'file' field
+            message = BytesParser(policy = default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            for part in message.iter_parts():
+                if part.get_param("name", header = "content-disposition") == "file":
+                    self.send_json(service.upload(part.get_payload(decode = True)))
+                    return
+            self.send_error(400)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_server(service: FakeVirusTotal, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Starts the fake VirusTotal server in a background thread.
+
+    Args:
+        service (FakeVirusTotal): State of the service.
+        port (int): Port to listen on (0 = any free port).
+    Returns:
+        server (ThreadingHTTPServer): The server; its port is 'server.server_address[1]'.
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(service))
+    server.daemon_threads = True
+    th.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Fake VirusTotal v2 API server.")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--rate-limit", type = int, default = 4, help = "Requests per window (0 = unlimited).")
+    parser.add_argument("--rate-window", type = float, default = 60)
+    parser.add_argument("--known-rate", type = float, default = 0.7)
+    parser.add_argument("--scan-seconds", type = float, default = 5)
+    args = parser.parse_args()
+
+    server = start_server(FakeVirusTotal(args.rate_limit, args.rate_window, args.known_rate, args.scan_seconds), args.port)
+    print(f"Fake VirusTotal listening on http://127.0.0.1:{server.server_address[1]}/vtapi/v2/")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
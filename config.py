@@ -12,6 +12,13 @@ EMULATOR_PATH = os.path.expanduser(_config["Paths"]["EMULATOR_PATH"])
 ADB_PATH = os.path.expanduser(_config["Paths"]["ADB_PATH"])
 AAPT_PATH = os.path.expanduser(_config["Paths"]["AAPT_PATH"])
 
+# Emulator parameters
+EMULATOR_BASE_PORT = int(_config["Emulator"]["BASE_PORT"])
+PREBOOT = _config["Emulator"].getboolean("PREBOOT")
+PUSH_DURING_BOOT = _config["Emulator"].getboolean("PUSH_DURING_BOOT")
+EMULATOR_GPU = _config["Emulator"]["GPU"]
+PROFILES_FILE = _config["Emulator"]["PROFILES_FILE"]
+
 # VirusTotal API parameters
 API_KEY = os.getenv("API_KEY")
 API_SCAN_URL = _config["API_URLs"]["API_SCAN_URL"]
@@ -23,6 +30,8 @@ SSH_KEY_PATH = os.path.expanduser(os.getenv("SSH_KEY_PATH"))
 # Files
 STATS_FILE = _config["Files"]["STATS_FILE"]
 ERRORS_FILE = _config["Files"]["ERRORS_FILE"]
+TIMINGS_FILE = _config["Files"]["TIMINGS_FILE"]
+CORPUS_DIR = _config["Files"]["CORPUS_DIR"]
 
 # APK Test parameters
 MAX_APK_NB_TA = int(_config["APK_Test"]["MAX_APK_NB_TA"])
@@ -31,6 +40,61 @@ MAX_APK_NB_TA = int(_config["APK_Test"]["MAX_APK_NB_TA"])
 MAX_APK_NB_VS = int(_config["Virus_Scan"]["MAX_APK_NB_VS"])
 MAX_ATTEMPT = int(_config["Virus_Scan"]["MAX_ATTEMPT"])
 COOLDOWN = int(_config["Virus_Scan"]["COOLDOWN"])
+VT_DAILY_QUOTA = int(_config["Virus_Scan"]["VT_DAILY_QUOTA"])
+CSV_LABEL_MAX_AGE_DAYS = int(_config["Virus_Scan"]["CSV_LABEL_MAX_AGE_DAYS"])
+STORE_VT_REPORTS = _config["Virus_Scan"].getboolean("STORE_REPORTS")
+
+# Labels of scanned APKs
+LABEL_SUSPICIOUS_MIN = int(_config["Labels"]["SUSPICIOUS_MIN"])
+LABEL_MALICIOUS_MIN = int(_config["Labels"]["MALICIOUS_MIN"])
+LABEL_ENGINES = [engine.strip() for engine in _config["Labels"]["ENGINES"].split(",") if engine.strip()]
+
+# Index of processed hashes
+SKIP_DUPLICATES = _config["Duplicates"].getboolean("SKIP")
+INDEX_BITS_PER_HASH = int(_config["Duplicates"]["BITS_PER_HASH"])
+
+# Scratch directories of the workers
+SCRATCH = _config["Scratch"]["SCRATCH"]
+SCRATCH_TMPFS_DIR = _config["Scratch"]["TMPFS_DIR"]
+SCRATCH_DISK_DIR = _config["Scratch"]["DISK_DIR"]
+SCRATCH_MIN_FREE_MB = int(_config["Scratch"]["MIN_FREE_MB"])
+
+# File downloader
+TIMEOUT = int(_config["Downloader"]["TIMEOUT"])
+TIMEOUT_FACTOR = float(_config["Downloader"]["TIMEOUT_FACTOR"])
+MIN_SPEED_KB = float(_config["Downloader"]["MIN_SPEED_KB"])
+MAX_DOWNLOAD_ATTEMPTS = int(_config["Downloader"]["MAX_DOWNLOAD_ATTEMPTS"])
+RESUME = _config["Downloader"].getboolean("RESUME")
+
+# Retries of temporary errors
+RETRY_MAX_ATTEMPTS = int(_config["Retry"]["MAX_ATTEMPTS"])
+RETRY_BASE_DELAY = float(_config["Retry"]["BASE_DELAY"])
+RETRY_MAX_DELAY = float(_config["Retry"]["MAX_DELAY"])
+
+# Adaptive concurrency
+ADAPTIVE = _config["Resources"].getboolean("ADAPTIVE")
+MIN_EMULATORS = int(_config["Resources"]["MIN_EMULATORS"])
+MAX_EMULATORS = int(_config["Resources"]["MAX_EMULATORS"])
+MIN_SCAN_WORKERS = int(_config["Resources"]["MIN_SCAN_WORKERS"])
+MAX_SCAN_WORKERS = int(_config["Resources"]["MAX_SCAN_WORKERS"])
+EMULATOR_RAM_MB = int(_config["Resources"]["EMULATOR_RAM_MB"])
+SCAN_WORKER_RAM_MB = int(_config["Resources"]["SCAN_WORKER_RAM_MB"])
+MIN_FREE_RAM_MB = int(_config["Resources"]["MIN_FREE_RAM_MB"])
+MIN_FREE_DISK_MB = int(_config["Resources"]["MIN_FREE_DISK_MB"])
+MAX_CPU_PERCENT = float(_config["Resources"]["MAX_CPU_PERCENT"])
+MAX_LOAD_PER_CPU = float(_config["Resources"]["MAX_LOAD_PER_CPU"])
+SCALE_INTERVAL = int(_config["Resources"]["SCALE_INTERVAL"])
+SCALING_LOG = _config["Resources"]["SCALING_LOG"]
+
+# Profiling (environment variable has priority over config.ini)
+PROFILING = _config["Profiling"].getboolean("ENABLED")
+if os.getenv("APK_OBSERVER_PROFILE"):
+    PROFILING = os.getenv("APK_OBSERVER_PROFILE").lower() in ("1", "yes", "true", "on")
+PROFILE_DIR = _config["Profiling"]["PROFILE_DIR"]
 
-# Timeout for file downloader
-TIMEOUT = int(_config["Downloader"]["TIMEOUT"])
\ No newline at end of file
+# Performance metrics
+THROUGHPUT_WINDOW = int(_config["Metrics"]["THROUGHPUT_WINDOW"])
+METRICS_HOST = _config["Metrics"]["METRICS_HOST"]
+METRICS_PORT = int(_config["Metrics"]["METRICS_PORT"])
+METRICS_FILE = _config["Metrics"]["METRICS_FILE"]
+METRICS_INTERVAL = int(_config["Metrics"]["METRICS_INTERVAL"])
\ No newline at end of file
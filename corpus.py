@@ -0,0 +1,326 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import numpy as np
+from config import CORPUS_DIR
+
+CSV_PATH = "latest.csv"
+CHUNK_ROWS = 200_000 # Rows converted at once
+
+# Column name -> (type, value for a missing field)
+COLUMNS = {
+    "sha256": ("V32", None), # Raw hash bytes
+    "apk_size": ("int64", -1),
+    "dex_date": ("datetime64[D]", "NaT"),
+    "vt_detection": ("int16", -1),
+    "vt_scan_date": ("datetime64[D]", "NaT"),
+    "markets": ("uint64", 0), # Bit N is set if the APK is in market N (see 'markets' in meta.json)
+}
+
+def csv_signature(csv_path: str) -> dict:
+    """
+    Returns:
+        signature (dict): Size and modification time of the CSV file (to detect a newer 'latest.csv').
+    """
+
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+def convert_chunk(rows: list[list[str]], index: dict, markets: dict) -> dict:
+    """
+    Converts rows of 'latest.csv' to column arrays.
+
+    Args:
+        rows (list[list[str]]): Rows of the CSV file.
+        index (dict): Column name -> position in the row.
+        markets (dict): Market name -> bit number (new markets are added).
+    Returns:
+        columns (dict): Column name -> array.
+    """
+
+    def market_mask(field: str) -> int:
+        mask = 0
+        for market in filter(None, field.split("|")):
+            if market not in markets:
+                if len(markets) == 64:
+                    raise RuntimeError("ERROR: More than 64 markets in 'latest.csv'.")
+                markets[market] = len(markets)
+            mask |= 1 << markets[market]
+        return mask
+
+    def dates(position: int) -> np.ndarray:
+        return np.array([row[position][:10] or "NaT" for row in rows], dtype = "datetime64[D]")
+
+    return {
+        "sha256": np.frombuffer(b"".join(bytes.fromhex(row[index["sha256"]]) for row in rows), dtype = "V32"),
+        "apk_size": np.array([int(row[index["apk_size"]] or -1) for row in rows], dtype = "int64"),
+        "dex_date": dates(index["dex_date"]),
+        "vt_detection": np.array([int(row[index["vt_detection"]] or -1) for row in rows], dtype = "int16"),
+        "vt_scan_date": dates(index["vt_scan_date"]),
+        "markets": np.array([market_mask(row[index["markets"]]) for row in rows], dtype = "uint64"),
+    }
+
+def build_corpus(csv_path: str = CSV_PATH, corpus_dir: str = CORPUS_DIR) -> int:
+    """
+    Converts 'latest.csv' to one memory-mappable file per column (one pass over the CSV file).
+    The new corpus replaces the old one only when it is complete.
+
+    Args:
+        csv_path (str): Path to 'latest.csv'.
+        corpus_dir (str): Output directory.
+    Returns:
+        rows (int): Number of converted rows.
+    """
+
+    tmp_dir = corpus_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+
+    markets = {}
+    total = 0
+    files = {name: open(os.path.join(tmp_dir, f"{name}.bin"), "wb") for name in COLUMNS}
+    try:
+        with open(csv_path, "r", encoding = "utf-8") as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader)
+            index = {name: header.index(name) for name in COLUMNS}
+            index["sha256"] = 0 # SHA-256 is in first column
+
+            rows = []
+            for row in reader:
+                rows.append(row)
+                if len(rows) == CHUNK_ROWS:
+                    for name, array in convert_chunk(rows, index, markets).items():
+                        array.tofile(files[name])
+                    total += len(rows)
+                    rows = []
+            if rows:
+                for name, array in convert_chunk(rows, index, markets).items():
+                    array.tofile(files[name])
+                total += len(rows)
+    finally:
+        for f in files.values():
+            f.close()
+
+    meta = {"rows": total, "columns": {name: dtype for name, (dtype, _) in COLUMNS.items()},
+            "markets": sorted(markets, key = markets.get), "source": csv_signature(csv_path)}
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent = 2)
+
+    shutil.rmtree(corpus_dir, ignore_errors = True)
+    os.replace(tmp_dir, corpus_dir)
+    return total
+
+class Corpus:
+    """
+    Columns of 'latest.csv' (hash, size, dates, VirusTotal detections, markets) as memory-mapped arrays.\n
+    Row N - 1 holds APK number N. Filters are evaluated on whole columns with numpy, so selecting
+    APKs doesn't read the CSV file; only the pages of the used columns are read from disk.
+    """
+
+    def __init__(self, corpus_dir: str = CORPUS_DIR):
+        """
+        Args:
+            corpus_dir (str): Directory written by 'build_corpus'.
+        """
+
+        with open(os.path.join(corpus_dir, "meta.json")) as f:
+            meta = json.load(f)
+
+        self.rows = meta["rows"]
+        self.markets = meta["markets"]
+        self.source = meta["source"]
+        self.columns = {}
+        for name, dtype in meta["columns"].items():
+            path = os.path.join(corpus_dir, f"{name}.bin")
+            if self.rows == 0: # Empty files can't be memory-mapped
+                self.columns[name] = np.zeros(0, dtype = dtype)
+            else:
+                self.columns[name] = np.memmap(path, dtype = dtype, mode = "r", shape = (self.rows,))
+
+    def is_current(self, csv_path: str = CSV_PATH) -> bool:
+        """
+        Returns:
+            current (bool): False if 'latest.csv' has changed since the conversion (True if it was removed).
+        """
+
+        if not os.path.exists(csv_path):
+            return True
+        return csv_signature(csv_path) == self.source
+
+    def entry(self, app_number: int) -> dict | None:
+        """
+        Returns the row of an APK in the same form as the CSV file.
+
+        Args:
+            app_number (int): Number of the APK (row of 'latest.csv').
+        Returns:
+            One_of_Two:
+                - **entry** (dict): Column name -> value (string).
+                - **None**: If there is no such APK.
+        """
+
+        if not 1 <= app_number <= self.rows:
+            return None
+
+        row = app_number - 1
+        size = int(self.columns["apk_size"][row])
+        detection = int(self.columns["vt_detection"][row])
+        mask = int(self.columns["markets"][row])
+        date = lambda name: "" if np.isnat(self.columns[name][row]) else str(self.columns[name][row])
+        return {
+            "sha256": self.columns["sha256"][row].tobytes().hex().upper(),
+            "apk_size": "" if size < 0 else str(size),
+            "dex_date": date("dex_date"),
+            "vt_detection": "" if detection < 0 else str(detection),
+            "vt_scan_date": date("vt_scan_date"),
+            "markets": "|".join(market for bit, market in enumerate(self.markets) if mask >> bit & 1),
+        }
+
+    def select(self, markets: list[str] = None, date_from: str = None, date_to: str = None,
+               max_size_mb: float = None, min_detection: int = None, max_detection: int = None,
+               exclude_hashes: list[str] = None, first: int = 1, limit: int = None) -> np.ndarray:
+        """
+        Selects APKs with vectorized filters. Every filter is optional.
+
+        Args:
+            markets (list[str]): APK is in at least one of these markets.
+            date_from (str): Earliest DEX date ('YYYY-MM-DD', included).
+            date_to (str): Latest DEX date ('YYYY-MM-DD', included).
+            max_size_mb (float): Largest APK size in MB.
+            min_detection (int): Lowest VirusTotal detection count (APKs without a count are excluded).
+            max_detection (int): Highest VirusTotal detection count (APKs without a count are excluded).
+            exclude_hashes (list[str]): SHA-256 hashes to skip (e.g. already processed APKs).
+            first (int): Lowest APK number.
+            limit (int): Largest number of selected APKs.
+        Returns:
+            app_numbers (ndarray): Selected APK numbers in increasing order.
+        """
+
+        mask = np.ones(self.rows, dtype = bool)
+        if first > 1:
+            mask[:first - 1] = False
+        if markets:
+            unknown = [market for market in markets if market not in self.markets]
+            if unknown:
+                raise ValueError(f"Unknown market(s): {', '.join(unknown)}. Known: {', '.join(self.markets)}")
+            bits = np.uint64(sum(1 << self.markets.index(market) for market in markets))
+            mask &= (self.columns["markets"] & bits) != 0
+        if date_from:
+            mask &= self.columns["dex_date"] >= np.datetime64(date_from, "D")
+        if date_to:
+            mask &= self.columns["dex_date"] <= np.datetime64(date_to, "D")
+        if max_size_mb is not None:
+            size = self.columns["apk_size"]
+            mask &= (size >= 0) & (size <= max_size_mb * 2**20)
+        if min_detection is not None:
+            mask &= self.columns["vt_detection"] >= min_detection
+        if max_detection is not None:
+            detection = self.columns["vt_detection"]
+            mask &= (detection >= 0) & (detection <= max_detection)
+
+        rows = np.flatnonzero(mask)
+        if exclude_hashes: # Only compares the hashes of the rows that passed the other filters
+            excluded = np.frombuffer(b"".join(bytes.fromhex(h) for h in exclude_hashes), dtype = "V32")
+            rows = rows[~np.isin(self.columns["sha256"][rows], excluded)]
+        if limit is not None:
+            rows = rows[:limit]
+        return rows + 1
+
+_corpus = None
+_corpus_checked = False
+
+def load_corpus() -> Corpus | None:
+    """
+    Opens the corpus once per process.
+
+    Returns:
+        One_of_Two:
+            - **corpus** (Corpus): If it exists and matches 'latest.csv'.
+            - **None**: Otherwise ('latest.csv' is read instead).
+    """
+
+    global _corpus, _corpus_checked
+    if not _corpus_checked:
+        _corpus_checked = True
+        if os.path.exists(os.path.join(CORPUS_DIR, "meta.json")):
+            corpus = Corpus(CORPUS_DIR)
+            if corpus.is_current():
+                _corpus = corpus
+    return _corpus
+
+def processed_hashes(pipeline: str, db_path: str = "results.db") -> list[str]:
+    """
+    Returns:
+        hashes (list[str]): SHA-256 hashes already stored by APK Tester ('test') or Virus Scanner ('scan').
+    """
+
+    if not os.path.exists(db_path):
+        return []
+    table = "apk_info" if pipeline == "test" else "scan_results"
+    connection = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in connection.execute(f"SELECT DISTINCT sha256_hash FROM {table} WHERE sha256_hash IS NOT NULL")]
+    except sqlite3.OperationalError: # Table doesn't exist yet
+        return []
+    finally:
+        connection.close()
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Converts 'latest.csv' to a columnar corpus and selects APKs from it.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    build = commands.add_parser("build", help = "Converts 'latest.csv' (run again when it is updated).")
+    build.add_argument("--csv", default = CSV_PATH)
+
+    select = commands.add_parser("select", help = "Writes the numbers of the matching APKs (one per line).")
+    select.add_argument("--market", action = "append", help = "Market name (repeat for several markets).")
+    select.add_argument("--from", dest = "date_from", help = "Earliest DEX date (YYYY-MM-DD).")
+    select.add_argument("--to", dest = "date_to", help = "Latest DEX date (YYYY-MM-DD).")
+    select.add_argument("--max-size-mb", type = float)
+    select.add_argument("--min-detection", type = int, help = "Lowest vt_detection.")
+    select.add_argument("--max-detection", type = int, help = "Highest vt_detection.")
+    select.add_argument("--unprocessed", choices = ["test", "scan"], help = "Skips APKs already in results.db.")
+    select.add_argument("--first", type = int, default = 1, help = "Lowest APK number.")
+    select.add_argument("--limit", type = int)
+    select.add_argument("--output", default = "-", help = "Work list file for 'headless.py --work-list' (default: stdout).")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.command == "build":
+        rows = build_corpus(args.csv)
+        print(f"Converted {rows} rows to '{CORPUS_DIR}' in {time.time() - start_time:.1f}s.", file = sys.stderr)
+        sys.exit(0)
+
+    if not os.path.exists(os.path.join(CORPUS_DIR, "meta.json")):
+        print(f"No corpus found in '{CORPUS_DIR}'. Run 'python3 corpus.py build' first.", file = sys.stderr)
+        sys.exit(1)
+    corpus = Corpus(CORPUS_DIR)
+    if not corpus.is_current():
+        print("Warning: 'latest.csv' has changed since the conversion. Run 'python3 corpus.py build' again.", file = sys.stderr)
+
+    try:
+        app_numbers = corpus.select(args.market, args.date_from, args.date_to, args.max_size_mb,
+                                    args.min_detection, args.max_detection,
+                                    processed_hashes(args.unprocessed) if args.unprocessed else None,
+                                    args.first, args.limit)
+    except ValueError as e:
+        print(f"ERROR: {e}", file = sys.stderr)
+        sys.exit(2)
+
+    text = "".join(f"{number}\n" for number in app_numbers.tolist())
+    if args.output == "-":
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(f"Selected {len(app_numbers)} of {corpus.rows} APKs in {time.time() - start_time:.2f}s.", file = sys.stderr)
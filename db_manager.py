@@ -1,5 +1,16 @@
 import sqlite3
 from datetime import datetime, timezone
+from analytics import create_tables as create_analytics_tables, record_test
+from scan_db_manager import create_table as create_scan_table
+
+# Performance of the app: cold start (from 'am start -W'), memory and CPU use after the launch
+PERFORMANCE_COLUMNS = {
+    "cold_start_ms": "INTEGER",
+    "wait_time_ms": "INTEGER",
+    "pss_kb": "INTEGER",
+    "rss_kb": "INTEGER",
+    "cpu_percent": "REAL",
+}
     
 def create_table(cursor):
     """
@@ -23,9 +34,26 @@ def create_table(cursor):
             "positives INTEGER," +
             "total_engines INTEGER," +
             "test_time TEXT," +
-            "scan_time TEXT)"
+            "scan_time TEXT," +
+            "cold_start_ms INTEGER," +
+            "wait_time_ms INTEGER," +
+            "pss_kb INTEGER," +
+            "rss_kb INTEGER," +
+            "cpu_percent REAL)"
     )
 
+    # Databases created before the performance of apps was stored
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(apk_info)")]
+    for column, column_type in PERFORMANCE_COLUMNS.items():
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE apk_info ADD COLUMN {column} {column_type}")
+
+    # Lookups of processed hashes (see hash_index.py)
+    cursor.execute("CREATE INDEX IF NOT EXISTS apk_info_sha256_hash ON apk_info (sha256_hash)")
+
+    # Native libraries and summary tables (see analytics.py)
+    create_analytics_tables(cursor)
+
 def insert_row(cursor, connection, data: dict):
     """
     Inserts a record to 'apk_info' table
@@ -38,13 +66,18 @@ def insert_row(cursor, connection, data: dict):
 
     cursor.execute(
         "INSERT INTO apk_info (apk_name, sha256_hash, min_sdk_version, sdk_version, max_sdk_version," + 
-        "native_libs, outcome, scan_label, positives, total_engines, test_time, scan_time)" + 
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", 
+        "native_libs, outcome, scan_label, positives, total_engines, test_time, scan_time," + 
+        "cold_start_ms, wait_time_ms, pss_kb, rss_kb, cpu_percent)" + 
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", 
             (data["apk_name"], data["sha256_hash"], data["min_sdk_version"], 
             data["sdk_version"], data["max_sdk_version"], data["native_libs"], 
             data["outcome"], data["scan_label"], data["positives"], 
-            data["total_engines"], data["test_time"], data["scan_time"]))
-        
+            data["total_engines"], data["test_time"], data["scan_time"],
+            data["cold_start_ms"], data["wait_time_ms"], data["pss_kb"], 
+            data["rss_kb"], data["cpu_percent"]))
+
+    # Updates the summary tables in the same transaction
+    record_test(cursor, cursor.lastrowid, data)
     connection.commit()
 
 def insert_scan_results(cursor, connection, sha256_hash: str):
@@ -85,8 +118,9 @@ def db_main(data, pipe_connection):
     connection = sqlite3.connect("results.db")
     cursor = connection.cursor()
 
-    # Creates a table (if doesn't exist)
+    # Creates the tables (if they don't exist). Scan results table is needed to join the results
     create_table(cursor)
+    create_scan_table(cursor)
 
     # Inserts the data for a file
     insert_row(cursor, connection, data)
@@ -1,59 +1,220 @@
 import subprocess as sp
 import sys
+import os
 import csv
-from config import TIMEOUT, SSH_KEY_PATH
+import time
+import select
+import hashlib
+from metrics import stage_timer
+from corpus import load_corpus
+from errors import TransientError, EndOfDataError
+from config import TIMEOUT, TIMEOUT_FACTOR, MIN_SPEED_KB, MAX_DOWNLOAD_ATTEMPTS, RESUME, SSH_KEY_PATH
 
-def retrieve_hash(app_number: int) -> str:
+CHUNK_SIZE = 1024 * 1024
+throughput = None # Observed download speed in bytes per second (moving average of this process)
+
+def retrieve_entry(app_number: int) -> dict:
     """
-    Opens the CSV file and retrieves the SHA-256 hash of the required APK file.
+    Opens the CSV file and retrieves the row of the required APK file.
     
     Args:
         app_number (int): The app number from the list.
     Returns:
-        sha256_hash (str): SHA-256 hash of the APK file.
+        entry (dict): Column name -> value ('sha256', 'vt_detection', 'vt_scan_date', ...).
+    Raises:
+        EndOfDataError: If the file has no such row.
     """
 
+    # Columnar corpus: direct access to the row instead of reading the CSV file up to it
+    corpus = load_corpus()
+    if corpus is not None:
+        entry = corpus.entry(app_number)
+        if entry is None:
+            raise EndOfDataError(f"File {app_number} is past the end of 'latest.csv'.")
+        return entry
+
     try:
         with open('latest.csv', 'r', encoding='utf-8') as csvfile:
             reader = csv.reader(csvfile)
-            next(reader) # Skips the header
+            header = next(reader)
             for i, row in enumerate(reader, 1):
                 if i == app_number:
-                    return row[0] # SHA-256 is in first column
+                    entry = dict(zip(header, row))
+                    entry["sha256"] = row[0] # SHA-256 is in first column
+                    return entry
     except FileNotFoundError:
         connection.send(("current", "ERROR: 'latest.csv' file not found."))
         sys.exit(1)
 
+    raise EndOfDataError(f"File {app_number} is past the end of 'latest.csv'.")
+
+def retrieve_hash(app_number: int) -> str:
+    """
+    Opens the CSV file and retrieves the SHA-256 hash of the required APK file.
+    
+    Args:
+        app_number (int): The app number from the list.
+    Returns:
+        sha256_hash (str): SHA-256 hash of the APK file.
+    Raises:
+        EndOfDataError: If the file has no such row.
+    """
+
+    return retrieve_entry(app_number)["sha256"]
+
+def get_apk_size(entry: dict) -> int | None:
+    """
+    Returns:
+        apk_size (int): Size of the APK in bytes from its row of the CSV file (None if unknown).
+    """
+
+    size = entry.get("apk_size", "")
+    return int(size) if size.isdigit() else None
+
+def check_ssh():
+    """
+    Checks if the SSH key is added to the agent.
+    """
+
+    result = sp.run(["ssh-add", "-l"], stdout = sp.PIPE, stderr = sp.DEVNULL)
+    if result.returncode != 0:
+        print("ERROR: SSH key is not added to the agent.")
+        sys.exit(1)
+
 connection = None
 
-def download_apk(app_number: int, apk_path: str, conn) -> str:
+def estimate_timeout(remaining: int | None) -> float | None:
     """
-    Downloads APK from AndroZoo using the provided SHA-256 hash.
+    Derives the time limit of a transfer from the expected size and the throughput of earlier downloads.
+
+    Args:
+        remaining (int): Bytes left to download (None if the size is unknown).
+    Returns:
+        One_of_Two:
+            - **timeout** (float): Seconds allowed for the transfer.
+            - **None**: If the size is unknown (only stalls are detected).
+    """
+
+    if remaining is None:
+        return None
+    speed = max(throughput or 0, MIN_SPEED_KB * 1024) # Bytes per second
+    return TIMEOUT + TIMEOUT_FACTOR * remaining / speed
+
+def transfer(sha256_hash: str, part_path: str, offset: int, digest, remaining: int | None) -> tuple[bool, str]:
+    """
+    Streams the APK from AndroZoo to the end of the temporary file while hashing it.
+
+    Args:
+        sha256_hash (str): SHA-256 hash of the APK.
+        part_path (str): Temporary file.
+        offset (int): Bytes already in the temporary file (resumed from there).
+        digest (hashlib object): SHA-256 of the bytes already in the temporary file.
+        remaining (int): Expected number of bytes left (None if unknown).
+    Returns:
+        result (tuple[bool, str]): True if the stream ended normally, otherwise False and the reason.
+    """
+
+    global throughput
+
+    request = f"{sha256_hash} {offset}\n" if offset else f"{sha256_hash}\n"
+    process = sp.Popen(["ssh", "-i", SSH_KEY_PATH, "benoit@pierregraux.fr"],
+                       stdin = sp.PIPE, stdout = sp.PIPE, stderr = sp.DEVNULL)
+    process.stdin.write(request.encode())
+    process.stdin.close()
+
+    start_time = time.time()
+    timeout = estimate_timeout(remaining)
+    received = 0
+    try:
+        with open(part_path, "ab") as f:
+            while True:
+                # Stops when no data arrives for TIMEOUT seconds or the whole transfer takes too long
+                time_left = None if timeout is None else start_time + timeout - time.time()
+                if time_left is not None and time_left <= 0:
+                    return False, "timed out"
+                wait = TIMEOUT if time_left is None else min(TIMEOUT, time_left)
+                if not select.select([process.stdout], [], [], wait)[0]:
+                    return False, "timed out" if wait < TIMEOUT else "stalled"
+
+                chunk = os.read(process.stdout.fileno(), CHUNK_SIZE)
+                if not chunk: # End of the stream
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+
+        # Throughput of this link (moving average), used for the next time limits
+        elapsed = time.time() - start_time
+        if received and elapsed > 0:
+            speed = received / elapsed
+            throughput = speed if throughput is None else 0.7 * throughput + 0.3 * speed
+
+    if process.returncode != 0:
+        return False, f"SSH exited with code {process.returncode}"
+    return True, ""
+
+def download_apk(app_number: int, apk_path: str, conn, sha256_hash: str = None, apk_size: int = None) -> str:
+    """
+    Downloads APK from AndroZoo using the provided SHA-256 hash.\n
+    The file is written to '<apk_path>.part' while it is hashed. An interrupted transfer is resumed
+    from the last received byte (if RESUME is enabled). The file is moved to 'apk_path' only when
+    its hash matches.
 
     Args:
         app_number (int): Number of the app from the CSV file.
         apk_path (str): Output file path.
         conn (Connection): Pipe connection for sending data.
+        sha256_hash (str): SHA-256 hash of the APK, if it was already retrieved from the CSV file.
+        apk_size (int): Expected size of the APK in bytes ('apk_size' of the CSV file), if it is known.
 
     Returns:
         sha256_hash (str): SHA-256 hash of the APK.
+    Raises:
+        TransientError: If the APK couldn't be downloaded intact after MAX_DOWNLOAD_ATTEMPTS.
     """
 
     global connection
     connection = conn
 
-    # Opens CSV file and returns the SHA-256 hash of the file
-    sha256_hash = retrieve_hash(app_number)
+    # Opens CSV file and returns the SHA-256 hash and the size of the file
+    if sha256_hash is None:
+        with stage_timer(connection, "hash_lookup"):
+            entry = retrieve_entry(app_number)
+        sha256_hash = entry["sha256"]
+        apk_size = get_apk_size(entry)
 
     # Downloads the APK
-    try:
-        connection.send(("current", f"Downloading file {app_number}..."))
-        sp.check_call(f"echo {sha256_hash} | ssh -i {SSH_KEY_PATH} benoit@pierregraux.fr > {apk_path}", shell = True, 
-                      stdout = sp.DEVNULL, stderr = sp.DEVNULL, timeout = TIMEOUT)
-        return sha256_hash
-    except sp.TimeoutExpired:   
-        connection.send(("current", "ERROR: SSH command timed out. Check that SSH key was added."))
-        sys.exit(1)
-    except sp.CalledProcessError:
-        connection.send(("current", "ERROR: SSH command failed."))
-        sys.exit(1)
\ No newline at end of file
+    connection.send(("current", f"Downloading file {app_number}..."))
+    part_path = f"{apk_path}.part"
+    with stage_timer(connection, "download"):
+        with open(part_path, "wb"): # Starts with an empty file
+            pass
+        digest = hashlib.sha256()
+        for attempt in range(1, MAX_DOWNLOAD_ATTEMPTS + 1):
+            offset = os.path.getsize(part_path)
+            remaining = max(apk_size - offset, 0) if apk_size else None
+            finished, reason = transfer(sha256_hash, part_path, offset, digest, remaining)
+
+            if finished and digest.hexdigest() == sha256_hash.lower():
+                os.replace(part_path, apk_path) # Publishes the complete file
+                return sha256_hash
+
+            if finished: # Whole stream received, but the content is wrong
+                connection.send(("count", "download_corrupt"))
+                reason = "hash mismatch"
+            connection.send(("current", f"Download of file {app_number} failed ({reason}).\nAttempt {attempt}/{MAX_DOWNLOAD_ATTEMPTS}."))
+
+            if finished or not RESUME: # Starts again from the first byte
+                with open(part_path, "wb"):
+                    pass
+                digest = hashlib.sha256()
+            elif os.path.getsize(part_path) > offset:
+                connection.send(("count", "download_resumed"))
+
+    os.remove(part_path)
+    raise TransientError(f"ERROR: Download of file {app_number} failed after {MAX_DOWNLOAD_ATTEMPTS} attempts.")
@@ -1,7 +1,59 @@
 import subprocess as sp
+import json
+import os
+import signal
+import threading as th
 import time
-import sys
-from config import ADB_PATH, EMULATOR_PATH
+from metrics import stage_timer
+from errors import TransientError
+from config import ADB_PATH, EMULATOR_PATH, EMULATOR_BASE_PORT, PUSH_DURING_BOOT, EMULATOR_GPU, PROFILES_FILE
+
+# Copy of the APK on the emulator, which is installed with 'pm install'
+REMOTE_APK_PATH = "/data/local/tmp/test.apk"
+
+# Time in seconds between two boot checks of the standby emulator
+STANDBY_CHECK_INTERVAL = 1
+
+# Emulators of this worker. Every worker has two ports: one for the emulator in use
+# and one for the standby emulator that boots in advance for the next APK (pre-boot)
+worker_ports = (EMULATOR_BASE_PORT, EMULATOR_BASE_PORT + 2)
+emulator_port = EMULATOR_BASE_PORT
+device_serial = f"emulator-{EMULATOR_BASE_PORT}"
+boot_started = None # Time when the emulator in use started booting
+handed_over = None # Time when the standby emulator was handed over (None if booted on demand)
+boot_done = None # Time when the standby emulator had booted, if it was booted when it was handed over
+standby = None # Standby emulator: {"avd": ..., "port": ..., "started": ..., "push": ..., "sha256": ..., "booted": ..., "watching": ...}
+apk_push = None # Process copying the APK to the emulator in use (None if not pushed during the boot)
+emulators = {} # Port -> emulator process started by this worker
+profiles = None # AVD -> launch profile tuned by 'emu_tuner.py' (loaded at the first launch)
+
+def select_device(worker_id: int, conn):
+    """
+    Selects the emulator port and serial number of a worker.
+
+    Args:
+        worker_id (int): ID of the worker.
+        conn (Connection): Pipe connection for sending data.
+    """
+
+    global worker_ports, emulator_port, device_serial, connection
+    connection = conn
+    # An emulator uses two ports (console and ADB), and a worker has two emulators
+    worker_ports = (EMULATOR_BASE_PORT + 4 * worker_id, EMULATOR_BASE_PORT + 4 * worker_id + 2)
+    emulator_port = worker_ports[0]
+    device_serial = f"emulator-{emulator_port}"
+
+def adb(*args: str) -> list[str]:
+    """
+    Builds an ADB command for the emulator of this worker.
+
+    Args:
+        args (str): ADB arguments.
+    Returns:
+        command (list[str]): Full command.
+    """
+
+    return [ADB_PATH, "-s", device_serial, *args]
 
 def choose_emulator(sdk_version: int) -> str:
     """
@@ -46,55 +98,305 @@ def get_devices() -> list[str]:
 
     return running_devices
 
-def wait_emulator_start(timeout: int = 300) -> bool:
+def wait_emulator_start(timeout: int = 300, interval: float = 2) -> bool:
     """
-    Waits for the emulator to fully boot by checking 'sys.boot_completed'.\n
-    If the emulator doesn't launch in 5 minutes, the program terminates. 
+    Waits for the emulator to fully boot by checking 'sys.boot_completed'.
 
     Args:
         timeout (int): Maximum time to wait in seconds.
+        interval (float): Time between two checks in seconds.
     Returns:
-        True/False (bool): True if boot completed, False if timeout exceeded.
+        True/False (bool): True if boot completed, False if timeout exceeded or the emulator
+            exited (e.g. its GPU mode is not supported by the host).
     """
 
     start_time = time.time()
-    sp.run([ADB_PATH, "wait-for-device"], stdout = sp.DEVNULL, stderr = sp.DEVNULL)
+    process = emulators.get(emulator_port)
     while time.time() - start_time < timeout:
+        if process is not None and process.poll() is not None:
+            return False
         try:
-            result = sp.run([ADB_PATH, "shell", "getprop", "sys.boot_completed"], stdout = sp.PIPE, stderr = sp.DEVNULL, text = True)
+            # Fails until ADB can reach the emulator
+            result = sp.run(adb("shell", "getprop", "sys.boot_completed"), stdout = sp.PIPE, stderr = sp.DEVNULL, 
+                            text = True, timeout = 30)
             if result.stdout.strip() == "1":
                 return True
         except Exception as e:
             connection.send(("current", f"Warning: Failed to check\nemulator boot status: {e}"))
-        time.sleep(2)
+        time.sleep(interval)
 
     return False
 
-def start_emulator(avd: str):
+def load_profiles() -> dict:
+    """
+    Returns:
+        profiles (dict): AVD -> launch profile saved by 'emu_tuner.py' (empty if not tuned yet).
+    """
+
+    global profiles
+    if profiles is None:
+        try:
+            with open(PROFILES_FILE) as f:
+                profiles = {avd: entry["profile"] for avd, entry in json.load(f).items()}
+        except FileNotFoundError:
+            profiles = {}
+    return profiles
+
+def profile_flags(profile: dict) -> list[str]:
+    """
+    Builds the emulator options of a launch profile. Missing settings keep the default
+    of the emulator (GPU: EMULATOR_GPU).
+
+    Args:
+        profile (dict): 'cores', 'memory' (MB), 'gpu', 'no_audio', 'cache_size' and 'partition_size' (MB).
+    Returns:
+        flags (list[str]): Emulator options.
+    """
+
+    flags = ["-gpu", profile.get("gpu") or EMULATOR_GPU]
+    if profile.get("cores"):
+        flags += ["-cores", str(profile["cores"])]
+    if profile.get("memory"):
+        flags += ["-memory", str(profile["memory"])]
+    if profile.get("no_audio"):
+        flags.append("-no-audio")
+    if profile.get("cache_size"):
+        flags += ["-cache-size", str(profile["cache_size"])]
+    if profile.get("partition_size"):
+        flags += ["-partition-size", str(profile["partition_size"])]
+    return flags
+
+def spawn_emulator(avd: str, port: int, profile: dict | None = None):
+    """
+    Launches an emulator in the background (without waiting for it to boot).
+
+    Args:
+        avd (str): Device to be launched.
+        port (int): Console port of the emulator.
+        profile (dict): Launch profile (None: the profile tuned for the AVD, if there is one).
+    """
+
+    if profile is None:
+        profile = load_profiles().get(avd, {})
+
+    # Own process group, so that the emulator and its children can be killed together
+    emulators[port] = sp.Popen([EMULATOR_PATH, "-avd", avd, "-port", str(port), 
+                                "-wipe-data", "-no-snapshot-load", "-no-snapshot-save", "-no-boot-anim", 
+                                "-netdelay", "none", 
+                                "-netspeed", "full", "-no-window", *profile_flags(profile)], 
+                               stdout = sp.DEVNULL, stderr = sp.DEVNULL, start_new_session = True)
+
+def kill_emulator(port: int):
+    """
+    Kills the emulator process of a port (if it is still running), e.g. when it doesn't boot
+    or doesn't shut down in time, so that the port can be used again.
+
+    Args:
+        port (int): Console port of the emulator.
+    """
+
+    process = emulators.pop(port, None)
+    if process is None:
+        return
+    if process.poll() is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.wait()
+
+def push_apk(apk_path: str, serial: str) -> sp.Popen | None:
+    """
+    Copies the APK to an emulator in the background. The copy starts as soon as ADB can reach
+    the emulator, so it runs while Android is still booting.
+
+    Args:
+        apk_path (str): Path to the APK file.
+        serial (str): Emulator's serial number.
+    Returns:
+        One_of_Two:
+            - **process** (Popen): Running 'adb push'.
+            - **None**: If pushing during the boot is disabled.
+    """
+
+    if not PUSH_DURING_BOOT:
+        return None
+    return sp.Popen([ADB_PATH, "-s", serial, "wait-for-device", "push", apk_path, REMOTE_APK_PATH], 
+                    stdout = sp.PIPE, stderr = sp.STDOUT, text = True)
+
+def stop_push(process: sp.Popen | None):
+    """
+    Stops a copy of the APK (if it is running).
+    """
+
+    if process is not None and process.poll() is None:
+        process.kill()
+    if process is not None:
+        process.communicate()
+
+def take_apk_push() -> sp.Popen | None:
+    """
+    Takes the copy of the APK to the emulator in use, so that it is installed from there.
+
+    Returns:
+        One_of_Two:
+            - **process** (Popen): 'adb push' of the APK (it may still be running).
+            - **None**: If the APK wasn't pushed during the boot.
+    """
+
+    global apk_push
+    process, apk_push = apk_push, None
+    return process
+
+def start_emulator(avd: str, apk_path: str | None = None, sha256_hash: str | None = None):
     """
-    Launches the correct emulator.
+    Launches the correct emulator. If the standby emulator is the correct one, it is
+    used instead (it has already been booting). Otherwise, the standby emulator is discarded.
 
     Args:
         avd (str): Device to be launch.
+        apk_path (str): APK to push while the emulator boots (None to install it with 'adb install').
+        sha256_hash (str): Hash of the APK, to check that the standby emulator received the same APK.
     """
 
+    global emulator_port, device_serial, boot_started, handed_over, boot_done, standby, apk_push
+
+    stop_push(apk_push)
+    apk_push = None
+
+    if standby is not None and standby["avd"] == avd: # Prediction was right
+        connection.send(("count", "preboot_hit"))
+        emulator_port = standby["port"]
+        device_serial = f"emulator-{emulator_port}"
+        boot_started = standby["started"]
+        handed_over = time.time()
+        boot_done = standby["booted"]
+        standby["watching"] = False
+        if standby["sha256"] == sha256_hash:
+            apk_push = standby["push"] # The APK has been copied while the standby emulator booted
+        else: # The standby emulator received another APK (or none)
+            stop_push(standby["push"])
+            if apk_path is not None:
+                apk_push = push_apk(apk_path, device_serial)
+        standby = None
+        return
+
+    if standby is not None: # Prediction was wrong
+        connection.send(("count", "preboot_miss"))
+        discard_standby()
+
     connection.send(("current", f"Starting emulator '{avd}'..."))
-    sp.Popen([EMULATOR_PATH, "-avd", avd, 
-              "-wipe-data", "-no-snapshot-load", "-no-snapshot-save", "-no-boot-anim", 
-              "-netdelay", "none", 
-              "-netspeed", "full", "-gpu", "host", "-no-window"], stdout = sp.DEVNULL, stderr = sp.DEVNULL)
+    emulator_port = worker_ports[0]
+    device_serial = f"emulator-{emulator_port}"
+    boot_started = time.time()
+    handed_over = None
+    boot_done = None
+    spawn_emulator(avd, emulator_port)
+    if apk_path is not None:
+        apk_push = push_apk(apk_path, device_serial)
+
+def wait_emulator_ready():
+    """
+    Waits until the emulator in use has booted.
 
-    if not wait_emulator_start():
-        connection.send(("current", "Failed to launch emulator in time. Quitting."))
-        sys.exit(1)
+    Raises:
+        TransientError: If the emulator doesn't boot in time (it is killed).
+    """
+
+    with stage_timer(connection, "boot"):
+        booted = wait_emulator_start()
+
+    if not booted:
+        kill_emulator(emulator_port)
+        raise TransientError("ERROR: Failed to launch emulator in time.")
 
-def wait_emulator_shutdown(device_serial: str, timeout: int = 60) -> bool:
+    # Boot time hidden by the pre-boot (time the standby emulator booted before it was needed,
+    # without the time it waited once booted)
+    if handed_over is not None:
+        connection.send(("timing", ("preboot_hidden", min(handed_over, boot_done or handed_over) - boot_started)))
+
+def start_standby(sdk_version: int, apk_path: str | None = None, sha256_hash: str | None = None):
     """
-    Waits for the given emulator to fully shut down.\n
-    If the emulator doesn't shut down in 60 seconds, the program terminates.
+    Boots the emulator for the next APK in the background, while the current APK is tested.
+
+    Args:
+        sdk_version (int): Target or minimum SDK version of the next APK.
+        apk_path (str): Next APK, pushed while the standby emulator boots.
+        sha256_hash (str): Hash of the next APK.
+    """
+
+    global standby
+
+    avd = choose_emulator(sdk_version)
+    port = worker_ports[1] if emulator_port == worker_ports[0] else worker_ports[0]
+    spawn_emulator(avd, port)
+    push = push_apk(apk_path, f"emulator-{port}") if apk_path is not None else None
+    standby = {"avd": avd, "port": port, "started": time.time(), "push": push,
+               "sha256": sha256_hash if push is not None else None, "booted": None, "watching": True}
+    th.Thread(target = watch_standby_boot, args = (standby,), daemon = True).start()
+
+def watch_standby_boot(state: dict):
+    """
+    Records when the standby emulator has booted ('booted' of its state). Runs in a thread until
+    the boot completes, or the standby emulator is handed over or discarded ('watching').
+
+    Args:
+        state (dict): Standby emulator.
+    """
+
+    serial = f"emulator-{state['port']}"
+    process = emulators.get(state["port"])
+    while state["watching"] and (process is None or process.poll() is None):
+        try:
+            result = sp.run([ADB_PATH, "-s", serial, "shell", "getprop", "sys.boot_completed"],
+                            stdout = sp.PIPE, stderr = sp.DEVNULL, text = True, timeout = 30)
+            if result.stdout.strip() == "1":
+                state["booted"] = time.time()
+                return
+        except sp.TimeoutExpired:
+            pass
+        except OSError: # ADB can't be run, the worker reports it
+            return
+        time.sleep(STANDBY_CHECK_INTERVAL)
+
+def drop_standby_push():
+    """
+    Stops the copy of the next APK to the standby emulator (if there is one), e.g. if the
+    next APK is skipped. The standby emulator keeps booting for the APK after it.
+    """
+
+    if standby is None:
+        return
+    stop_push(standby["push"])
+    standby["push"] = None
+    standby["sha256"] = None
+
+def discard_standby():
+    """
+    Shuts down the standby emulator (if there is one).
+    """
+
+    global standby
+    if standby is None:
+        return
+
+    port = standby["port"]
+    serial = f"emulator-{port}"
+    standby["watching"] = False
+    stop_push(standby["push"])
+    standby = None
+    sp.run([ADB_PATH, "-s", serial, "emu", "kill"], stdout = sp.DEVNULL, stderr = sp.DEVNULL)
+    if not wait_emulator_shutdown(serial):
+        connection.send(("current", "Timeout: Standby emulator did not shut down cleanly. Killing it."))
+        connection.send(("count", "emulator_killed"))
+    kill_emulator(port)
+
+def wait_emulator_shutdown(serial: str, timeout: int = 60) -> bool:
+    """
+    Waits for the given emulator to fully shut down.
     
     Args:
-        device_serial (str): Emulator's serial number.
+        serial (str): Emulator's serial number.
         timeout (int): Time limit for the emulator to shut down.
     Returns:
         True/False (bool): True if shut down, False if timeout is exceeded.
@@ -105,7 +407,7 @@ def wait_emulator_shutdown(device_serial: str, timeout: int = 60) -> bool:
         try:
             result = sp.run([ADB_PATH, "devices"], stdout = sp.PIPE, stderr = sp.DEVNULL)
             output = result.stdout.decode().strip()
-            if device_serial not in output:
+            if serial not in output:
                 return True
         except Exception as e:
             connection.send(("current", f"Warning: Failed to check\nemulator shut down status: {e}"))
@@ -114,32 +416,46 @@ def wait_emulator_shutdown(device_serial: str, timeout: int = 60) -> bool:
 
 def shut_down_emulator():
     """
-    Shuts down the running emulator.
+    Shuts down the emulator in use (if it is running). If it doesn't shut down in time,
+    its process is killed.
     """
+
+    global apk_push
+    stop_push(apk_push)
+    apk_push = None
     
-    running_devices = get_devices()
-    device_serial = running_devices[0]
+    if device_serial not in get_devices():
+        kill_emulator(emulator_port) # Emulator that never came up
+        return
 
     connection.send(("current", f"Shutting down the emulator..."))
-    sp.run([ADB_PATH, "-s", device_serial, "emu", "kill"], stdout = sp.DEVNULL, stderr = sp.DEVNULL)
+    with stage_timer(connection, "shutdown"):
+        sp.run(adb("emu", "kill"), stdout = sp.DEVNULL, stderr = sp.DEVNULL)
+
+        # Waits for the current emulator to shut down
+        shut_down = wait_emulator_shutdown(device_serial)
 
-    # Waits for the current emulator to shut down
-    if not wait_emulator_shutdown(device_serial):
-        connection.send(("current", "Timeout: Emulator did not shut down cleanly. Quitting."))
-        sys.exit(1)
+    if not shut_down:
+        connection.send(("current", "Timeout: Emulator did not shut down cleanly. Killing it."))
+        connection.send(("count", "emulator_killed"))
+    kill_emulator(emulator_port)
 
 # ////////////////////////////////////
 # /////////////// MAIN ///////////////
 # ////////////////////////////////////
 connection = None
 
-def launch_emulator(sdk_version: int, conn):
+def launch_emulator(sdk_version: int, conn, apk_path: str | None = None, sha256_hash: str | None = None):
     """
-    Launches the Android emulator according to the target or minimum SDK version for the APK.
+    Launches the Android emulator according to the target or minimum SDK version for the APK.\n
+    It doesn't wait for the boot, see 'wait_emulator_ready'. The APK is pushed to the emulator
+    while it boots (PUSH_DURING_BOOT).
 
     Args:
         sdk_version (int): Target or minimum SDK version for the APK.
         conn (Connection): Pipe connection for sending data.
+        apk_path (str): Path to the APK file.
+        sha256_hash (str): Hash of the APK.
     """
 
     global connection
@@ -148,5 +464,5 @@ def launch_emulator(sdk_version: int, conn):
     # Chooses right emulator for the APK
     required_avd = choose_emulator(sdk_version)
     
-    # Starts the emulator
-    start_emulator(required_avd)
\ No newline at end of file
+    # Starts the emulator (or takes the standby emulator)
+    start_emulator(required_avd, apk_path, sha256_hash)
\ No newline at end of file
@@ -0,0 +1,223 @@
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+import emu_manager
+import test_apk
+from app_launch import app_launch_main
+from config import PROFILES_FILE
+
+# Settings tried by default (every combination). An empty value keeps the default of the emulator
+DEFAULT_CANDIDATES = {
+    "cores": "2,4",
+    "memory": "2048,4096",
+    "gpu": "swiftshader_indirect,off",
+    "no_audio": "yes",
+    "cache_size": "",
+    "partition_size": "",
+}
+
+class TuningConnection:
+    """
+    Stands in for the pipe of a worker: keeps the stage timings sent by emu_manager and
+    app_launch, and prints their status messages with --verbose.
+    """
+
+    def __init__(self, verbose: bool):
+        self.verbose = verbose
+        self.timings = {}
+
+    def send(self, message: tuple):
+        kind, value = message
+        if kind == "timing":
+            self.timings[value[0]] = value[1]
+        elif kind == "current" and self.verbose:
+            print(f"    {' '.join(str(value).split())}")
+
+def all_avds() -> list[str]:
+    """
+    Returns:
+        avds (list[str]): AVDs used by APK Tester (see choose_emulator).
+    """
+
+    return list(dict.fromkeys(emu_manager.choose_emulator(sdk_version) for sdk_version in range(0, 36)))
+
+def candidate_profiles(candidates: dict) -> list[dict]:
+    """
+    Builds every combination of the candidate settings.
+
+    Args:
+        candidates (dict): Setting -> comma-separated values (e.g. 'cores': '2,4').
+    Returns:
+        profiles (list[dict]): Launch profiles (see profile_flags), without the empty settings.
+    """
+
+    values = {}
+    for setting, text in candidates.items():
+        options = [value.strip() for value in text.split(",")]
+        if setting == "no_audio":
+            values[setting] = [value == "yes" for value in options]
+        elif setting == "gpu":
+            values[setting] = options
+        else:
+            values[setting] = [int(value) if value else None for value in options]
+
+    profiles = []
+    for combination in itertools.product(*values.values()):
+        profile = {setting: value for setting, value in zip(values, combination) if value not in (None, "", False)}
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
+
+def describe(profile: dict) -> str:
+    return " ".join(emu_manager.profile_flags(profile))
+
+def measure(avd: str, profile: dict, apk: dict | None, connection: TuningConnection, boot_timeout: int) -> dict | None:
+    """
+    Boots the AVD once with a launch profile, then installs and launches the probe APK.
+
+    Returns:
+        One_of_Two:
+            - **times** (dict): 'boot', 'install' and 'launch' durations in seconds.
+            - **None**: If the emulator didn't boot in time, exited, or failed to run the probe APK.
+    """
+
+    connection.timings = {}
+    start_time = time.time()
+    emu_manager.spawn_emulator(avd, emu_manager.emulator_port, profile)
+    try:
+        if not emu_manager.wait_emulator_start(boot_timeout, interval = 0.5):
+            return None
+        times = {"boot": time.time() - start_time, "install": 0.0, "launch": 0.0}
+
+        if apk is not None:
+            app_launch_main(apk["path"], apk["package_name"], connection, apk["activity"])
+            times["install"] = connection.timings.get("install", 0.0)
+            times["launch"] = connection.timings.get("launch", 0.0)
+        return times
+    except RuntimeError as e: # Also TransientError (device offline...)
+        connection.send(("current", e))
+        return None
+    finally:
+        emu_manager.shut_down_emulator()
+
+def tune_avd(avd: str, profiles: list[dict], apk: dict | None, connection: TuningConnection, runs: int,
+             boot_timeout: int) -> list[dict]:
+    """
+    Measures every launch profile of an AVD. A profile is stable if all its runs succeed.
+
+    Returns:
+        results (list[dict]): 'profile', 'stable', and the median 'boot', 'install', 'launch'
+            and 'total' times in seconds of every profile, fastest stable profile first.
+    """
+
+    results = []
+    for profile in profiles:
+        print(f"[{avd}] {describe(profile)}", flush = True)
+        measured = []
+        for _ in range(runs):
+            times = measure(avd, profile, apk, connection, boot_timeout)
+            if times is None:
+                break # Unstable, no more runs
+            measured.append(times)
+
+        result = {"profile": profile, "stable": len(measured) == runs}
+        if measured:
+            for stage in ("boot", "install", "launch"):
+                result[stage] = statistics.median(times[stage] for times in measured)
+            result["total"] = result["boot"] + result["install"] + result["launch"]
+        results.append(result)
+
+    return sorted(results, key = lambda result: (not result["stable"], result.get("total", float("inf"))))
+
+def save_profile(avd: str, result: dict, apk_path: str | None):
+    """
+    Saves the fastest stable profile of an AVD to PROFILES_FILE (profiles of other AVDs are kept).
+    """
+
+    try:
+        with open(PROFILES_FILE) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = {}
+
+    saved[avd] = {
+        "profile": result["profile"],
+        "boot_s": round(result["boot"], 2),
+        "install_s": round(result["install"], 2),
+        "launch_s": round(result["launch"], 2),
+        "probe_apk": os.path.basename(apk_path) if apk_path else None,
+        "tuned": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+    }
+    with open(f"{PROFILES_FILE}.tmp", "w") as f:
+        json.dump(saved, f, indent = 2)
+    os.replace(f"{PROFILES_FILE}.tmp", PROFILES_FILE)
+
+def print_results(results: list[dict]):
+    print(f"    {'boot':>7} {'install':>8} {'launch':>7} {'total':>7}  profile")
+    for result in results:
+        if "total" in result:
+            times = f"{result['boot']:6.1f}s {result['install']:7.1f}s {result['launch']:6.1f}s {result['total']:6.1f}s"
+        else:
+            times = f"{'-':>7} {'-':>8} {'-':>7} {'-':>7}"
+        print(f"    {times}  {describe(result['profile'])}" + ("" if result["stable"] else "  (unstable)"))
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Boots every AVD with candidate launch settings and saves the fastest " +
+                                                   f"stable profile to '{PROFILES_FILE}' (used by APK Tester).")
+    parser.add_argument("--avd", action = "append", help = "AVD to tune (repeat for several AVDs, default: all).")
+    parser.add_argument("--cores", default = DEFAULT_CANDIDATES["cores"], help = "CPU cores (comma-separated).")
+    parser.add_argument("--memory", default = DEFAULT_CANDIDATES["memory"], help = "RAM in MB (comma-separated).")
+    parser.add_argument("--gpu", default = DEFAULT_CANDIDATES["gpu"], help = "GPU modes, e.g. host,swiftshader_indirect,off.")
+    parser.add_argument("--no-audio", default = DEFAULT_CANDIDATES["no_audio"], help = "'yes', 'no' or 'yes,no'.")
+    parser.add_argument("--cache-size", default = DEFAULT_CANDIDATES["cache_size"], help = "Cache partition sizes in MB (empty: default).")
+    parser.add_argument("--partition-size", default = DEFAULT_CANDIDATES["partition_size"], help = "System/data partition sizes in MB (empty: default).")
+    parser.add_argument("--runs", type = int, default = 2, help = "Boots per profile (all must succeed).")
+    parser.add_argument("--apk", help = "Probe APK installed and launched after every boot (e.g. a small app that is known to work).")
+    parser.add_argument("--boot-timeout", type = int, default = 300, help = "Seconds before a boot is counted as failed.")
+    parser.add_argument("--worker", type = int, default = 0, help = "Uses the emulator ports of this worker ID (pick a free one while the programs run).")
+    parser.add_argument("--dry-run", action = "store_true", help = "Prints the results without saving them.")
+    parser.add_argument("--verbose", action = "store_true")
+    args = parser.parse_args()
+
+    connection = TuningConnection(args.verbose)
+    emu_manager.select_device(args.worker, connection)
+
+    apk = None
+    if args.apk:
+        test_apk.connection = connection
+        badging = test_apk.dump_badging(args.apk)
+        apk = {"path": args.apk, "package_name": test_apk.get_package_name(badging),
+               "activity": test_apk.get_launchable_activity(badging)}
+
+    # The current settings (no profile) are measured too, so a profile is only saved if it is faster
+    profiles = [{}] + [profile for profile in candidate_profiles({"cores": args.cores, "memory": args.memory, "gpu": args.gpu, "no_audio": args.no_audio,
+                                          "cache_size": args.cache_size, "partition_size": args.partition_size}) if profile]
+    start_time = time.time()
+    for avd in args.avd or all_avds():
+        results = tune_avd(avd, profiles, apk, connection, args.runs, args.boot_timeout)
+        print_results(results)
+        best = results[0]
+        if not best["stable"]:
+            print(f"[{avd}] No stable profile.")
+            continue
+
+        default = next(result for result in results if result["profile"] == {})
+        if best["profile"] == {}:
+            print(f"[{avd}] The default settings are the fastest.")
+        elif default["stable"]:
+            print(f"[{avd}] Best: {describe(best['profile'])} ({default['total'] - best['total']:.1f}s faster than the default)")
+        else:
+            print(f"[{avd}] Best: {describe(best['profile'])} (the default settings don't work)")
+        if not args.dry_run:
+            save_profile(avd, best, args.apk)
+
+    print(f"Tuned in {time.time() - start_time:.0f}s.", file = sys.stderr)
@@ -0,0 +1,13 @@
+class TransientError(RuntimeError):
+    """
+    Temporary failure that doesn't depend on the APK: SSH or VirusTotal errors, an emulator that
+    doesn't boot, a device that goes offline... The APK is tried again later (see RetryQueue).\n
+    Errors of the APK itself are raised as RuntimeError ('Error: ...'), and misconfigurations
+    (missing tools, files or keys) stop the program.
+    """
+
+class EndOfDataError(LookupError):
+    """
+    APK number past the last row of 'latest.csv' (or of the corpus). The rows after it don't exist
+    either, so the worker takes no new APK from its range (it still finishes its retries).
+    """
@@ -0,0 +1,239 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Parquet is optional (pip install pyarrow), compressed JSON lines are written without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+TABLES = ("apk_info", "scan_results")
+CHUNK_ROWS = 10_000 # Rows read and written at once (memory use doesn't depend on the table size)
+EXTENSIONS = {"parquet": ".parquet", "jsonl": ".jsonl.gz", "csv": ".csv.gz"}
+
+def create_tracking(cursor, table: str):
+    """
+    Adds the 'export_version' column to a table, set from a sequence by triggers every time
+    a row is inserted or updated (e.g. when the scan label is added to 'apk_info'), so that
+    an export only reads the rows changed since the last one. Existing rows get their ID.
+
+    Args:
+        cursor (any): Database cursor
+        table (str): Table to track.
+    """
+
+    if "export_version" in column_types(cursor, table):
+        return
+
+    connection = cursor.connection
+    connection.commit()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        columns = list(column_types(cursor, table))
+        if "export_version" not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN export_version INTEGER")
+            cursor.execute(f"UPDATE {table} SET export_version = id")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_export_version ON {table} (export_version)")
+
+            cursor.execute("CREATE TABLE IF NOT EXISTS export_sequence (table_name TEXT PRIMARY KEY, value INTEGER)")
+            # Tells a recreated database apart (its versions start again from 1)
+            cursor.execute("INSERT OR IGNORE INTO export_sequence VALUES ('database', ?)", (random.getrandbits(62),))
+            cursor.execute(f"INSERT OR REPLACE INTO export_sequence VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM {table}))", (table,))
+
+            # Every inserted or changed row takes the next version
+            data_columns = ", ".join(column for column in columns if column != "id")
+            for event in ("INSERT", f"UPDATE OF {data_columns}"):
+                name = f"{table}_export_{event.split()[0].lower()}"
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN " +
+                        f"UPDATE export_sequence SET value = value + 1 WHERE table_name = '{table}'; " +
+                        f"UPDATE {table} SET export_version = (SELECT value FROM export_sequence WHERE table_name = '{table}') " +
+                        "WHERE id = NEW.id; " +
+                    "END")
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+
+def column_types(cursor, table: str) -> dict:
+    """
+    Returns:
+        types (dict): Column name -> declared type ('INTEGER', 'REAL' or 'TEXT').
+    """
+
+    return {row[1]: row[2].upper() or "TEXT" for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+def parquet_column(values: list, column_type: str):
+    """
+    Converts the values of a column to an Arrow array of its declared type. Values of another
+    type (e.g. 'PENDING' in the 'positives' column before the scan) are written as nulls.
+    """
+
+    if column_type == "INTEGER":
+        return pa.array([value if isinstance(value, int) else None for value in values], type = pa.int64())
+    if column_type == "REAL":
+        return pa.array([float(value) if isinstance(value, (int, float)) else None for value in values], type = pa.float64())
+    return pa.array([value if value is None else str(value) for value in values], type = pa.string())
+
+class ChunkWriter:
+    """
+    Writes the chunks of one export to a compressed file (a temporary file until it is complete).
+    """
+
+    def __init__(self, path: str, file_format: str, types: dict):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.file_format = file_format
+        self.types = types
+        self.columns = list(types)
+        if file_format == "parquet":
+            schema = pa.schema([(column, parquet_column([], column_type).type) for column, column_type in types.items()])
+            self.writer = pq.ParquetWriter(self.tmp_path, schema, compression = "zstd")
+        else:
+            self.file = gzip.open(self.tmp_path, "wt", compresslevel = 6, newline = "")
+            if file_format == "csv":
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(self.columns)
+
+    def write(self, rows: list[tuple]):
+        if self.file_format == "parquet":
+            arrays = [parquet_column([row[i] for row in rows], self.types[column]) for i, column in enumerate(self.columns)]
+            self.writer.write_table(pa.Table.from_arrays(arrays, names = self.columns)) # One row group per chunk
+        elif self.file_format == "csv":
+            self.writer.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows)
+
+    def close(self):
+        (self.writer if self.file_format == "parquet" else self.file).close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        (self.writer if self.file_format == "parquet" else self.file).close()
+        os.remove(self.tmp_path)
+
+def database_id(connection) -> int | None:
+    """
+    Returns:
+        database_id (int | None): Random ID of the database, set when the tracking was added.
+    """
+
+    row = connection.execute("SELECT value FROM export_sequence WHERE table_name = 'database'").fetchone()
+    return row[0] if row else None
+
+def load_watermarks(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, "watermarks.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_watermarks(output_dir: str, watermarks: dict):
+    path = os.path.join(output_dir, "watermarks.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(watermarks, f, indent = 2)
+    os.replace(f"{path}.tmp", path)
+
+def export_table(connection, table: str, output_dir: str, file_format: str, watermark: int,
+                 chunk_rows: int = CHUNK_ROWS) -> tuple[int, int]:
+    """
+    Writes the rows of a table inserted or changed since the watermark to a new file
+    ('<output_dir>/<table>/part-<database ID>-<first version>-<last version><extension>'). Changed rows are
+    written again: readers keep the row with the highest 'export_version' of every ID.
+
+    Args:
+        connection (connection): Database connection
+        table (str): Table to export.
+        output_dir (str): Directory of the exported files.
+        file_format (str): 'parquet', 'jsonl' or 'csv'.
+        watermark (int): Highest 'export_version' already exported.
+        chunk_rows (int): Rows read and written at once.
+    Returns:
+        tuple:
+            - **rows** (int): Number of exported rows.
+            - **watermark** (int): New watermark (unchanged if no row was exported).
+    """
+
+    cursor = connection.cursor()
+    create_tracking(cursor, table)
+    types = column_types(cursor, table)
+
+    # Rows changed during the export take a version above 'last', they are exported next time
+    last = cursor.execute("SELECT value FROM export_sequence WHERE table_name = ?", (table,)).fetchone()[0]
+    if last <= watermark:
+        return 0, watermark
+
+    os.makedirs(os.path.join(output_dir, table), exist_ok = True)
+    name = f"part-{database_id(connection):016x}-{watermark + 1:012d}-{last:012d}{EXTENSIONS[file_format]}"
+    writer = ChunkWriter(os.path.join(output_dir, table, name),
+                         file_format, types)
+    rows = 0
+    position = watermark
+    try:
+        # Every chunk is a short query (keyset pagination), so the workers can write between chunks
+        while chunk := cursor.execute(f"SELECT {', '.join(types)} FROM {table} " +
+                                      "WHERE export_version > ? AND export_version <= ? ORDER BY export_version LIMIT ?",
+                                      (position, last, chunk_rows)).fetchall():
+            writer.write(chunk)
+            rows += len(chunk)
+            position = chunk[-1][list(types).index("export_version")]
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+    return rows, last
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Exports the rows of 'results.db' added or changed since the last export.")
+    parser.add_argument("--db", default = "results.db")
+    parser.add_argument("--table", choices = TABLES + ("all",), default = "all")
+    parser.add_argument("--format", choices = ["auto", "parquet", "jsonl", "csv"], default = "auto",
+                        help = "'auto': Parquet if pyarrow is installed, otherwise compressed JSON lines.")
+    parser.add_argument("--output", default = "exports", help = "Directory of the exported files and of their watermarks.")
+    parser.add_argument("--chunk-rows", type = int, default = CHUNK_ROWS)
+    parser.add_argument("--full", action = "store_true", help = "Exports all rows again (ignores the watermarks).")
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format == "auto":
+        file_format = "parquet" if pa is not None else "jsonl"
+    elif file_format == "parquet" and pa is None:
+        print("ERROR: Parquet export needs pyarrow (pip install pyarrow).", file = sys.stderr)
+        sys.exit(2)
+    if not os.path.exists(args.db):
+        print(f"ERROR: Database '{args.db}' not found.", file = sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(args.output, exist_ok = True)
+    watermarks = load_watermarks(args.output)
+    connection = sqlite3.connect(args.db)
+    tables = TABLES if args.table == "all" else (args.table,)
+    tables = [table for table in tables
+              if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()]
+    for table in tables:
+        create_tracking(connection.cursor(), table)
+
+    # Watermarks of another (e.g. deleted and recreated) database don't apply
+    if tables and watermarks.get("database") != database_id(connection):
+        watermarks = {"database": database_id(connection)}
+
+    for table in tables:
+        start_time = time.time()
+        rows, watermarks[table] = export_table(connection, table, args.output, file_format,
+                                               0 if args.full else watermarks.get(table, 0), args.chunk_rows)
+        save_watermarks(args.output, watermarks) # After the file is complete
+        duration = time.time() - start_time
+        print(f"{table}: {rows} rows exported in {duration:.1f}s ({rows / max(duration, 1e-9):,.0f} rows/s).", file = sys.stderr)
+    connection.close()
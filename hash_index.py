@@ -0,0 +1,128 @@
+import math
+import sqlite3
+import numpy as np
+from db_manager import create_table as create_test_table
+from scan_db_manager import create_table as create_scan_table
+from config import INDEX_BITS_PER_HASH
+
+# Hashes that can be added during a run without raising the false positive rate
+HEADROOM = 100_000
+
+# Hashes read from the database at once while the index is built
+BATCH_SIZE = 100_000
+
+# Hashes already processed by each program. APK Tester rows with a program error ('ERROR: ...',
+# e.g. a failed download) are not counted, so that these APKs are tried again
+PROCESSED_QUERIES = {
+    "test": ("SELECT sha256_hash FROM apk_info WHERE sha256_hash IS NOT NULL AND NOT outcome GLOB 'ERROR*'",
+             "SELECT 1 FROM apk_info WHERE sha256_hash = ? AND NOT outcome GLOB 'ERROR*' LIMIT 1"),
+    "scan": ("SELECT sha256_hash FROM scan_results WHERE sha256_hash IS NOT NULL",
+             "SELECT 1 FROM scan_results WHERE sha256_hash = ? LIMIT 1"),
+}
+
+def hash_words(hashes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Takes two 64-bit words of every SHA-256 hash (hashes are already uniformly distributed,
+    so they are used as the hash functions of the Bloom filter).
+
+    Args:
+        hashes (list[str]): SHA-256 hashes (64 hexadecimal characters).
+    Returns:
+        tuple:
+            - **h1** (np.ndarray): First 64 bits of every hash.
+            - **h2** (np.ndarray): Next 64 bits of every hash (odd, so that all positions differ).
+    """
+
+    words = np.frombuffer(bytes.fromhex("".join(hashes)), dtype = ">u8").reshape(-1, 4).astype(np.uint64)
+    return words[:, 0], words[:, 1] | np.uint64(1)
+
+class HashIndex:
+    """
+    Membership index of the SHA-256 hashes that a program has already processed, so that
+    duplicate rows of 'latest.csv' and overlapping ranges are skipped before the download.\n
+    A Bloom filter (INDEX_BITS_PER_HASH bits per hash, about 1% false positives with 10 bits)
+    answers most lookups in memory. Its positive answers are confirmed with the indexed
+    'sha256_hash' column of the database, so that a false positive never skips an APK.
+    """
+
+    def __init__(self, pipeline: str, db_path: str = "results.db"):
+        """
+        Loads the hashes stored in the database.
+
+        Args:
+            pipeline (str): Name of the program ('test' or 'scan').
+            db_path (str): Path to the database.
+        """
+
+        load_query, self.confirm_query = PROCESSED_QUERIES[pipeline]
+        self.db = sqlite3.connect(db_path)
+        cursor = self.db.cursor()
+        # Creates the table and its hash index (if they don't exist)
+        if pipeline == "test":
+            create_test_table(cursor)
+        else:
+            create_scan_table(cursor)
+        self.db.commit()
+
+        count = cursor.execute(f"SELECT COUNT(*) FROM ({load_query})").fetchone()[0]
+        self.size = (count + HEADROOM) * INDEX_BITS_PER_HASH
+        self.functions = max(1, round(INDEX_BITS_PER_HASH * math.log(2))) # Optimal number of hash functions
+        self.bits = np.zeros((self.size + 7) // 8, dtype = np.uint8)
+        self.count = 0
+
+        cursor.execute(load_query)
+        while rows := cursor.fetchmany(BATCH_SIZE):
+            self.add_many([row[0] for row in rows])
+
+    def positions(self, hashes: list[str]) -> np.ndarray:
+        """
+        Returns:
+            positions (np.ndarray): Bit positions of every hash (one row per hash).
+        """
+
+        h1, h2 = hash_words(hashes)
+        steps = np.arange(self.functions, dtype = np.uint64)
+        # Double hashing: h1 + i * h2 (overflows wrap around)
+        with np.errstate(over = "ignore"):
+            return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.size)
+
+    def add_many(self, hashes: list[str]):
+        """
+        Adds hashes to the index (invalid hashes are ignored).
+        """
+
+        hashes = [value.upper() for value in hashes if isinstance(value, str) and len(value) == 64]
+        try:
+            bytes.fromhex("".join(hashes))
+        except ValueError: # Rare rows that aren't hexadecimal
+            hashes = [value for value in hashes if all(c in "0123456789ABCDEF" for c in value)]
+        if not hashes:
+            return
+        positions = self.positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+        self.count += len(hashes)
+
+    def add(self, sha256_hash: str):
+        """
+        Adds a processed hash to the index.
+        """
+
+        self.add_many([sha256_hash])
+
+    def __contains__(self, sha256_hash: str) -> bool:
+        """
+        Returns:
+            True/False (bool): True if the hash has already been processed.
+        """
+
+        if not isinstance(sha256_hash, str) or len(sha256_hash) != 64:
+            return False
+        positions = self.positions([sha256_hash.upper()])[0]
+        if not all(self.bits[position >> 3] >> (position & 7) & 1 for position in positions.tolist()):
+            return False # Never stored
+
+        # Possible false positive, the database has the answer
+        return self.db.execute(self.confirm_query, (sha256_hash.upper(),)).fetchone() is not None
+
+    def close(self):
+        self.db.close()
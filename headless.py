@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from test_apk import ta_main
+from virus_scan import vs_main
+from downloader import check_ssh
+from stats_manager import init_stats, save_stats
+from work_queue import WorkRange, WorkList, WorkerPool, read_work_list
+from metrics import PipelineMetrics, TimingLog
+from metrics_exporter import MetricsExporter, render_prometheus
+from profiler import profile_stage
+from resource_manager import ResourceController
+from config import MAX_APK_NB_TA, MAX_APK_NB_VS, TIMINGS_FILE, THROUGHPUT_WINDOW, VT_DAILY_QUOTA
+from config import METRICS_HOST, METRICS_PORT, METRICS_FILE, METRICS_INTERVAL
+from config import ADAPTIVE, SCALE_INTERVAL, MIN_EMULATORS, MAX_EMULATORS, MIN_SCAN_WORKERS, MAX_SCAN_WORKERS
+from config import EMULATOR_RAM_MB, SCAN_WORKER_RAM_MB, PREBOOT
+
+# Exit codes
+EXIT_FINISHED = 0 # All APKs of the range were processed
+EXIT_WORKER_FAILED = 1 # A worker stopped because of an error (see the "current" events)
+EXIT_USAGE = 2 # Invalid command-line arguments
+# Stopped by SIGINT/SIGTERM: 128 + signal number (130 / 143), like shells do
+
+stop_signal = None # Signal that requested the stop
+
+def handle_signal(signum, frame):
+    """
+    Records a stop request. The main loop then asks the workers to stop after their current APK.
+    """
+
+    global stop_signal
+    if stop_signal is not None: # Second signal: stops immediately
+        raise KeyboardInterrupt
+    stop_signal = signum
+
+def emit(event: dict):
+    """
+    Writes an event to stdout as a JSON line.
+
+    Args:
+        event (dict): Event data.
+    """
+
+    print(json.dumps({"time": round(time.time(), 3), **event}, default = str), flush = True)
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """
+    Parses the command-line arguments.
+
+    Args:
+        argv (list[str]): Command-line arguments.
+    Returns:
+        args (Namespace): Parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description = "Runs APK Tester and/or Virus Scanner without the TUI. " +
+                                     "Progress is written to stdout as JSON lines.")
+    parser.add_argument("--pipeline", choices = ["test", "scan", "both"], default = "both",
+                        help = "Programs to run (default: both).")
+    parser.add_argument("--start", type = int,
+                        help = "First APK number (row of latest.csv). Default: continue from the stats file.")
+    parser.add_argument("--end", type = int,
+                        help = "Last APK number (included). Default: MAX_APK_NB_TA / MAX_APK_NB_VS from config.ini.")
+    parser.add_argument("--work-list",
+                        help = "File with the APK numbers to process, one per line (see 'corpus.py select'). " +
+                        "With --start, numbers below it are skipped; --end is ignored.")
+    parser.add_argument("--test-workers", type = int, default = 1,
+                        help = "Number of APK Tester workers (one emulator each). Initial number with --adaptive.")
+    parser.add_argument("--scan-workers", type = int, default = 1,
+                        help = "Number of Virus Scanner workers. Initial number with --adaptive.")
+    parser.add_argument("--adaptive", action = "store_true", default = ADAPTIVE,
+                        help = "Adapts the number of workers to free host resources ([Resources] in config.ini).")
+    parser.add_argument("--no-ssh-check", action = "store_true",
+                        help = "Does not check that the SSH key is added to the agent.")
+
+    args = parser.parse_args(argv)
+    if args.start is not None and args.start < 1:
+        parser.error("--start must be at least 1.")
+    if args.end is not None and args.start is not None and args.end < args.start:
+        parser.error("--end must not be lower than --start.")
+    if args.work_list is not None and not os.path.isfile(args.work_list):
+        parser.error(f"work list '{args.work_list}' not found.")
+    if args.test_workers < 1 or args.scan_workers < 1:
+        parser.error("--test-workers and --scan-workers must be at least 1.")
+
+    return args
+
+def handle_message(pool: WorkerPool, metrics: PipelineMetrics, worker_id: int, key: str, value):
+    """
+    Applies a message of a worker and writes it to stdout.
+
+    Args:
+        pool (WorkerPool): Pool of the worker.
+        metrics (PipelineMetrics): Performance data of the program.
+        worker_id (int): ID of the worker.
+        key (str): Type of the message.
+        value (any): Content of the message.
+    """
+
+    event = {"pipeline": pool.name, "worker": worker_id}
+    if key == "timing":
+        metrics.record(*value)
+        emit({**event, "event": "timing", "stage": value[0], "seconds": round(value[1], 3)})
+        return
+    if key == "count":
+        metrics.count(value)
+        return
+    if key == "sample":
+        metrics.sample(*value)
+        emit({**event, "event": "sample", "name": value[0], "value": value[1]})
+        return
+    if key == "total":
+        metrics.mark_completed()
+
+    pool.aggregator.update(worker_id, key, value)
+    emit({**event, "event": key, "value": value if isinstance(value, (int, str)) else str(value)})
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+
+    if not args.no_ssh_check:
+        check_ssh()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    test_stats, scan_stats = init_stats()
+    work_list = read_work_list(args.work_list) if args.work_list else None
+    timing_log = TimingLog(TIMINGS_FILE)
+
+    # Creates worker pools of the chosen programs
+    pools = []
+    for name, target, stats, max_nb, workers in [("test", ta_main, test_stats, MAX_APK_NB_TA, args.test_workers),
+                                                 ("scan", vs_main, scan_stats, MAX_APK_NB_VS, args.scan_workers)]:
+        if args.pipeline not in (name, "both"):
+            continue
+        if work_list is not None: # Selected APKs only
+            first = args.start if args.start is not None else 1
+            work = WorkList(work_list, first)
+            last = work.last
+        else:
+            first = args.start if args.start is not None else stats["counter"]
+            last = args.end if args.end is not None else max_nb
+            work = WorkRange(first, last)
+        pool = WorkerPool(name, target, stats, work)
+        pools.append((pool, PipelineMetrics(name, THROUGHPUT_WINDOW, timing_log), last))
+        emit({"pipeline": name, "event": "start", "first": first, "last": last, "workers": workers,
+              "apks": work.remaining(first)})
+        for _ in range(workers):
+            pool.start_worker()
+
+    exporter = MetricsExporter(METRICS_HOST, METRICS_PORT, METRICS_FILE)
+    exporter.start()
+    last_report = time.time()
+
+    # Adaptive concurrency: (pool, minimum, maximum, RAM per worker), emulators first
+    controller = ResourceController() if args.adaptive else None
+    # With pre-boot, a tester worker runs up to two emulators
+    emulator_ram_mb = EMULATOR_RAM_MB * (2 if PREBOOT else 1)
+    bounds = {"test": (MIN_EMULATORS, MAX_EMULATORS, emulator_ram_mb),
+              "scan": (MIN_SCAN_WORKERS, MAX_SCAN_WORKERS, SCAN_WORKER_RAM_MB)}
+    scaled_pools = [(pool, *bounds[pool.name]) for pool, _, _ in pools]
+    last_scale = time.time()
+    stopping = False
+
+    try:
+        while any(pool.workers for pool, _, _ in pools):
+            # Stop request: workers finish their current APK first
+            if stop_signal is not None and not stopping:
+                stopping = True
+                emit({"event": "stopping", "signal": signal.Signals(stop_signal).name})
+                for pool, _, _ in pools:
+                    pool.stop()
+
+            # Reads messages of all workers
+            connections = {conn: (pool, metrics, worker_id)
+                           for pool, metrics, _ in pools for conn, worker_id in pool.connections().items()}
+            for conn in wait(list(connections), timeout = 1):
+                pool, metrics, worker_id = connections[conn]
+                try:
+                    key, value = conn.recv()
+                except EOFError: # Worker has exited
+                    pool.remove_worker(worker_id)
+                    emit({"pipeline": pool.name, "worker": worker_id, "event": "worker_exit", "failed": pool.failed})
+                    continue
+                with profile_stage("headless_receive"):
+                    handle_message(pool, metrics, worker_id, key, value)
+
+            # Starts or stops workers depending on free resources
+            if controller is not None and not stopping and time.time() - last_scale >= SCALE_INTERVAL:
+                for decision in controller.step(scaled_pools):
+                    emit({**decision, "event": "scale"})
+                last_scale = time.time()
+
+            # Reports progress
+            if time.time() - last_report >= METRICS_INTERVAL:
+                for pool, metrics, _ in pools:
+                    emit({"pipeline": pool.name, "event": "progress", "stats": pool.stats,
+                          "apks_per_hour": round(metrics.throughput(), 2),
+                          "eta_seconds": metrics.eta(pool.work.remaining(pool.stats["counter"]))})
+                with profile_stage("metrics_export"):
+                    exporter.update(render_prometheus([(pool.name, pool.stats, metrics, pool.work.remaining(pool.stats["counter"]))
+                                                       for pool, metrics, _ in pools], VT_DAILY_QUOTA))
+                last_report = time.time()
+    except KeyboardInterrupt: # Second stop request
+        emit({"event": "killed"})
+        for pool, _, _ in pools:
+            pool.terminate()
+        raise SystemExit(128 + (stop_signal or signal.SIGINT))
+    finally:
+        timing_log.close()
+        exporter.close()
+
+    # Final stats, event counts (e.g. 'csv_label_hit': VirusTotal requests saved) and p50/p95 of
+    # the measurements of apps (e.g. 'cold_start_ms') of this run
+    for pool, metrics, _ in pools:
+        samples = {name: dict(zip(("p50", "p95"), metrics.sample_percentiles(name))) for name in metrics.samples_by_name}
+        emit({"pipeline": pool.name, "event": "summary", "stats": pool.stats, "events": metrics.counters, "samples": samples})
+
+    # Saves stats, so that the next run continues from where this one stopped
+    # (a work list run doesn't move the resume point of the whole corpus)
+    if args.start is None and args.work_list is None:
+        save_stats(test_stats, scan_stats)
+
+    if stop_signal is not None:
+        code = 128 + stop_signal
+    elif any(pool.failed for pool, _, _ in pools):
+        code = EXIT_WORKER_FAILED
+    else:
+        code = EXIT_FINISHED
+
+    emit({"event": "exit", "code": code})
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,245 @@
+import csv
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from profiler import profile_stage
+
+# Upper bounds (in seconds) of the stage duration histograms
+HISTOGRAM_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600]
+
+@contextmanager
+def stage_timer(connection, stage: str):
+    """
+    Measures how long a pipeline stage takes and sends the duration to the TUI.\n
+    The duration is sent even if the stage fails, so slow failures are visible too.
+    When profiling is enabled, the stage is also profiled.
+
+    Args:
+        connection (Connection): Pipe connection for sending data.
+        stage (str): Name of the stage (e.g. "download", "boot").
+    """
+
+    start_time = time.perf_counter()
+    try:
+        with profile_stage(stage):
+            yield
+    finally:
+        connection.send(("timing", (stage, time.perf_counter() - start_time)))
+
+def percentile(values: list[float], p: float) -> float | None:
+    """
+    Computes the p-th percentile of the values (nearest-rank method).
+
+    Args:
+        values (list[float]): Measured values.
+        p (float): Percentile between 0 and 100.
+    Returns:
+        One_of_Two:
+            - **value** (float): The percentile.
+            - **None**: If there are no values.
+    """
+
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def format_duration(seconds: float | None) -> str:
+    """
+    Formats a duration in seconds for the TUI.
+
+    Args:
+        seconds (float | None): Duration in seconds.
+    Returns:
+        text (str): Human-readable duration.
+    """
+
+    if seconds is None:
+        return "N/A"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    if seconds < 3600:
+        return f"{int(seconds // 60)}m {int(seconds % 60)}s"
+    return f"{int(seconds // 3600)}h {int(seconds % 3600 // 60)}m"
+
+class TimingLog:
+    """
+    Appends raw stage timings to a CSV file, so that different runs can be compared.\n
+    Every run gets its own ID (UTC start time).
+    """
+
+    def __init__(self, path: str):
+        self.run_id = datetime.now(timezone.utc).isoformat(timespec = "seconds")
+        self.file = open(path, "a", newline = "")
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0: # New file
+            self.writer.writerow(["run_id", "pipeline", "stage", "seconds", "timestamp"])
+
+    def write(self, pipeline: str, stage: str, seconds: float):
+        """
+        Writes one timing to the file.
+
+        Args:
+            pipeline (str): Name of the pipeline.
+            stage (str): Name of the stage.
+            seconds (float): Duration of the stage.
+        """
+
+        self.writer.writerow([self.run_id, pipeline, stage, f"{seconds:.3f}", f"{time.time():.3f}"])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class PipelineMetrics:
+    """
+    Keeps rolling performance data of a pipeline: per-stage durations and APK completion times.
+    """
+
+    def __init__(self, name: str, window: int, log: TimingLog = None, samples: int = 1000):
+        """
+        Args:
+            name (str): Name of the pipeline.
+            window (int): Time window in seconds for the throughput.
+            log (TimingLog): Where raw timings are persisted (optional).
+            samples (int): Number of recent durations kept per stage.
+        """
+
+        self.name = name
+        self.window = window
+        self.log = log
+        self.samples = samples
+        self.start_time = time.time()
+        self.stages = {} # Stage name -> recent durations
+        self.histograms = {} # Stage name -> [bucket counts, sum, count] since start
+        self.completions = deque() # Completion times inside the window
+        self.counters = {} # Event name -> number of times it happened since start
+        self.samples_by_name = {} # Measurement name -> recent values (e.g. cold start time of apps)
+        self.daily_counters = {} # Event name -> number of times it happened today (UTC)
+        self.day = datetime.now(timezone.utc).date()
+
+    def record(self, stage: str, seconds: float):
+        """
+        Records the duration of a stage.
+        """
+
+        if stage not in self.stages:
+            self.stages[stage] = deque(maxlen = self.samples)
+        self.stages[stage].append(seconds)
+
+        if stage not in self.histograms:
+            self.histograms[stage] = [[0] * len(HISTOGRAM_BUCKETS), 0.0, 0]
+        histogram = self.histograms[stage]
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                histogram[0][i] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+        if self.log is not None:
+            self.log.write(self.name, stage, seconds)
+
+    def sample(self, name: str, value: float):
+        """
+        Records a measurement of a processed APK (e.g. cold start time or memory use of the app).
+
+        Args:
+            name (str): Name of the measurement.
+            value (float): Measured value.
+        """
+
+        if name not in self.samples_by_name:
+            self.samples_by_name[name] = deque(maxlen = self.samples)
+        self.samples_by_name[name].append(value)
+
+    def sample_percentiles(self, name: str) -> tuple[float | None, float | None]:
+        """
+        Returns:
+            tuple:
+                - **p50** (float | None): Median of the measurement.
+                - **p95** (float | None): 95th percentile of the measurement.
+        """
+
+        values = list(self.samples_by_name.get(name, []))
+        return (percentile(values, 50), percentile(values, 95))
+
+    def count(self, event: str):
+        """
+        Records that an event happened (e.g. a VirusTotal request or a cache hit).
+
+        Args:
+            event (str): Name of the event.
+        """
+
+        today = datetime.now(timezone.utc).date()
+        if today != self.day: # Daily counters restart at UTC midnight
+            self.day = today
+            self.daily_counters = {}
+
+        self.counters[event] = self.counters.get(event, 0) + 1
+        self.daily_counters[event] = self.daily_counters.get(event, 0) + 1
+
+    def count_today(self, event: str) -> int:
+        """
+        Returns:
+            count (int): Number of times the event happened today (UTC).
+        """
+
+        if datetime.now(timezone.utc).date() != self.day:
+            return 0
+        return self.daily_counters.get(event, 0)
+
+    def mark_completed(self):
+        """
+        Records that the pipeline has finished processing one APK.
+        """
+
+        self.completions.append(time.time())
+
+    def throughput(self) -> float:
+        """
+        Returns:
+            rate (float): Processed APKs per hour over the rolling window.
+        """
+
+        now = time.time()
+        while self.completions and now - self.completions[0] > self.window:
+            self.completions.popleft()
+
+        # At least a minute, so that the first APKs don't give huge rates
+        elapsed = max(60, min(self.window, now - self.start_time))
+        return len(self.completions) * 3600 / elapsed
+
+    def eta(self, remaining: int) -> float | None:
+        """
+        Estimates the time left until the pipeline reaches its APK limit.
+
+        Args:
+            remaining (int): Number of APKs that are left.
+        Returns:
+            One_of_Two:
+                - **seconds** (float): Estimated time left.
+                - **None**: If there is no throughput yet.
+        """
+
+        if remaining <= 0:
+            return 0.0
+
+        rate = self.throughput()
+        if rate == 0:
+            return None
+        return remaining * 3600 / rate
+
+    def stage_percentiles(self, stage: str) -> tuple[float | None, float | None]:
+        """
+        Returns:
+            tuple:
+                - **p50** (float | None): Median duration of the stage.
+                - **p95** (float | None): 95th percentile duration of the stage.
+        """
+
+        values = list(self.stages.get(stage, []))
+        return (percentile(values, 50), percentile(values, 95))
@@ -0,0 +1,176 @@
+import os
+import threading as th
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import HISTOGRAM_BUCKETS
+
+PREFIX = "apk_observer"
+
+def format_labels(labels: dict) -> str:
+    """
+    Formats metric labels in Prometheus text format.
+
+    Args:
+        labels (dict): Label names and values.
+    Returns:
+        text (str): Labels, e.g. '{pipeline="test"}'.
+    """
+
+    if not labels:
+        return ""
+
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def render_prometheus(pipelines: list[tuple], vt_daily_quota: int) -> str:
+    """
+    Renders the stats and performance data of the programs in Prometheus text format.
+
+    Args:
+        pipelines (list[tuple]): For every program: (name, stats, metrics, number of APKs left).
+        vt_daily_quota (int): Number of VirusTotal requests allowed per day.
+    Returns:
+        text (str): Metrics in Prometheus text format.
+    """
+
+    # Metric name -> (type, help, list of (labels, value))
+    families = {}
+    def add(name: str, kind: str, help_text: str, labels: dict, value: float):
+        families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+
+    for name, stats, metrics, remaining in pipelines:
+        pipeline = {"pipeline": name}
+
+        # Counters of the TUI
+        for key, value in stats.items():
+            if key == "counter":
+                add(f"{PREFIX}_counter", "gauge", "Number of the APK in progress (row of latest.csv).", pipeline, value)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                add(f"{PREFIX}_apks_total", "counter", "Processed APKs by result.", {**pipeline, "result": key}, value)
+
+        add(f"{PREFIX}_queue_depth", "gauge", "APKs left until the APK limit is reached.",
+            pipeline, remaining)
+        add(f"{PREFIX}_throughput_apks_per_hour", "gauge", "Processed APKs per hour (rolling window).",
+            pipeline, metrics.throughput())
+
+        # Stage latencies
+        for stage, (buckets, total, count) in metrics.histograms.items():
+            labels = {**pipeline, "stage": stage}
+            for bound, bucket_count in zip(HISTOGRAM_BUCKETS, buckets):
+                add(f"{PREFIX}_stage_duration_seconds", "histogram", "Duration of pipeline stages.",
+                    {**labels, "le": bound}, bucket_count)
+            add(f"{PREFIX}_stage_duration_seconds", "histogram", "", {**labels, "le": "+Inf"}, count)
+            add(f"{PREFIX}_stage_duration_seconds", "histogram", "", {**labels, "_suffix": "sum"}, total)
+            add(f"{PREFIX}_stage_duration_seconds", "histogram", "", {**labels, "_suffix": "count"}, count)
+
+        if "boot" in metrics.histograms:
+            _, total, count = metrics.histograms["boot"]
+            add(f"{PREFIX}_emulator_boots_total", "counter", "Number of emulator boots.", pipeline, count)
+            add(f"{PREFIX}_emulator_boot_seconds_total", "counter", "Time spent booting emulators.", pipeline, total)
+
+        # Events and cache hit rates ('<cache>_hit' / '<cache>_miss' events)
+        caches = set()
+        for event, count in metrics.counters.items():
+            add(f"{PREFIX}_events_total", "counter", "Number of pipeline events.", {**pipeline, "event": event}, count)
+            if event.endswith(("_hit", "_miss")):
+                caches.add(event.rsplit("_", 1)[0])
+
+        for cache in sorted(caches):
+            hits = metrics.counters.get(f"{cache}_hit", 0)
+            misses = metrics.counters.get(f"{cache}_miss", 0)
+            add(f"{PREFIX}_cache_hit_ratio", "gauge", "Hit rate of caches.",
+                {**pipeline, "cache": cache}, hits / (hits + misses))
+
+        if name == "scan":
+            add(f"{PREFIX}_vt_quota_remaining", "gauge", "VirusTotal requests left today (UTC, this process).",
+                {}, max(0, vt_daily_quota - metrics.count_today("vt_request")))
+            add(f"{PREFIX}_vt_quota_saved_total", "counter", "APKs labelled from latest.csv without a VirusTotal request.",
+                {}, metrics.counters.get("csv_label_hit", 0))
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            labels = dict(labels)
+            suffix = labels.pop("_suffix", "bucket" if kind == "histogram" else None)
+            metric_name = f"{name}_{suffix}" if suffix else name
+            lines.append(f"{metric_name}{format_labels(labels)} {float(value):g}")
+
+    return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """
+    Exports metrics through a local HTTP endpoint and/or a periodically rewritten file.\n
+    It only serves the last rendered text, so scraping never waits for the programs.
+    """
+
+    def __init__(self, host: str, port: int, path: str):
+        """
+        Args:
+            host (str): Address of the HTTP endpoint.
+            port (int): Port of the HTTP endpoint (0 disables it).
+            path (str): Path of the metrics file (empty string disables it).
+        """
+
+        self.host = host
+        self.port = port
+        self.path = path
+        self.text = ""
+        self.server = None
+
+    def start(self):
+        """
+        Starts the HTTP endpoint in a background thread (if enabled).
+        """
+
+        if not self.port:
+            return
+
+        exporter = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.text.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Keeps stderr (errors.txt) clean
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        th.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    def update(self, text: str):
+        """
+        Publishes new metrics.
+
+        Args:
+            text (str): Metrics in Prometheus text format.
+        """
+
+        self.text = text
+        if self.path:
+            # Writes a temporary file first, so readers never see a half-written file
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        """
+        Stops the HTTP endpoint.
+        """
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,100 @@
+import cProfile
+import os
+import sys
+import time
+import pstats
+import multiprocessing as mp
+from multiprocessing import util
+from contextlib import contextmanager, nullcontext
+from config import PROFILING, PROFILE_DIR
+
+DUMP_INTERVAL = 60 # Seconds between writes of the profile files
+
+profiles = {} # Stage name -> cProfile.Profile of this process
+owner_pid = None # Process that owns 'profiles' (forked children start with empty profiles)
+active = False # True while a stage is profiled (nested stages are counted in the outer one)
+last_dump = 0
+
+def dump_profiles():
+    """
+    Writes the profiles of this process to files (one per stage).\n
+    File name: '<process name>-<pid>-<stage>.prof'. They can be read with 'pstats' or snakeviz.
+    """
+
+    global last_dump
+    if owner_pid != os.getpid():
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok = True)
+    process_name = mp.current_process().name
+    for stage, profile in profiles.items():
+        profile.dump_stats(os.path.join(PROFILE_DIR, f"{process_name}-{owner_pid}-{stage}.prof"))
+    last_dump = time.time()
+
+def get_profile(stage: str) -> cProfile.Profile:
+    """
+    Returns the profile of a stage in this process (creates it if needed).
+    """
+
+    global owner_pid
+    if owner_pid != os.getpid(): # New process
+        profiles.clear()
+        owner_pid = os.getpid()
+        util.Finalize(None, dump_profiles, exitpriority = 10) # Also runs when a worker process exits
+
+    if stage not in profiles:
+        profiles[stage] = cProfile.Profile()
+    return profiles[stage]
+
+@contextmanager
+def _profile_stage(stage: str):
+    global active
+    if active: # Nested stage
+        yield
+        return
+
+    profile = get_profile(stage)
+    active = True
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        active = False
+        if time.time() - last_dump >= DUMP_INTERVAL:
+            dump_profiles()
+
+def profile_stage(stage: str):
+    """
+    Profiles a stage with cProfile when profiling is enabled (PROFILING in config.ini or
+    APK_OBSERVER_PROFILE environment variable). Otherwise, it does nothing.
+
+    Args:
+        stage (str): Name of the stage.
+    """
+
+    if not PROFILING:
+        return nullcontext()
+    return _profile_stage(stage)
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    # Prints the slowest functions of every stage (profiles of all processes are merged)
+    by_stage = {}
+    names = sorted(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else []
+    for name in names:
+        if name.endswith(".prof"):
+            stage = name[:-len(".prof")].rsplit("-", 1)[1]
+            by_stage.setdefault(stage, []).append(os.path.join(PROFILE_DIR, name))
+
+    if not by_stage:
+        print(f"No profiles found in '{PROFILE_DIR}'. Enable profiling in config.ini first.")
+        sys.exit(1)
+
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    for stage, paths in sorted(by_stage.items()):
+        print(f"\n========== {stage} ({len(paths)} process(es)) ==========")
+        pstats.Stats(*paths).sort_stats("cumulative").print_stats(limit)
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import psutil
+from work_queue import WorkerPool
+from config import MIN_FREE_RAM_MB, MIN_FREE_DISK_MB, MAX_CPU_PERCENT, MAX_LOAD_PER_CPU, SCALING_LOG
+
+SWAP_IN_LIMIT = 1024 * 1024 # Swapped-in bytes per second that count as swapping
+HEADROOM = 0.8 # Scales up only below this share of the CPU and load limits
+RAM_RAMP_SECONDS = 180 # Time until a new worker (a booting emulator) uses all of its RAM
+
+class ResourceController:
+    """
+    Adapts the number of workers (emulators and scanner workers) to the free resources of the host.\n
+    It samples CPU, free RAM, load, disk space and swap activity with psutil. Under pressure it stops
+    one worker (after its current APK), before the host starts swapping and emulator boots time out.
+    When there is room for one more worker, it starts one. Every decision is logged to SCALING_LOG.
+    """
+
+    def __init__(self):
+        psutil.cpu_percent(interval = None) # First call only starts the measurement
+        self.last_swap_in = psutil.swap_memory().sin
+        self.last_sample = time.time()
+        self.reserved = [] # (start time, RAM in MB) of recently started workers
+
+    def sample(self) -> dict:
+        """
+        Measures the resources of the host.
+
+        Returns:
+            sample (dict): CPU usage, free RAM, load per CPU, free disk space and swap-in rate.
+        """
+
+        now = time.time()
+        self.reserved = [(started, ram_mb) for started, ram_mb in self.reserved if now - started < RAM_RAMP_SECONDS]
+        swap_in = psutil.swap_memory().sin
+        swap_in_rate = (swap_in - self.last_swap_in) / max(now - self.last_sample, 1e-9)
+        self.last_swap_in = swap_in
+        self.last_sample = now
+
+        return {
+            "cpu_percent": psutil.cpu_percent(interval = None),
+            "available_mb": psutil.virtual_memory().available // 2**20,
+            "reserved_mb": sum(ram_mb for _, ram_mb in self.reserved), # Not used yet by new workers
+            "load_per_cpu": round(os.getloadavg()[0] / (psutil.cpu_count() or 1), 2),
+            "disk_free_mb": psutil.disk_usage(".").free // 2**20,
+            "swap_in_per_second": int(swap_in_rate),
+        }
+
+    def pressure(self, sample: dict) -> list[str]:
+        """
+        Returns:
+            reasons (list[str]): Why the host is overloaded (empty list if it isn't).
+        """
+
+        reasons = []
+        if sample["available_mb"] < MIN_FREE_RAM_MB:
+            reasons.append("low memory")
+        if sample["swap_in_per_second"] > SWAP_IN_LIMIT:
+            reasons.append("swapping")
+        if sample["cpu_percent"] > MAX_CPU_PERCENT:
+            reasons.append("high CPU")
+        if sample["load_per_cpu"] > MAX_LOAD_PER_CPU:
+            reasons.append("high load")
+        if sample["disk_free_mb"] < MIN_FREE_DISK_MB:
+            reasons.append("low disk space")
+        return reasons
+
+    def step(self, pools: list[tuple[WorkerPool, int, int, int]]) -> list[dict]:
+        """
+        Samples the host and starts or stops at most one worker.
+
+        Args:
+            pools (list[tuple]): For every pool: (pool, minimum workers, maximum workers, RAM per worker in MB).
+                Pools come in priority order (the first one gets new workers first).
+        Returns:
+            decisions (list[dict]): Scaling decisions (empty list if nothing changed).
+        """
+
+        sample = self.sample()
+        reasons = self.pressure(sample)
+        decision = None
+
+        if reasons:
+            # Stops a worker of the pool that uses the most RAM per worker
+            for pool, minimum, _, _ in sorted(pools, key = lambda item: -item[3]):
+                if pool.active_workers() > minimum:
+                    pool.retire_worker()
+                    decision = {"pipeline": pool.name, "change": -1, "reason": ", ".join(reasons)}
+                    break
+        else:
+            for pool, _, maximum, ram_mb in pools:
+                work_left = pool.work.peek() <= pool.work.last
+                room = (sample["available_mb"] - sample["reserved_mb"] - ram_mb >= MIN_FREE_RAM_MB and
+                        sample["cpu_percent"] < MAX_CPU_PERCENT * HEADROOM and
+                        sample["load_per_cpu"] < MAX_LOAD_PER_CPU * HEADROOM)
+                if work_left and room and pool.active_workers() < maximum:
+                    pool.start_worker()
+                    self.reserved.append((time.time(), ram_mb))
+                    decision = {"pipeline": pool.name, "change": 1, "reason": "free resources"}
+                    break
+
+        record = {"time": round(time.time(), 3), **sample,
+                  "workers": {pool.name: pool.active_workers() for pool, _, _, _ in pools}, "decision": decision}
+        with open(SCALING_LOG, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        return [decision] if decision else []
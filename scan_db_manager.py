@@ -1,5 +1,7 @@
 import sqlite3
 from datetime import datetime, timezone
+from analytics import create_tables as create_analytics_tables, record_scan
+from vt_reports import create_table as create_reports_table, store_report
     
 def create_table(cursor):
     """
@@ -16,9 +18,24 @@ def create_table(cursor):
             "positives INTEGER," +
             "total_engines INTEGER," +
             "scan_label TEXT," +
+            "label_source TEXT," +
             "scan_time TEXT)"
     )
 
+    # Databases created before the label source was stored
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(scan_results)")]
+    if "label_source" not in columns:
+        cursor.execute("ALTER TABLE scan_results ADD COLUMN label_source TEXT")
+
+    # Lookups of processed hashes (see hash_index.py)
+    cursor.execute("CREATE INDEX IF NOT EXISTS scan_results_sha256_hash ON scan_results (sha256_hash)")
+
+    # Raw VirusTotal reports (see vt_reports.py)
+    create_reports_table(cursor)
+
+    # Native libraries and summary tables (see analytics.py)
+    create_analytics_tables(cursor)
+
 def insert_row(cursor, connection, data: dict):
     """
     Inserts a record to 'scan_results' table
@@ -30,11 +47,15 @@ def insert_row(cursor, connection, data: dict):
     """
 
     cursor.execute(
-        "INSERT INTO scan_results (sha256_hash, positives, total_engines, scan_label, scan_time)" + 
-        "VALUES (?, ?, ?, ?, ?)", 
+        "INSERT INTO scan_results (sha256_hash, positives, total_engines, scan_label, label_source, scan_time)" + 
+        "VALUES (?, ?, ?, ?, ?, ?)", 
             (data["sha256_hash"], data["positives"], 
-            data["total_engines"], data["scan_label"], data["scan_time"]))
-        
+            data["total_engines"], data["scan_label"], data["label_source"], data["scan_time"]))
+
+    # Updates the summary tables and stores the report in the same transaction
+    record_scan(cursor, cursor.lastrowid, data)
+    if data.get("report") is not None:
+        store_report(cursor, data["sha256_hash"], data["report"])
     connection.commit()
 
 # ////////////////////////////////////
@@ -0,0 +1,99 @@
+import os
+import ast
+from config import STATS_FILE
+
+def init_stats() -> tuple[dict, dict]:
+    """
+    Reads stats from the file.
+    If it doesn't exist, then initializes stats to default zeroed values.
+
+    Returns:
+        tuple:
+            - **test_stats** (dict): Stats for APK Test.
+            - **scan_stats** (dict): Stats for Virus Scan.
+    """
+
+    test_stats = {}
+    scan_stats = {}
+
+    if os.path.exists(STATS_FILE): # If the program has been launched before
+        with open(STATS_FILE) as f:
+            test_stats = ast.literal_eval(f.readline())
+            scan_stats = ast.literal_eval(f.readline())
+    else: # First launch
+        test_stats = {
+            "current": "N/A",
+            "counter": 1,
+            "launched": 0,
+            "crashed": 0,
+            "not_installed": 0,
+            "total": 0
+        }
+
+        scan_stats = {
+            "current": "N/A",
+            "counter": 1,
+            "benign": 0,
+            "suspicious": 0,
+            "malicious": 0,
+            "total": 0
+        }
+
+    return (test_stats, scan_stats)
+
+def save_stats(test_stats: dict, scan_stats: dict):
+    """
+    Saves stats in a .txt file, so that the programs continue from where they stopped.
+
+    Args:
+        test_stats (dict): Stats for APK Test.
+        scan_stats (dict): Stats for Virus Scan.
+    """
+
+    with open(STATS_FILE, "w") as f:
+        f.write(f"{test_stats}\n" +
+        f"{scan_stats}")
+
+class StatsAggregator:
+    """
+    Merges the stats sent by several worker processes of the same program.\n
+    Workers send absolute values of their own copy of the stats, so only the difference
+    since their last message is added. The saved counter is the lowest APK number that is
+    still in progress, so that no APK is skipped when the programs are resumed.
+    """
+
+    def __init__(self, stats: dict):
+        """
+        Args:
+            stats (dict): Stats of the program (updated in place).
+        """
+
+        self.stats = stats
+        self.seen = {} # Worker ID -> last values sent by the worker
+        self.counters = {} # Worker ID -> APK number reported by the worker
+
+    def add_worker(self, worker_id: int):
+        """
+        Registers a worker that starts with a copy of the current stats.
+        """
+
+        self.seen[worker_id] = dict(self.stats)
+
+    def update(self, worker_id: int, key: str, value):
+        """
+        Applies a message of a worker to the stats.
+
+        Args:
+            worker_id (int): ID of the worker.
+            key (str): Name of the stat.
+            value (any): Value sent by the worker.
+        """
+
+        if key == "counter":
+            self.counters[worker_id] = value
+            self.stats["counter"] = min(self.counters.values())
+        elif isinstance(value, int) and isinstance(self.stats.get(key), int):
+            self.stats[key] += value - self.seen[worker_id].get(key, 0)
+            self.seen[worker_id][key] = value
+        else:
+            self.stats[key] = value
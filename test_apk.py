@@ -1,60 +1,98 @@
 import subprocess as sp
+import sys
+import time
 import zipfile as zp
 
-from emu_manager import launch_emulator, shut_down_emulator
-from downloader import download_apk
+from emu_manager import launch_emulator, wait_emulator_ready, shut_down_emulator, select_device, start_standby, discard_standby, drop_standby_push
+from downloader import download_apk, retrieve_entry, get_apk_size
 from app_launch import app_launch_main
 from db_manager import db_main
-from config import AAPT_PATH, MAX_APK_NB_TA
+from metrics import stage_timer
+from work_queue import WorkRange, RetryQueue
+from workspace import Workspace
+from hash_index import HashIndex
+from errors import TransientError, EndOfDataError
+from config import AAPT_PATH, PREBOOT, SKIP_DUPLICATES, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
 
-def get_package_name(apk_path: str) -> str:
+def dump_badging(apk_path: str) -> str:
     """
-    Retrieves the package name of the APK.
+    Reads the metadata of the APK with 'aapt dump badging' (once per APK, the other functions parse its output).
 
+    Args:
+        apk_path (str): Path to the APK file.
     Returns:
-        package_name (str): Package name of the APK.
+        badging (str): Output of AAPT.
+    Raises:
+        RuntimeError: If AAPT can't read the APK.
     """
 
     try:
         result = sp.run([AAPT_PATH, "dump", "badging", apk_path], stdout = sp.PIPE, stderr = sp.DEVNULL, check = True, text = True)
-        for line in result.stdout.splitlines():
-            if line.startswith("package:"):
-                parts = line.split("'")
-                return parts[1] # The package name
-    except FileNotFoundError:
-        raise RuntimeError("ERROR: APK file not found or invalid path.")
+        return result.stdout
+    except FileNotFoundError: # AAPT_PATH is wrong, no APK can be tested
+        connection.send(("current", "ERROR: AAPT not found. Check AAPT_PATH in 'config.ini'."))
+        sys.exit(1)
     except sp.CalledProcessError:
-        raise RuntimeError("ERROR: Failed to extract package name with AAPT.")
+        raise RuntimeError("ERROR: Failed to read the APK with AAPT.")
+
+def get_package_name(badging: str) -> str | None:
+    """
+    Retrieves the package name of the APK.
+
+    Args:
+        badging (str): Output of 'dump_badging'.
+    Returns:
+        package_name (str): Package name of the APK (None if missing).
+    """
+
+    for line in badging.splitlines():
+        if line.startswith("package:"):
+            parts = line.split("'")
+            return parts[1] # The package name
+    return None
+
+def get_launchable_activity(badging: str) -> str | None:
+    """
+    Retrieves the activity started by the launcher.
+
+    Args:
+        badging (str): Output of 'dump_badging'.
+    Returns:
+        One_of_Two:
+            - **activity** (str): Class name of the activity.
+            - **None**: If the APK has no launchable activity.
+    """
+
+    for line in badging.splitlines():
+        if line.startswith("launchable-activity:"):
+            return line.split("'")[1] # The class name
+    return None
 
-def get_sdk_info() -> dict:
+def get_sdk_info(badging: str) -> dict:
     """
     Retrieves and returns minimum, target, and maximum SDK versions of an apk.
 
+    Args:
+        badging (str): Output of 'dump_badging'.
     Returns:
         sdk_info (dict): SDK versions    
     """
 
-    try:
-        output = sp.check_output([AAPT_PATH, 'dump', 'badging', "./test.apk"], stderr = sp.DEVNULL)
-        lines = output.decode().splitlines()
-
-        sdk_info = {
-            "min": None,
-            "target": None,
-            "max": None
-        }
-
-        for line in lines:
-            if line.startswith("sdkVersion:"):
-                sdk_info["min"] = line.split("'")[1]
-            elif line.startswith("targetSdkVersion:"):
-                sdk_info["target"] = line.split("'")[1]
-            elif line.startswith("maxSdkVersion:"):
-                sdk_info["max"] = line.split("'")[1]
-
-        return sdk_info
-    except sp.CalledProcessError:
-        connection.send(("current", f"ERROR: Failed to retrieve SDK versions."))
+    sdk_info = {
+        "min": None,
+        "target": None,
+        "max": None
+    }
+
+    for line in badging.splitlines():
+        if line.startswith("sdkVersion:"):
+            sdk_info["min"] = line.split("'")[1]
+        elif line.startswith("targetSdkVersion:"):
+            sdk_info["target"] = line.split("'")[1]
+        elif line.startswith("maxSdkVersion:"):
+            sdk_info["max"] = line.split("'")[1]
+
+    return sdk_info
 
 def get_native_libs(apk_path: str) -> list[str] | list:
     """
@@ -82,89 +120,253 @@ def get_native_libs(apk_path: str) -> list[str] | list:
 
     return ["ERROR"]
 
+def get_sdk_version(sdk_info: dict) -> int:
+    """
+    Returns the SDK version used to choose the emulator: the target SDK version,
+    or the minimum SDK version if the target is empty.
+    """
+
+    if sdk_info["target"] != None:
+        return int(sdk_info["target"])
+    elif sdk_info["min"] != None:
+        return int(sdk_info["min"])
+    return 0
+
+def prepare_apk(app_number: int, file_name: str) -> dict:
+    """
+    Downloads the APK to the workspace and retrieves its metadata.
+
+    Args:
+        app_number (int): Number of the app from the CSV file.
+        file_name (str): Name of the APK file in the workspace.
+    Returns:
+        apk (dict): Path, SHA-256 hash, package name, SDK versions, native libraries, launchable
+            activity, whether the hash was already tested (then, nothing is downloaded), and the
+            error raised while reading the APK (None if there was none).
+    Raises:
+        EndOfDataError: If the APK number is past the end of 'latest.csv'.
+    """
+
+    apk = {
+        "path": None,
+        "sha256_hash": None,
+        "package_name": None,
+        "sdk_info": {"min": None, "target": None, "max": None},
+        "native_libs": [],
+        "activity": None,
+        "duplicate": False,
+        "error": None
+    }
+
+    # Retrieves the hash and size of the APK
+    with stage_timer(connection, "hash_lookup"):
+        entry = retrieve_entry(app_number)
+    apk["sha256_hash"] = entry["sha256"]
+
+    # Hash already tested (duplicate row or overlapping range)
+    if index is not None and entry["sha256"] in index:
+        apk["duplicate"] = True
+        return apk
+
+    # Chooses tmpfs or disk depending on the free room
+    apk_path, storage = workspace.path(file_name, get_apk_size(entry))
+    apk["path"] = apk_path
+    connection.send(("count", f"scratch_{storage}"))
+
+    # Downloads the APK
+    try:
+        download_apk(app_number, apk_path, connection, entry["sha256"], get_apk_size(entry))
+    except RuntimeError as e:
+        apk["error"] = e
+        return apk
+
+    with stage_timer(connection, "metadata"):
+        try:
+            # Retrieves package name, the activity to launch and SDK versions (one AAPT run)
+            badging = dump_badging(apk_path)
+            apk["package_name"] = get_package_name(badging)
+            apk["activity"] = get_launchable_activity(badging)
+            apk["sdk_info"] = get_sdk_info(badging)
+
+            # Retrieves native libraries that the app uses
+            apk["native_libs"] = get_native_libs(apk_path)
+        except RuntimeError as e:
+            apk["error"] = e
+
+    return apk
+
 # ////////////////////////////////////
 # /////////////// MAIN ///////////////
 # ////////////////////////////////////
 connection = None
+workspace = None
+index = None
 
-def ta_main(stats, conn, quit_flag: bool):
-    # Making the connection global to all functions
-    global connection
+def ta_main(stats, conn, quit_flag: bool, work: WorkRange, worker_id: int = 0):
+    # Making the connection, workspace and index global to all functions
+    global connection, workspace, index
     connection = conn
 
-    outcome = "Launched successfully"
-    while stats["counter"] <= MAX_APK_NB_TA:
-        try:
+    # Hashes already tested (loaded from the database)
+    if SKIP_DUPLICATES:
+        with stage_timer(connection, "index_load"):
+            index = HashIndex("test")
+
+    # Every worker downloads to its own scratch directory and runs its own emulators. The second
+    # file holds the next APK, which is downloaded while the current one is tested (pre-boot)
+    workspace = Workspace("test", worker_id)
+    file_names = ["test.apk", "test_next.apk"]
+    slot = 0
+    select_device(worker_id, connection)
+
+    # APKs that failed with a temporary error, tried again later
+    retries = RetryQueue(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+
+    next_apk = None # Prefetched next APK: (app number, APK data)
+    end_of_data = False # True once an APK number is past the end of 'latest.csv' (only retries are left)
+    resume = None
+    try:
+        while True:
             # Checks if the quit flag is triggered
             if quit_flag.value == True:
-                connection.send(("counter", stats["counter"])) # Sends the "counter" to save it in a 
+                resume = next_apk[0] if next_apk else work.peek() # Prefetched APK was not tested
+                if retries:
+                    resume = min(resume, retries.lowest())
+                connection.send(("counter", resume)) # Sends the "counter" to save it
                 connection.send(("current", "Exited early due to user request."))
                 break
 
-            # Downloads the APK
-            apk_path = "test.apk"
-            sha256_hash = download_apk(stats["counter"], apk_path, connection)
-            
-            # Retrieves package name
-            package_name = get_package_name(apk_path)
+            # Takes the next APK (already downloaded if it was prefetched) or an APK due for a retry
+            if next_apk is not None:
+                app_number, apk = next_apk
+                next_apk = None
+            else:
+                app_number = retries.claim(None if end_of_data else work)
+                if app_number is None:
+                    if not retries: # All APKs are tested
+                        break
+                    time.sleep(min(1, retries.wait_time())) # Waits for the next retry
+                    continue
+                apk = None
+            stats["counter"] = app_number
+            # APK in progress (resume point, APKs waiting for a retry are not passed)
+            connection.send(("counter", min(app_number, retries.lowest()) if retries else app_number))
 
-            # Retrieves SDK versions and shows them
-            sdk_info = get_sdk_info()
+            if apk is None:
+                try:
+                    apk = prepare_apk(app_number, file_names[slot])
+                except EndOfDataError as e:
+                    end_of_data = True
+                    connection.send(("current", f"{e} No more APKs to test."))
+                    continue
 
-            # Retrieves native libraries that the app uses
-            native_libs = get_native_libs(apk_path)
+            # Skips an APK that was already tested (a prefetched APK may have been tested since)
+            if not apk["duplicate"] and index is not None and apk["sha256_hash"] in index:
+                apk["duplicate"] = True
+                workspace.remove(apk["path"])
+            if apk["duplicate"]:
+                drop_standby_push() # The standby emulator may be receiving this APK
+                connection.send(("count", "duplicate_skip"))
+                connection.send(("current", f"File {app_number} was already tested. Skipped."))
+                continue
 
-            # Launches corresponding Android emulator
-            sdk_version = 0
-            if sdk_info["target"] != None:
-                sdk_version = sdk_info["target"]
-            elif sdk_info["min"] != None: # If target is empty, sends min SDK version
-                sdk_version = sdk_info["min"]
+            outcome = "Launched successfully"
+            retry = False # True if the APK failed with a temporary error and will be tried again
+            performance = {} # Cold start, memory and CPU of the app (filled while it runs)
+            try:
+                if apk["error"] is not None:
+                    raise apk["error"]
 
-            # Launches the emulator
-            launch_emulator(int(sdk_version), connection)
+                # Launches corresponding Android emulator (or takes the standby one) and pushes the APK while it boots
+                launch_emulator(get_sdk_version(apk["sdk_info"]), connection, apk["path"], apk["sha256_hash"])
 
-            # Installs, runs the app, and does the health check
-            app_launch_main(apk_path, package_name, connection)            
+                # Downloads the next APK while the emulator boots, then boots its emulator in the background
+                if PREBOOT and quit_flag.value == False:
+                    next_number = retries.claim(None if end_of_data else work)
+                    if next_number is not None:
+                        try:
+                            next_apk = (next_number, prepare_apk(next_number, file_names[1 - slot]))
+                            slot = 1 - slot
+                        except EndOfDataError as e:
+                            end_of_data = True
+                            connection.send(("current", f"{e} No more APKs to test."))
 
-            # Updates TUI
-            stats["launched"] += 1
-            connection.send(("launched", stats["launched"]))
-        except RuntimeError as e:
-            if str(e) in ["Error: App crashed.", "Error: App is not running."]: # App crashed or not running
-                stats["crashed"] += 1
-                connection.send(("crashed", stats["crashed"]))
-            else: # App was not installed correctly or misses split APKs
-                stats["not_installed"] += 1
-                connection.send(("not_installed", stats["not_installed"]))
-            
-            connection.send(("current", e))
-            outcome = str(e)
-        finally:
-            stats["counter"] += 1
-            stats["total"] += 1
-            connection.send(("total", stats["total"]))
-
-            data = {
-                "apk_name": package_name,
-                "sha256_hash": sha256_hash,
-                "min_sdk_version": sdk_info["min"],
-                "sdk_version": sdk_info["target"],
-                "max_sdk_version": sdk_info["max"],
-                "native_libs": ", ".join(native_libs) if native_libs else "", # If list is empty, put empty string
-                "outcome": outcome,
-                "scan_label": "PENDING",
-                "positives": "PENDING",
-                "total_engines": "PENDING",
-                "scan_time": "PENDING"
-            }
-
-            # Updates the database
-            db_main(data, connection)
-
-            # Shuts down the emulator
-            shut_down_emulator()
-
-    connection.send(("counter", stats["counter"]))
+                # Waits for the emulator of the current APK
+                wait_emulator_ready()
+
+                if next_apk is not None and next_apk[1]["error"] is None and not next_apk[1]["duplicate"]:
+                    start_standby(get_sdk_version(next_apk[1]["sdk_info"]), next_apk[1]["path"],
+                                  next_apk[1]["sha256_hash"])
+
+                # Installs, runs the app, and does the health check
+                app_launch_main(apk["path"], apk["package_name"], connection, apk["activity"], performance)
+
+                # Updates TUI
+                stats["launched"] += 1
+                connection.send(("launched", stats["launched"]))
+            except TransientError as e:
+                retry = retries.add(app_number)
+                if retry:
+                    connection.send(("count", "retry"))
+                    connection.send(("current", f"{e} File {app_number} will be tried again " +
+                                                f"({retries.failed_attempts(app_number)}/{RETRY_MAX_ATTEMPTS} attempts failed)."))
+                else:
+                    connection.send(("count", "give_up"))
+                    stats["not_installed"] += 1
+                    connection.send(("not_installed", stats["not_installed"]))
+                    outcome = f"{e} Gave up after {RETRY_MAX_ATTEMPTS} attempts."
+                    connection.send(("current", outcome))
+            except RuntimeError as e:
+                if str(e) in ["Error: App crashed.", "Error: App is not running."]: # App crashed or not running
+                    stats["crashed"] += 1
+                    connection.send(("crashed", stats["crashed"]))
+                else: # App was not installed correctly or misses split APKs
+                    stats["not_installed"] += 1
+                    connection.send(("not_installed", stats["not_installed"]))
+                
+                connection.send(("current", e))
+                outcome = str(e)
+            finally:
+                if not retry: # Nothing is recorded until the last attempt
+                    stats["total"] += 1
+                    connection.send(("total", stats["total"]))
+
+                    data = {
+                        "apk_name": apk["package_name"],
+                        "sha256_hash": apk["sha256_hash"],
+                        "min_sdk_version": apk["sdk_info"]["min"],
+                        "sdk_version": apk["sdk_info"]["target"],
+                        "max_sdk_version": apk["sdk_info"]["max"],
+                        "native_libs": ", ".join(apk["native_libs"]) if apk["native_libs"] else "", # If list is empty, put empty string
+                        "outcome": outcome,
+                        "cold_start_ms": performance.get("cold_start_ms"),
+                        "wait_time_ms": performance.get("wait_time_ms"),
+                        "pss_kb": performance.get("pss_kb"),
+                        "rss_kb": performance.get("rss_kb"),
+                        "cpu_percent": performance.get("cpu_percent"),
+                        "scan_label": "PENDING",
+                        "positives": "PENDING",
+                        "total_engines": "PENDING",
+                        "scan_time": "PENDING"
+                    }
+
+                    # Updates the database
+                    with stage_timer(connection, "db_write"):
+                        db_main(data, connection)
+                    if index is not None and not outcome.startswith("ERROR"): # Program errors are tried again
+                        index.add(apk["sha256_hash"])
+
+                # Shuts down the emulator and frees the room of the APK
+                shut_down_emulator()
+                if apk["path"] is not None:
+                    workspace.remove(apk["path"])
+    finally:
+        # Shuts down the standby emulator if the next APK will not be tested
+        discard_standby()
+        workspace.cleanup()
+        if index is not None:
+            index.close()
+
+    connection.send(("counter", work.peek() if resume is None else resume))
     connection.send(("current", "Finished testing all APKs."))
-    connection.close()
\ No newline at end of file
+    connection.close()
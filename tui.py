@@ -5,17 +5,23 @@ from rich.columns import Columns
 from rich.text import Text
 
 import multiprocessing as mp
-import subprocess as sp
 import threading as th
-import os
 import sys
-import ast
+import time
 import select
 import tty, termios
 from time import sleep
 from virus_scan import vs_main
 from test_apk import ta_main
-from config import ERRORS_FILE, STATS_FILE
+from downloader import check_ssh
+from stats_manager import init_stats, save_stats
+from work_queue import WorkRange
+from metrics import PipelineMetrics, TimingLog, format_duration
+from profiler import profile_stage
+from metrics_exporter import MetricsExporter, render_prometheus
+from config import ERRORS_FILE, TIMINGS_FILE, THROUGHPUT_WINDOW, MAX_APK_NB_TA, MAX_APK_NB_VS
+from config import METRICS_HOST, METRICS_PORT, METRICS_FILE, METRICS_INTERVAL, VT_DAILY_QUOTA
+from config import LABEL_SUSPICIOUS_MIN, LABEL_MALICIOUS_MIN
 
 def key_listener():
     """
@@ -27,55 +33,6 @@ def key_listener():
             if key == 'q':
                 user_triggered.set()
 
-def check_ssh():
-    """
-    Checks if the SSH key is added to the agent.
-    """
-
-    result = sp.run(["ssh-add", "-l"], stdout = sp.PIPE, stderr = sp.DEVNULL)
-    if result.returncode != 0:
-        print("ERROR: SSH key is not added to the agent.")
-        sys.exit(1)
-
-def init_stats() -> tuple[dict, dict]:
-    """
-    Reads stats from the file. 
-    If it doesn't exist, then initializes stats to default zeroed values.
-
-    Returns:
-        tuple:
-            - **test_stats** (dict): Stats for APK Test.
-            - **scan_stats** (dict): Stats for Virus Scan.
-    """
-
-    test_stats = {}
-    scan_stats = {}
-
-    if os.path.exists(STATS_FILE): # If the program has been launched before
-        with open(STATS_FILE) as f:
-            test_stats = ast.literal_eval(f.readline())
-            scan_stats = ast.literal_eval(f.readline())
-    else: # First launch
-        test_stats = {        
-            "current": "N/A",
-            "counter": 1,
-            "launched": 0,
-            "crashed": 0,
-            "not_installed": 0,
-            "total": 0
-        }
-        
-        scan_stats = {
-            "current": "N/A",
-            "counter": 1,
-            "benign": 0,
-            "suspicious": 0,
-            "malicious": 0,
-            "total": 0
-        }
-
-    return (test_stats, scan_stats)
-
 def make_test_table(stats):
     """
     Writes down APK tester stats to the TUI.
@@ -108,12 +65,116 @@ def make_scan_table(stats):
     table.add_column("Value", width = 35)
 
     table.add_row("Current status:\n", str(stats.get("current", "N/A")))
-    table.add_row("Benign (0 flags):", str(stats.get("benign", "N/A")))
-    table.add_row("Suspicious (1 - 2 flags):", str(stats.get("suspicious", "N/A")))
-    table.add_row("Malicious (2+ flags):", str(stats.get("malicious", "N/A")))
+    table.add_row(f"Benign (< {LABEL_SUSPICIOUS_MIN} flags):", str(stats.get("benign", "N/A")))
+    table.add_row(f"Suspicious ({LABEL_SUSPICIOUS_MIN} - {LABEL_MALICIOUS_MIN - 1} flags):", str(stats.get("suspicious", "N/A")))
+    table.add_row(f"Malicious ({LABEL_MALICIOUS_MIN}+ flags):", str(stats.get("malicious", "N/A")))
     table.add_row("Total apks scanned:", str(stats.get("total", "N/A")))
     return table
 
+# Performance of tested apps shown in the TUI: (label, measurement, unit, scale)
+APP_SAMPLES = [
+    ("App cold start:", "cold_start_ms", "ms", 1),
+    ("App PSS:", "pss_kb", "MB", 1 / 1024),
+    ("App RSS:", "rss_kb", "MB", 1 / 1024),
+    ("App CPU:", "cpu_percent", "%", 1),
+]
+
+def make_perf_table(test_metrics: PipelineMetrics, scan_metrics: PipelineMetrics, test_stats: dict, scan_stats: dict):
+    """
+    Writes down throughput, ETA and per-stage latencies of both programs to the TUI.
+
+    Args:
+        test_metrics (PipelineMetrics): Performance data of APK tester.
+        scan_metrics (PipelineMetrics): Performance data of Virus scanner.
+        test_stats (dict): test_apk.py stats.
+        scan_stats (dict): virus_scan.py stats.
+    """
+
+    table = Table(title = "Performance (p50 / p95)")
+    table.add_column("Metric")
+    table.add_column("APK tester", width = 20)
+    table.add_column("Virus scanner", width = 20)
+
+    table.add_row("Throughput:", 
+                  f"{test_metrics.throughput():.1f} APKs/h", 
+                  f"{scan_metrics.throughput():.1f} APKs/h")
+    table.add_row("ETA:", 
+                  format_duration(test_metrics.eta(MAX_APK_NB_TA - test_stats["counter"] + 1)), 
+                  format_duration(scan_metrics.eta(MAX_APK_NB_VS - scan_stats["counter"] + 1)))
+
+    # Share of emulators that were already booting when they were needed
+    hits, misses = test_metrics.counters.get("preboot_hit", 0), test_metrics.counters.get("preboot_miss", 0)
+    if hits + misses:
+        table.add_row("Pre-boot hits:", f"{hits / (hits + misses):.0%} ({hits}/{hits + misses})", "-")
+
+    # APKs labelled from 'latest.csv' (every one saves at least one VirusTotal request)
+    if "csv_label_hit" in scan_metrics.counters or "csv_label_miss" in scan_metrics.counters:
+        table.add_row("VT quota saved:", "-", f"{scan_metrics.counters.get('csv_label_hit', 0)} requests")
+
+    # APKs skipped because their hash was already processed
+    if "duplicate_skip" in test_metrics.counters or "duplicate_skip" in scan_metrics.counters:
+        table.add_row("Duplicates skipped:", str(test_metrics.counters.get("duplicate_skip", 0)), 
+                      str(scan_metrics.counters.get("duplicate_skip", 0)))
+
+    # APKs tried again after a temporary error / given up after RETRY_MAX_ATTEMPTS
+    if any(name in metrics.counters for metrics in (test_metrics, scan_metrics) for name in ("retry", "give_up")):
+        table.add_row("Retries / give-ups:",
+                      f"{test_metrics.counters.get('retry', 0)} / {test_metrics.counters.get('give_up', 0)}",
+                      f"{scan_metrics.counters.get('retry', 0)} / {scan_metrics.counters.get('give_up', 0)}")
+
+    # Distributions of the performance of tested apps
+    for label, name, unit, scale in APP_SAMPLES:
+        p50, p95 = test_metrics.sample_percentiles(name)
+        if p50 is not None:
+            table.add_row(label, f"{p50 * scale:.0f} / {p95 * scale:.0f} {unit}", "-")
+
+    # Stages in the order they were first seen
+    stages = list(test_metrics.stages) + [stage for stage in scan_metrics.stages if stage not in test_metrics.stages]
+    for stage in stages:
+        cells = []
+        for metrics in (test_metrics, scan_metrics):
+            p50, p95 = metrics.stage_percentiles(stage)
+            cells.append("-" if p50 is None else f"{format_duration(p50)} / {format_duration(p95)}")
+        table.add_row(f"{stage}:", *cells)
+    return table
+
+FINISH_MESSAGES = ["Finished testing all APKs.", "Finished scanning all APKs.", "Exited early due to user request."]
+
+def receive_updates(conn, stats: dict, metrics: PipelineMetrics, timeout: float) -> bool:
+    """
+    Reads all pending messages of a program and updates its stats and performance data.
+
+    Args:
+        conn (Connection): Connection pipe between the program and TUI.
+        stats (dict): Stats of the program.
+        metrics (PipelineMetrics): Performance data of the program.
+        timeout (float): Time to wait for the first message.
+    Returns:
+        finished (bool): True if the program has finished its work.
+    """
+
+    while conn.poll(timeout): # Checks for sent data
+        timeout = 0 # Only waits for the first message
+        key, value = conn.recv() # Retrieves updated data
+
+        if key == "timing":
+            metrics.record(*value)
+            continue
+        if key == "count":
+            metrics.count(value)
+            continue
+        if key == "sample":
+            metrics.sample(*value)
+            continue
+        if key == "total":
+            metrics.mark_completed()
+
+        stats[key] = value # Updates stats
+        if value in FINISH_MESSAGES:
+            return True
+
+    return False
+
 def tui(tui_at_conn, tui_vs_conn, test_stats: dict, scan_stats: dict):
     """
     Displays program statistics in a TUI (Text-based User Interface)
@@ -128,30 +189,32 @@ def tui(tui_at_conn, tui_vs_conn, test_stats: dict, scan_stats: dict):
     finished = [False, False] # I - APK tester, II - Virus scanner
     status_message = Text("Press 'q' on keyboard to quit early.", style = "bold cyan")
 
-    with Live("", refresh_per_second = 10) as live:
+    # Performance data (raw timings are appended to a file)
+    timing_log = TimingLog(TIMINGS_FILE)
+    test_metrics = PipelineMetrics("test", THROUGHPUT_WINDOW, timing_log)
+    scan_metrics = PipelineMetrics("scan", THROUGHPUT_WINDOW, timing_log)
+
+    # Metrics for monitoring (disabled by default)
+    exporter = MetricsExporter(METRICS_HOST, METRICS_PORT, METRICS_FILE)
+    exporter.start()
+    last_export = 0
+
+    # Refreshed by the loop (no auto-refresh thread), so the rich rendering is part of the profiled stage
+    with Live("", auto_refresh = False) as live:
         while finished[0] == False or finished[1] == False:
             # 'q' key is pressed, requesting early exit
             if user_triggered.is_set():
                 quit_flag.value = True
                 status_message = Text("Quit request acknowledged. Waiting for programs to finish their current work...", style = "bold cyan")
 
-            # APK Tester
-            if not finished[0]:
-                if tui_at_conn.poll(0.5): # Checks for sent data
-                    key, value = tui_at_conn.recv() # Retrieves updated data
-                    if value == "Finished testing all APKs." or value == "Exited early due to user request.":
-                        finished[0] = True
-
-                    test_stats[key] = value # Updates test stats
+            with profile_stage("tui_receive"):
+                # APK Tester
+                if not finished[0]:
+                    finished[0] = receive_updates(tui_at_conn, test_stats, test_metrics, 0.25)
 
-            # Virus Scanner
-            if not finished[1]:
-                if tui_vs_conn.poll(0.5):
-                    key, value = tui_vs_conn.recv()
-                    if value == "Finished scanning all APKs." or value == "Exited early due to user request.":
-                        finished[1] = True
-
-                    scan_stats[key] = value # Updates scan stats
+                # Virus Scanner
+                if not finished[1]:
+                    finished[1] = receive_updates(tui_vs_conn, scan_stats, scan_metrics, 0.25)
 
             # Updates status message when programs are finished
             if finished[0] == True and finished[1] == True:
@@ -160,13 +223,25 @@ def tui(tui_at_conn, tui_vs_conn, test_stats: dict, scan_stats: dict):
                 else: # Programs finished their work
                     status_message = Text("Finished testing and scanning applications.", style = "bold cyan")
 
-            live.update(Group(Columns([make_test_table(test_stats), make_scan_table(scan_stats)]), status_message))
+            with profile_stage("tui_render"):
+                live.update(Group(Columns([make_test_table(test_stats), make_scan_table(scan_stats)]), 
+                                  make_perf_table(test_metrics, scan_metrics, test_stats, scan_stats), 
+                                  status_message))
+                live.refresh()
+
+            # Exports metrics for monitoring
+            if (METRICS_PORT or METRICS_FILE) and time.time() - last_export >= METRICS_INTERVAL:
+                with profile_stage("metrics_export"):
+                    exporter.update(render_prometheus([("test", test_stats, test_metrics, max(0, MAX_APK_NB_TA - test_stats["counter"] + 1)), 
+                                                       ("scan", scan_stats, scan_metrics, max(0, MAX_APK_NB_VS - scan_stats["counter"] + 1))], VT_DAILY_QUOTA))
+                last_export = time.time()
             sleep(0.5)
+
+    timing_log.close()
+    exporter.close()
     
     # Saves stats in a .txt file
-    with open(STATS_FILE, "w") as f:
-        f.write(f"{test_stats}\n" + 
-        f"{scan_stats}")
+    save_stats(test_stats, scan_stats)
 
 # ////////////////////////////////////
 # ///////// ENTRY POINT MAIN /////////
@@ -196,8 +271,8 @@ if __name__ == "__main__":
     test_stats, scan_stats = init_stats()
 
     # Creates the child processes and starts them
-    ta = mp.Process(target = ta_main, args = (test_stats, at_conn, quit_flag))
-    vs = mp.Process(target = vs_main, args = (scan_stats, vs_conn, quit_flag))
+    ta = mp.Process(target = ta_main, args = (test_stats, at_conn, quit_flag, WorkRange(test_stats["counter"], MAX_APK_NB_TA)))
+    vs = mp.Process(target = vs_main, args = (scan_stats, vs_conn, quit_flag, WorkRange(scan_stats["counter"], MAX_APK_NB_VS)))
     ta.start()
     vs.start()
 
@@ -1,11 +1,21 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import time
 import requests
-from downloader import download_apk
+from datetime import datetime, timezone, timedelta
+from downloader import download_apk, retrieve_entry, get_apk_size
 from scan_db_manager import db_main
-from config import API_KEY, API_SCAN_URL, API_REPORT_URL, MAX_ATTEMPT, COOLDOWN, MAX_APK_NB_VS
+from metrics import stage_timer
+from work_queue import WorkRange, RetryQueue
+from workspace import Workspace
+from hash_index import HashIndex
+from errors import TransientError, EndOfDataError
+from config import API_KEY, API_SCAN_URL, API_REPORT_URL, MAX_ATTEMPT, COOLDOWN, CSV_LABEL_MAX_AGE_DAYS, SKIP_DUPLICATES
+from config import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from config import LABEL_SUSPICIOUS_MIN, LABEL_MALICIOUS_MIN, LABEL_ENGINES, STORE_VT_REPORTS
+from vt_reports import count_positives
 
 def check_scan(sha256_hash: str):
     """
@@ -20,31 +30,38 @@ def check_scan(sha256_hash: str):
         sha256_hash (str): SHA-256 hash of the APK.
     Returns:
         response (JSON object): Response in Pickle format.
+    Raises:
+        TransientError: If the request fails or VirusTotal answers with a server error.
     """
 
     connection.send(("current", "Checking if the file has\nalready been scanned before..."))
     cur_attempt = 0
     while cur_attempt < MAX_ATTEMPT:
         try:
+            connection.send(("count", "vt_request"))
             response = requests.get(API_REPORT_URL, params = {'apikey': API_KEY, 'resource': sha256_hash}, timeout = 10)
 
             # 4 requests per minute limit is reached
             if response.status_code == 204:
+                connection.send(("count", "vt_rate_limited"))
                 connection.send(("current", "4 requests per minute limit hit.\nWaiting before retrying..."))
                 time.sleep(COOLDOWN)
                 cur_attempt += 1
                 continue
 
-            # HTTP error
+            # Server error (temporary)
+            if response.status_code >= 500:
+                raise TransientError(f"ERROR: HTTP error {response.status_code} from Virus Total.")
+
+            # Client error (e.g. wrong API key)
             if response.status_code != 200:
                 connection.send(("current", f"HTTP error {response.status_code}: {response.text}"))
                 sys.exit(1)
 
             connection.send(("current", "File has been already scanned.\nWriting down results..."))
             return response.json()
-        except requests.RequestException as e:
-            connection.send(("current", f"ERROR: Request to Virus Total failed: {e}"))
-            sys.exit(1)
+        except (requests.RequestException, ValueError) as e: # ValueError: response isn't JSON
+            raise TransientError(f"ERROR: Request to Virus Total failed: {e}")
     
     # 500 requests per day limit is reached
     connection.send(("current", "ERROR: Maximum number of requests per day\nto VirusTotal has been reached. Quitting."))
@@ -58,16 +75,19 @@ def upload_file(apk_path: str):
         apk_path (str): Path to APK file.
     Returns:
         response (JSON object): Response in Pickle format.
+    Raises:
+        TransientError: If the upload fails.
     """
 
     connection.send(("current", "File not found in Virus Total.\nUploading for scan..."))
     try:
         with open(apk_path, 'rb') as f:
-            files = {'file': (apk_path, f)}
+            files = {'file': (os.path.basename(apk_path), f)}
+            connection.send(("count", "vt_request"))
             response = requests.post(API_SCAN_URL, files = files, params = {'apikey': API_KEY}, timeout = 30)
             return response.json()
     except Exception as e:
-        raise RuntimeError(f"ERROR: Upload failed: {e}")
+        raise TransientError(f"ERROR: Upload failed: {e}")
 
 def scan_file(scan_id: str):
     """
@@ -77,26 +97,58 @@ def scan_file(scan_id: str):
         scan_id (str): Scan ID.
     Returns:
         result (JSON object): Scan results.
+    Raises:
+        TransientError: If a request fails or the results aren't ready in time.
     """
 
     connection.send(("current", "Waiting for scan results..."))
     for _ in range(12):  # Waits 60 seconds
         try:
             time.sleep(5)
+            connection.send(("count", "vt_request"))
             poll_response = requests.get(API_REPORT_URL, params = {'apikey': API_KEY, 'resource': scan_id}, timeout = 10)
             report = poll_response.json()
             
             if report.get("response_code") == 1: # Scan completed
                 return report
         except Exception as e:
-            raise RuntimeError(f"ERROR: in scan_file: {e}")
+            raise TransientError(f"ERROR: in scan_file: {e}")
     else:
-        connection.send(("current", "ERROR: Timed out waiting for scan results."))
-        sys.exit(1)
+        raise TransientError("ERROR: Timed out waiting for scan results.")
+
+def get_csv_report(entry: dict) -> dict | None:
+    """
+    Reads the detection count that AndroZoo stores in 'latest.csv' (from an earlier VirusTotal scan).
+
+    Args:
+        entry (dict): Row of the APK in 'latest.csv'.
+    Returns:
+        One_of_Two:
+            - **report** (dict): Number of positives and scan date, if the count is recent enough.
+            - **None**: If the count is missing or older than CSV_LABEL_MAX_AGE_DAYS.
+    """
+
+    if CSV_LABEL_MAX_AGE_DAYS <= 0:
+        return None
+
+    detection = entry.get("vt_detection", "").strip()
+    scan_date = entry.get("vt_scan_date", "").strip()
+    if not detection or not scan_date:
+        return None
+
+    try:
+        positives = int(detection)
+        scanned = datetime.fromisoformat(scan_date).replace(tzinfo = timezone.utc)
+    except ValueError:
+        return None
+
+    if datetime.now(timezone.utc) - scanned > timedelta(days = CSV_LABEL_MAX_AGE_DAYS):
+        return None # Stale: the APK is scanned again
+    return {"positives": positives, "scan_date": scan_date}
 
 def get_label(positives: int) -> str:
     """
-    Marks an application based on the scan results.
+    Marks an application based on the scan results (thresholds of the [Labels] section of 'config.ini').
 
     Args:
         positives (int): Number of engines that marked the apk as malicious.
@@ -104,9 +156,9 @@ def get_label(positives: int) -> str:
         label (str): App label.
     """
 
-    if positives == 0:
+    if positives < LABEL_SUSPICIOUS_MIN:
         return "BENIGN"
-    elif positives <= 2:
+    elif positives < LABEL_MALICIOUS_MIN:
         return "SUSPICIOUS"
     else:
         return "MALICIOUS"
@@ -116,62 +168,140 @@ def get_label(positives: int) -> str:
 # ////////////////////////////////////
 connection = None
 
-def vs_main(stats, conn, quit_flag: bool):
+def vs_main(stats, conn, quit_flag: bool, work: WorkRange, worker_id: int = 0):
     # Making the connection global to all functions
     global connection
     connection = conn
 
-    while stats["counter"] <= MAX_APK_NB_VS:
-        try:
+    # Every worker downloads to its own scratch directory (tmpfs if there is room)
+    workspace = Workspace("scan", worker_id)
+
+    # Hashes already scanned (loaded from the database)
+    index = None
+    if SKIP_DUPLICATES:
+        with stage_timer(connection, "index_load"):
+            index = HashIndex("scan")
+
+    # APKs that failed with a temporary error, tried again later
+    retries = RetryQueue(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+    end_of_data = False # True once an APK number is past the end of 'latest.csv' (only retries are left)
+
+    try:
+        while True:
             # Checks if the quit flag is triggered
             if quit_flag.value == True:
-                connection.send(("counter", stats["counter"])) # Sends the stats["counter"] to save it
+                resume = min(work.peek(), retries.lowest()) if retries else work.peek()
+                connection.send(("counter", resume)) # Sends the "counter" to save it
                 connection.send(("current", "Exited early due to user request."))
                 break
 
-            # Retrieves the APK file from input
-            apk_path = "scan.apk"
-            sha256_hash = download_apk(stats["counter"], apk_path, connection)
-
-            # Checks if the file is already scanned in VirusTotal
-            result = check_scan(sha256_hash)
-
-            # File is not scanned
-            if result.get("response_code") != 1:
-                # Uploads the file for scanning
-                upload_result = upload_file(apk_path)
-                scan_id = upload_result.get("scan_id")
-                if not scan_id:
-                    connection.send(("current", "ERROR: Failed to get scan ID."))
-                    sys.exit(1)
+            # Takes an APK due for a retry or the next APK
+            app_number = retries.claim(None if end_of_data else work)
+            if app_number is None:
+                if not retries: # All APKs are scanned
+                    break
+                time.sleep(min(1, retries.wait_time())) # Waits for the next retry
+                continue
+            stats["counter"] = app_number
+            # APK in progress (resume point, APKs waiting for a retry are not passed)
+            connection.send(("counter", min(app_number, retries.lowest()) if retries else app_number))
+
+            apk_path = None
+            try:
+                # Retrieves the row of the APK (hash and AndroZoo's detection count)
+                with stage_timer(connection, "hash_lookup"):
+                    entry = retrieve_entry(app_number)
+                sha256_hash = entry["sha256"]
+
+                # Hash already scanned (duplicate row or overlapping range)
+                if index is not None and sha256_hash in index:
+                    connection.send(("count", "duplicate_skip"))
+                    connection.send(("current", f"File {app_number} was already scanned. Skipped."))
+                    continue
+
+                # Recent detection count in 'latest.csv': no download and no VirusTotal request.
+                # Not used with an engine subset (AndroZoo only stores the count of all engines)
+                csv_report = get_csv_report(entry) if not LABEL_ENGINES else None
+                if not LABEL_ENGINES:
+                    connection.send(("count", "csv_label_hit" if csv_report else "csv_label_miss"))
+                if csv_report:
+                    connection.send(("current", f"Detection count of file {app_number}\nfound in 'latest.csv'."))
+                    positives = csv_report["positives"]
+                    total = None # Not stored by AndroZoo
+                    label_source = "androzoo"
+                    label = get_label(positives)
+                    report = None
+                else:
+                    # Retrieves the APK file from input (tmpfs or disk depending on the free room)
+                    apk_path, storage = workspace.path("scan.apk", get_apk_size(entry))
+                    connection.send(("count", f"scratch_{storage}"))
+                    download_apk(app_number, apk_path, connection, sha256_hash, get_apk_size(entry))
+
+                    # Checks if the file is already scanned in VirusTotal
+                    with stage_timer(connection, "vt_lookup"):
+                        result = check_scan(sha256_hash)
+
+                    # File is not scanned
+                    connection.send(("count", "vt_report_hit" if result.get("response_code") == 1 else "vt_report_miss"))
+                    if result.get("response_code") != 1:
+                        # Uploads the file for scanning
+                        with stage_timer(connection, "vt_upload"):
+                            upload_result = upload_file(apk_path)
+                        scan_id = upload_result.get("scan_id")
+                        if not scan_id:
+                            raise TransientError("ERROR: Failed to get scan ID.")
+                        
+                        # Waits for scan results and retrieves them
+                        with stage_timer(connection, "vt_poll"):
+                            result = scan_file(scan_id)
                     
-                # Waits for scan results and retrieves them
-                result = scan_file(scan_id)
-                
-            positives = result.get("positives", 0)
-            total = result.get("total", 0)
-            label = get_label(positives)
-
-            # Updates stats
-            stats[label.lower()] += 1
-            connection.send((label.lower(), stats[label.lower()]))
-            stats["total"] += 1
-            connection.send(("total", stats["total"]))
-
-            scan_data = {
-                "sha256_hash": sha256_hash,
-                "scan_label": label,
-                "positives": positives,
-                "total_engines": total,
-            }
-
-            # Updates the database
-            db_main(scan_data, connection)
-        except RuntimeError as e:
-            connection.send(("current", e))
-        finally:
-            stats["counter"] += 1
-    
-    connection.send(("counter", stats["counter"]))
+                    positives = result.get("positives", 0)
+                    total = result.get("total", 0)
+                    label_source = "virustotal"
+                    label = get_label(count_positives(result, LABEL_ENGINES))
+                    report = result if STORE_VT_REPORTS else None
+
+                # Updates stats
+                stats[label.lower()] += 1
+                connection.send((label.lower(), stats[label.lower()]))
+                stats["total"] += 1
+                connection.send(("total", stats["total"]))
+
+                scan_data = {
+                    "sha256_hash": sha256_hash,
+                    "scan_label": label,
+                    "positives": positives,
+                    "total_engines": total,
+                    "label_source": label_source,
+                    "report": report, # Full VirusTotal report (see vt_reports.py)
+                }
+
+                # Updates the database
+                with stage_timer(connection, "db_write"):
+                    db_main(scan_data, connection)
+                if index is not None:
+                    index.add(sha256_hash)
+            except TransientError as e:
+                if retries.add(app_number):
+                    connection.send(("count", "retry"))
+                    connection.send(("current", f"{e} File {app_number} will be tried again " +
+                                                f"({retries.failed_attempts(app_number)}/{RETRY_MAX_ATTEMPTS} attempts failed)."))
+                else:
+                    connection.send(("count", "give_up"))
+                    connection.send(("current", f"{e} Gave up on file {app_number} after {RETRY_MAX_ATTEMPTS} attempts."))
+            except EndOfDataError as e:
+                end_of_data = True
+                connection.send(("current", f"{e} No more APKs to scan."))
+            except RuntimeError as e:
+                connection.send(("current", e))
+            finally:
+                if apk_path is not None:
+                    workspace.remove(apk_path)
+    finally:
+        workspace.cleanup()
+        if index is not None:
+            index.close()
+
+    connection.send(("counter", work.peek()))
     connection.send(("current", "Finished scanning all APKs."))
     connection.close()
\ No newline at end of file
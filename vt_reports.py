@@ -0,0 +1,276 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+import zlib
+import numpy as np
+from analytics import create_tables as create_analytics_tables, record_relabel
+from config import LABEL_SUSPICIOUS_MIN, LABEL_MALICIOUS_MIN, LABEL_ENGINES
+
+LABELS = np.array(["BENIGN", "SUSPICIOUS", "MALICIOUS"])
+
+# Scan rows relabelled per transaction (the workers can write between batches)
+BATCH_SIZE = 10_000
+
+# A shared dictionary is trained from the first reports once there are this many
+DICTIONARY_SAMPLES = 64
+
+# zlib only looks this far back, a longer dictionary isn't used
+DICTIONARY_SIZE = 32 * 1024
+
+TABLES = [
+    "CREATE TABLE IF NOT EXISTS vt_reports (" +
+        "sha256_hash TEXT PRIMARY KEY," +
+        "dictionary_id INTEGER," + # 0: compressed without dictionary
+        "size INTEGER," + # Bytes of the uncompressed JSON
+        "report BLOB)",
+    "CREATE TABLE IF NOT EXISTS vt_report_dictionaries (" +
+        "id INTEGER PRIMARY KEY," +
+        "dictionary BLOB)",
+]
+
+def create_table(cursor):
+    """
+    Creates the tables of the raw VirusTotal reports if they don't exist.
+
+    Args:
+        cursor (any): Database cursor
+    """
+
+    for statement in TABLES:
+        cursor.execute(statement)
+
+def encode_report(report: dict) -> bytes:
+    # Same key order in every report, so the dictionary matches long runs of them
+    return json.dumps(report, sort_keys = True, separators = (",", ":")).encode()
+
+def compress(data: bytes, dictionary: bytes | None) -> bytes:
+    compressor = zlib.compressobj(9, zdict = dictionary) if dictionary else zlib.compressobj(9)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data: bytes, dictionary: bytes | None) -> bytes:
+    decompressor = zlib.decompressobj(zdict = dictionary) if dictionary else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+def build_dictionary(samples: list[bytes]) -> bytes:
+    """
+    Builds a shared dictionary from sample reports. zlib finds matches anywhere in the dictionary,
+    closest to its end for the shortest codes, so the most common engine entries go last.
+
+    Args:
+        samples (list[bytes]): Encoded reports (see encode_report).
+    Returns:
+        dictionary (bytes): At most DICTIONARY_SIZE bytes.
+    """
+
+    counts = {}
+    for sample in samples:
+        for part in sample.split(b"},"):
+            counts[part] = counts.get(part, 0) + 1
+
+    dictionary = b""
+    for part, _ in sorted(counts.items(), key = lambda item: item[1]):
+        dictionary = (dictionary + part + b"},")[-DICTIONARY_SIZE:]
+    return dictionary
+
+def train_dictionary(cursor, samples: int = DICTIONARY_SAMPLES) -> int:
+    """
+    Stores a new dictionary built from the latest stored reports. Later reports are compressed
+    with it, earlier ones keep theirs.
+
+    Returns:
+        dictionary_id (int): ID of the new dictionary.
+    """
+
+    dictionaries = load_dictionaries(cursor)
+    rows = cursor.execute("SELECT dictionary_id, report FROM vt_reports ORDER BY rowid DESC LIMIT ?", (samples,)).fetchall()
+    dictionary = build_dictionary([decompress(report, dictionaries.get(dictionary_id)) for dictionary_id, report in rows])
+    cursor.execute("INSERT INTO vt_report_dictionaries (dictionary) VALUES (?)", (dictionary,))
+    return cursor.lastrowid
+
+def load_dictionaries(cursor) -> dict:
+    """
+    Returns:
+        dictionaries (dict): Dictionary ID -> dictionary.
+    """
+
+    return dict(cursor.execute("SELECT id, dictionary FROM vt_report_dictionaries").fetchall())
+
+def store_report(cursor, sha256_hash: str, report: dict):
+    """
+    Stores the full VirusTotal report of a file, compressed with the latest dictionary
+    (in the transaction of the caller). The first dictionary is trained automatically.
+
+    Args:
+        cursor (any): Database cursor
+        sha256_hash (str): SHA-256 hash of the file
+        report (dict): Report returned by VirusTotal.
+    """
+
+    row = cursor.execute("SELECT id, dictionary FROM vt_report_dictionaries ORDER BY id DESC LIMIT 1").fetchone()
+    if row is None and cursor.execute("SELECT COUNT(*) FROM vt_reports").fetchone()[0] >= DICTIONARY_SAMPLES:
+        dictionary_id = train_dictionary(cursor)
+        row = (dictionary_id, load_dictionaries(cursor)[dictionary_id])
+    dictionary_id, dictionary = row or (0, None)
+
+    data = encode_report(report)
+    cursor.execute("INSERT OR REPLACE INTO vt_reports (sha256_hash, dictionary_id, size, report) VALUES (?, ?, ?, ?)",
+                   (sha256_hash, dictionary_id, len(data), compress(data, dictionary)))
+
+def load_report(cursor, sha256_hash: str) -> dict | None:
+    """
+    Returns:
+        One_of_Two:
+            - **report** (dict): Stored VirusTotal report of the file.
+            - **None**: If no report is stored for the hash.
+    """
+
+    row = cursor.execute("SELECT dictionary_id, report FROM vt_reports WHERE sha256_hash = ?", (sha256_hash,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(decompress(row[1], load_dictionaries(cursor).get(row[0])))
+
+def count_positives(report: dict, engines: list[str]) -> int:
+    """
+    Counts the engines that flag a file.
+
+    Args:
+        report (dict): VirusTotal report.
+        engines (list[str]): Engines that are counted (empty: all engines).
+    Returns:
+        positives (int): Number of these engines that detected the file.
+    """
+
+    if not engines:
+        return report.get("positives", 0)
+    scans = report.get("scans") or {}
+    return sum(1 for engine in engines if scans.get(engine, {}).get("detected"))
+
+def get_labels(positives: np.ndarray, suspicious_min: int, malicious_min: int) -> np.ndarray:
+    """
+    Labels many files at once from their detection counts (same rule as virus_scan.get_label).
+
+    Args:
+        positives (np.ndarray): Detection counts.
+        suspicious_min (int): Lowest count of a suspicious file.
+        malicious_min (int): Lowest count of a malicious file.
+    Returns:
+        labels (np.ndarray): 'BENIGN', 'SUSPICIOUS' or 'MALICIOUS' for every count.
+    """
+
+    return LABELS[(positives >= suspicious_min).astype(np.int8) + (positives >= malicious_min)]
+
+def relabel(connection, suspicious_min: int, malicious_min: int, engines: list[str], dry_run: bool = False) -> tuple[dict, int]:
+    """
+    Recomputes the label of every row of 'scan_results' with another policy, from the stored reports
+    (no VirusTotal request). The reports are only read if an engine subset is given: otherwise the
+    stored detection counts are enough. With an engine subset, rows without a report (labels from
+    'latest.csv', scans stored before the reports) are skipped, since their count covers all engines.
+    Changed labels are copied to 'apk_info' and 'label_by_sdk'.
+
+    Args:
+        connection (connection): Database connection
+        suspicious_min (int): Lowest count of a suspicious file.
+        malicious_min (int): Lowest count of a malicious file.
+        engines (list[str]): Engines that are counted (empty: all engines).
+        dry_run (bool): Only counts the changes.
+    Returns:
+        tuple:
+            - **transitions** (dict): (old label, new label) -> number of scan rows.
+            - **skipped** (int): Number of rows without a report that were skipped.
+    """
+
+    cursor = connection.cursor()
+    dictionaries = load_dictionaries(cursor)
+    reports = ("r.dictionary_id, r.report FROM scan_results s LEFT JOIN vt_reports r ON r.sha256_hash = s.sha256_hash"
+               if engines else "NULL, NULL FROM scan_results s")
+    transitions = {}
+    skipped = 0
+    position = 0
+
+    # Every batch is a short transaction (keyset pagination), so the workers can write between batches
+    while batch := cursor.execute(f"SELECT s.id, s.sha256_hash, s.positives, s.scan_label, {reports} " +
+                                  "WHERE s.id > ? ORDER BY s.id LIMIT ?", (position, BATCH_SIZE)).fetchall():
+        position = batch[-1][0]
+        positives = np.array([count_positives(json.loads(decompress(report, dictionaries.get(dictionary_id))), engines)
+                              if report is not None else (count if isinstance(count, int) and not engines else -1)
+                              for _, _, count, _, dictionary_id, report in batch])
+        if engines:
+            skipped += sum(1 for row in batch if row[5] is None)
+        labels = get_labels(positives, suspicious_min, malicious_min)
+
+        changed = [(scan_id, sha256_hash, old, str(new)) for (scan_id, sha256_hash, _, old, _, _), count, new
+                   in zip(batch, positives, labels) if count >= 0 and old != new]
+        for _, _, old, new in changed:
+            transitions[(old, new)] = transitions.get((old, new), 0) + 1
+        if dry_run or not changed:
+            continue
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.executemany("UPDATE scan_results SET scan_label = ? WHERE id = ?",
+                               [(new, scan_id) for scan_id, _, _, new in changed])
+            for scan_id, sha256_hash, old, new in changed:
+                record_relabel(cursor, scan_id, sha256_hash, old, new)
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    return transitions, skipped
+
+def print_stats(cursor):
+    reports, size, compressed = cursor.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(report)), 0) " +
+                                               "FROM vt_reports").fetchone()
+    print(f"Reports: {reports}")
+    print(f"Size: {size / 2**20:.1f} MB, compressed: {compressed / 2**20:.1f} MB " +
+          f"(ratio {size / max(compressed, 1):.1f}, {compressed / max(reports, 1):.0f} bytes per report)")
+    for dictionary_id, reports, size, compressed in cursor.execute(
+            "SELECT dictionary_id, COUNT(*), SUM(size), SUM(LENGTH(report)) FROM vt_reports GROUP BY dictionary_id"):
+        print(f"    dictionary {dictionary_id or 'none'}: {reports} reports, ratio {size / max(compressed, 1):.1f}")
+
+# ////////////////////////////////////
+# ///////// ENTRY POINT MAIN /////////
+# ////////////////////////////////////
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Relabels the scanned APKs of 'results.db' from the stored VirusTotal reports.")
+    parser.add_argument("--db", default = "results.db")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    relabel_parser = commands.add_parser("relabel", help = "Recomputes the scan labels with another policy (no VirusTotal request).")
+    relabel_parser.add_argument("--suspicious-min", type = int, default = LABEL_SUSPICIOUS_MIN, help = "Lowest detection count of a suspicious APK.")
+    relabel_parser.add_argument("--malicious-min", type = int, default = LABEL_MALICIOUS_MIN, help = "Lowest detection count of a malicious APK.")
+    relabel_parser.add_argument("--engines", default = ",".join(LABEL_ENGINES), help = "Comma-separated engines that are counted (empty: all).")
+    relabel_parser.add_argument("--dry-run", action = "store_true", help = "Prints the changes without saving them.")
+    commands.add_parser("train", help = "Trains a new compression dictionary from the latest reports.")
+    commands.add_parser("stats", help = "Number and compressed size of the stored reports.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    connection = sqlite3.connect(args.db)
+    cursor = connection.cursor()
+    create_table(cursor)
+
+    if args.command == "relabel":
+        if not 0 < args.suspicious_min <= args.malicious_min:
+            print("ERROR: Needs 0 < --suspicious-min <= --malicious-min.", file = sys.stderr)
+            sys.exit(2)
+        create_analytics_tables(cursor)
+        engines = [engine.strip() for engine in args.engines.split(",") if engine.strip()]
+        transitions, skipped = relabel(connection, args.suspicious_min, args.malicious_min, engines, args.dry_run)
+        for (old, new), rows in sorted(transitions.items()):
+            print(f"{old} -> {new}: {rows}")
+        print(f"{sum(transitions.values())} labels " + ("would change." if args.dry_run else "changed."))
+        if skipped:
+            print(f"{skipped} scans without a stored report were skipped (their detection count covers all engines).")
+    elif args.command == "train":
+        dictionary_id = train_dictionary(cursor)
+        connection.commit()
+        print(f"Dictionary {dictionary_id} is used for the next reports.")
+    else:
+        print_stats(cursor)
+
+    connection.close()
+    print(f"\nDone in {time.time() - start_time:.1f}s.", file = sys.stderr)
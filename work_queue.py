@@ -0,0 +1,317 @@
+import heapq
+import multiprocessing as mp
+import signal
+import time
+from array import array
+from bisect import bisect_left
+from stats_manager import StatsAggregator
+
+class WorkRange:
+    """
+    Hands out APK numbers (rows of 'latest.csv') to the worker processes of a program.\n
+    The next number is kept in shared memory, so several workers never test or scan the same APK.
+    """
+
+    def __init__(self, first: int, last: int):
+        """
+        Args:
+            first (int): First APK number.
+            last (int): Last APK number (included).
+        """
+
+        self.next_number = mp.Value('i', first)
+        self.last = last
+
+    def claim(self) -> int | None:
+        """
+        Takes the next APK number.
+
+        Returns:
+            One_of_Two:
+                - **app_number** (int): Number of the APK to process.
+                - **None**: If all APKs of the range are taken.
+        """
+
+        with self.next_number.get_lock():
+            app_number = self.next_number.value
+            if app_number > self.last:
+                return None
+            self.next_number.value += 1
+            return app_number
+
+    def peek(self) -> int:
+        """
+        Returns:
+            app_number (int): Next APK number that hasn't been taken yet.
+        """
+
+        return self.next_number.value
+
+    def remaining(self, counter: int) -> int:
+        """
+        Returns:
+            count (int): Number of APKs from 'counter' (APK in progress) to the end of the range.
+        """
+
+        return max(0, self.last - counter + 1)
+
+class WorkList:
+    """
+    Hands out the APK numbers of a work list (e.g. written by 'corpus.py select') to the worker
+    processes of a program. It has the same interface as WorkRange; the position in the list
+    is kept in shared memory.
+    """
+
+    def __init__(self, numbers: list[int], first: int = 1):
+        """
+        Args:
+            numbers (list[int]): APK numbers in increasing order.
+            first (int): Lowest APK number to process (skips the numbers below it, e.g. to resume).
+        """
+
+        self.numbers = array("l", sorted(number for number in set(numbers) if number >= first))
+        self.position = mp.Value('i', 0)
+        self.last = self.numbers[-1] if self.numbers else 0
+
+    def claim(self) -> int | None:
+        """
+        Takes the next APK number.
+
+        Returns:
+            One_of_Two:
+                - **app_number** (int): Number of the APK to process.
+                - **None**: If all APKs of the list are taken.
+        """
+
+        with self.position.get_lock():
+            if self.position.value >= len(self.numbers):
+                return None
+            app_number = self.numbers[self.position.value]
+            self.position.value += 1
+            return app_number
+
+    def peek(self) -> int:
+        """
+        Returns:
+            app_number (int): Next APK number that hasn't been taken yet ('last' + 1 if there is none).
+        """
+
+        position = self.position.value
+        return self.numbers[position] if position < len(self.numbers) else self.last + 1
+
+    def remaining(self, counter: int) -> int:
+        """
+        Returns:
+            count (int): Number of APKs of the list from 'counter' (APK in progress) to the end.
+        """
+
+        return len(self.numbers) - bisect_left(self.numbers, counter)
+
+class RetryQueue:
+    """
+    APKs of a worker that failed with a temporary error (TransientError). They are tried again
+    after an exponential backoff, while the worker goes on with other APKs, until their attempts
+    run out.
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        """
+        Args:
+            max_attempts (int): Attempts of an APK before it is given up (the first one included).
+            base_delay (float): Time in seconds before the second attempt (doubled after every attempt).
+            max_delay (float): Longest time in seconds between two attempts.
+        """
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts = {} # APK number -> number of failed attempts
+        self.pending = [] # Heap of (time when the APK is due, APK number)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, app_number: int) -> bool:
+        """
+        Records a failed attempt of an APK and schedules the next one.
+
+        Returns:
+            True/False (bool): True if the APK will be tried again, False if it's given up.
+        """
+
+        attempts = self.attempts.get(app_number, 0) + 1
+        self.attempts[app_number] = attempts
+        if attempts >= self.max_attempts:
+            return False
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        heapq.heappush(self.pending, (time.time() + delay, app_number))
+        return True
+
+    def failed_attempts(self, app_number: int) -> int:
+        """
+        Returns:
+            attempts (int): Number of failed attempts of the APK.
+        """
+
+        return self.attempts.get(app_number, 0)
+
+    def claim(self, work: WorkRange | WorkList | None) -> int | None:
+        """
+        Takes an APK that is due to be tried again, otherwise the next APK of the work.
+
+        Args:
+            work (WorkRange | WorkList | None): APKs of the program (None: only the retries, e.g.
+                after the end of 'latest.csv').
+        Returns:
+            One_of_Two:
+                - **app_number** (int): Number of the APK to process.
+                - **None**: If all APKs are taken and no retry is due yet.
+        """
+
+        if self.pending and self.pending[0][0] <= time.time():
+            return heapq.heappop(self.pending)[1]
+        return work.claim() if work is not None else None
+
+    def wait_time(self) -> float:
+        """
+        Returns:
+            seconds (float): Time until the next retry is due (0 if one is due).
+        """
+
+        return max(0.0, self.pending[0][0] - time.time()) if self.pending else 0.0
+
+    def lowest(self) -> int | None:
+        """
+        Returns:
+            app_number (int | None): Lowest APK number waiting for a retry (the resume point must not pass it).
+        """
+
+        return min(app_number for _, app_number in self.pending) if self.pending else None
+
+def read_work_list(path: str) -> list[int]:
+    """
+    Reads a work list file: one APK number per line (empty lines and '#' comments are skipped).
+    """
+
+    with open(path) as f:
+        return [int(line.split("#")[0]) for line in f if line.split("#")[0].strip()]
+
+def run_worker(target, *args):
+    """
+    Runs a worker process. The worker ignores SIGINT and SIGTERM, so that it can finish
+    its current APK; it is stopped through its quit flag by the parent process instead.
+
+    Args:
+        target (function): Main function of the program (ta_main or vs_main).
+        args (tuple): Arguments of the main function.
+    """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    target(*args)
+
+class WorkerPool:
+    """
+    Runs the worker processes of a program. All workers take APKs from the same range
+    and their stats are merged into the stats of the program.
+    """
+
+    def __init__(self, name: str, target, stats: dict, work: WorkRange | WorkList):
+        """
+        Args:
+            name (str): Name of the program ("test" or "scan").
+            target (function): Main function of the program (ta_main or vs_main).
+            stats (dict): Stats of the program (updated in place).
+            work (WorkRange | WorkList): APK numbers to process.
+        """
+
+        self.name = name
+        self.target = target
+        self.stats = stats
+        self.work = work
+        self.aggregator = StatsAggregator(stats)
+        self.workers = {} # Worker ID -> (process, connection, quit flag)
+        self.failed = False # True if a worker exited with an error
+
+    def start_worker(self) -> int:
+        """
+        Starts a new worker process.
+
+        Returns:
+            worker_id (int): ID of the worker.
+        """
+
+        # Reuses the lowest free ID (it also selects the emulator port of the worker)
+        worker_id = 0
+        while worker_id in self.workers:
+            worker_id += 1
+
+        parent_conn, child_conn = mp.Pipe()
+        quit_flag = mp.Value('b', False)
+        self.aggregator.add_worker(worker_id)
+        process = mp.Process(target = run_worker, 
+                             args = (self.target, dict(self.stats), child_conn, quit_flag, self.work, worker_id))
+        process.start()
+        child_conn.close() # Only the worker writes to it
+
+        self.workers[worker_id] = (process, parent_conn, quit_flag)
+        return worker_id
+
+    def stop_worker(self, worker_id: int):
+        """
+        Asks a worker to stop after its current APK.
+        """
+
+        self.workers[worker_id][2].value = True
+
+    def retire_worker(self):
+        """
+        Asks the newest running worker to stop after its current APK.
+        """
+
+        running = [worker_id for worker_id, (_, _, quit_flag) in self.workers.items() if not quit_flag.value]
+        if running:
+            self.stop_worker(max(running))
+
+    def active_workers(self) -> int:
+        """
+        Returns:
+            count (int): Number of workers that aren't stopping.
+        """
+
+        return sum(1 for _, _, quit_flag in self.workers.values() if not quit_flag.value)
+
+    def stop(self):
+        """
+        Asks all workers to stop after their current APK.
+        """
+
+        for worker_id in self.workers:
+            self.stop_worker(worker_id)
+
+    def terminate(self):
+        """
+        Kills all workers immediately.
+        """
+
+        for process, _, _ in self.workers.values():
+            process.kill() # Workers ignore SIGTERM
+
+    def connections(self) -> dict:
+        """
+        Returns:
+            connections (dict): Pipe connection -> worker ID of all running workers.
+        """
+
+        return {conn: worker_id for worker_id, (_, conn, _) in self.workers.items()}
+
+    def remove_worker(self, worker_id: int):
+        """
+        Cleans up a worker whose pipe was closed (the worker has exited).
+        """
+
+        process, conn, _ = self.workers.pop(worker_id)
+        conn.close()
+        process.join()
+        if process.exitcode != 0:
+            self.failed = True
@@ -0,0 +1,98 @@
+import os
+import shutil
+from config import SCRATCH, SCRATCH_TMPFS_DIR, SCRATCH_DISK_DIR, SCRATCH_MIN_FREE_MB
+
+PREFIX = "apk-observer-"
+
+def remove_stale(root: str):
+    """
+    Removes the scratch directories of worker processes that no longer exist (e.g. killed workers),
+    so that they don't keep using RAM in tmpfs.
+
+    Args:
+        root (str): Directory that contains scratch directories.
+    """
+
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            pid = int(name.rsplit("-", 1)[1])
+            os.kill(pid, 0) # Only checks if the process exists
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(root, name), ignore_errors = True)
+        except PermissionError: # Process of another user
+            continue
+
+class Workspace:
+    """
+    Scratch directory of a worker for downloaded APKs.\n
+    Files go to tmpfs (SCRATCH_TMPFS_DIR, usually '/dev/shm') when there is room for them, so that
+    downloads, aapt, zip reads and installs don't touch the project disk; otherwise they go to
+    SCRATCH_DISK_DIR. The directories are removed by 'cleanup' (or at the end of a 'with' block).
+    """
+
+    def __init__(self, pipeline: str, worker_id: int):
+        """
+        Args:
+            pipeline (str): Name of the program ('test' or 'scan').
+            worker_id (int): ID of the worker.
+        """
+
+        name = f"{PREFIX}{pipeline}-{worker_id}-{os.getpid()}"
+        self.tmpfs_dir = None
+        if SCRATCH in ("auto", "tmpfs") and os.path.isdir(SCRATCH_TMPFS_DIR):
+            remove_stale(SCRATCH_TMPFS_DIR)
+            self.tmpfs_dir = os.path.join(SCRATCH_TMPFS_DIR, name)
+            os.makedirs(self.tmpfs_dir, exist_ok = True)
+        remove_stale(SCRATCH_DISK_DIR)
+        self.disk_dir = os.path.join(SCRATCH_DISK_DIR, name)
+        os.makedirs(self.disk_dir, exist_ok = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def path(self, name: str, size: int | None = None) -> tuple[str, str]:
+        """
+        Chooses where a file is written.
+
+        Args:
+            name (str): File name.
+            size (int): Expected size of the file in bytes (None if unknown).
+        Returns:
+            result (tuple[str, str]): Path of the file and storage ('tmpfs' or 'disk').
+        """
+
+        if self.tmpfs_dir is not None:
+            # Room for the file and its temporary copy during the download
+            needed = 2 * (size or 0) + SCRATCH_MIN_FREE_MB * 2**20
+            if SCRATCH == "tmpfs" or shutil.disk_usage(self.tmpfs_dir).free >= needed:
+                return os.path.join(self.tmpfs_dir, name), "tmpfs"
+        return os.path.join(self.disk_dir, name), "disk"
+
+    def remove(self, path: str):
+        """
+        Removes a file of the workspace (if it exists).
+        """
+
+        for file_path in (path, f"{path}.part"):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self):
+        """
+        Removes the scratch directories with all their files.
+        """
+
+        for directory in (self.tmpfs_dir, self.disk_dir):
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors = True)